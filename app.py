@@ -1,17 +1,24 @@
-import os, uuid, shutil
+import os, uuid
 import matplotlib.pyplot as plt
 import streamlit as st
 import pandas as pd
 import diatribe.el_audio as el_audio
 import diatribe.saved_dialogues as saved_dialogues
+import diatribe.sessions as sessions
+import diatribe.audio_server as audio_server
+import diatribe.timing as timing
+import diatribe.jobs as jobs
+import diatribe.audio_pool as audio_pool
 from dotenv import load_dotenv
 from streamlit_extras.stylable_container import stylable_container
-from diatribe.dialogues import Character, Dialogue, get_voice_id, export_dialogue, get_lines
+from diatribe.dialogues import Character, Dialogue, DialogueImportError, get_characters, get_dialogue, export_dialogue, get_dialogue_export, get_lines
 from diatribe.sidebar import create_sidebar
 from diatribe.saved_dialogues import create_saved_dialogues
 from diatribe.generate import create_dialogue_generation, create_continue_dialogue
 from diatribe.utils import log
-from diatribe.audio_edit import create_edit_dialogue_line, create_edit_diatribe
+from diatribe.audio_edit import create_edit_diatribe
+from diatribe.line_list import create_line_list
+from diatribe.workspace import get_session_workspace, SilentProgress, StreamlitProgress
 
 load_dotenv()
 plt.style.use('dark_background')
@@ -29,17 +36,28 @@ def show_final_audio() -> bool:
 
 if __name__ == "__main__":
   st.set_page_config(layout="wide", page_title="Diatribe", page_icon="🎧")
+  el_audio.build_default_library()
+  saved_dialogues.load_sample_projects()
   
   if "session_id" not in st.session_state:
     st.session_state["session_id"] = str(uuid.uuid4())  
     log("session id: " + st.session_state.session_id)
+  timing.start_rerun(st.session_state.session_id)
+  sessions.start_session_collector()
+  audio_server.start_audio_server()
+  jobs.start_job_workers()
+  sessions.touch_session(st.session_state.session_id)
   
   st.title("🎧 Diatribe")
   
-  sidebar = create_sidebar()
+  with timing.span("sidebar"):
+    sidebar = create_sidebar()
+  if sessions.enforce_session_quota(st.session_state.session_id):
+    st.warning("This session is using too much storage. Please clear the dialogue or remove audio before generating more.")
     
   if sidebar.el_key:
-    saves = create_saved_dialogues()    
+    with timing.span("saved_dialogues"):
+      saves = create_saved_dialogues()    
     
     st.header("Characters")
     if sidebar.enable_instructions:
@@ -56,14 +74,17 @@ if __name__ == "__main__":
         submit_dialogue_upload = st.form_submit_button("Import", use_container_width=True)
         if submit_dialogue_upload and dialogue_upload:
           uploaded_dialogue = dialogue_upload.getvalue()
-          saved_dialogues.convert_imported_dialogue(uploaded_dialogue)
-          if "audio_files" in st.session_state:
-            del st.session_state["audio_files"]
-          if "generated_dialogue" in st.session_state:
-            del st.session_state["generated_dialogue"]
-          if "final_audio" in st.session_state:
-            del st.session_state["final_audio"]
-          st.toast("The dialogue has been imported.", icon="👍")
+          try:
+            saved_dialogues.convert_imported_dialogue(uploaded_dialogue)
+            if "audio_files" in st.session_state:
+              del st.session_state["audio_files"]
+            if "generated_dialogue" in st.session_state:
+              del st.session_state["generated_dialogue"]
+            if "final_audio" in st.session_state:
+              del st.session_state["final_audio"]
+            st.toast("The dialogue has been imported.", icon="👍")
+          except DialogueImportError as e:
+            st.error(f"The dialogue could not be imported because of an error on {e}")
     
     if "imported_characters" in st.session_state:
       character_data = st.session_state["imported_characters"]     
@@ -106,23 +127,19 @@ if __name__ == "__main__":
   
   characters_available = not character_table.empty
   if characters_available:
-    characters: list[Character] = []
-    for _, row in character_table.iterrows():
-      c = Character(
-        row["Name"], 
-        row["Voice"], 
-        get_voice_id(row["Voice"], sidebar.voices),
-        description=row["Description"],
-        group=int(row["Group"]) if row["Group"] is not None else 1
-      )
-      characters.append(c)
+    with timing.span("characters"):
+      characters: list[Character] = get_characters(character_table, sidebar.voices)
     character_names = [character.name for character in characters]
     
     st.header("Dialogue")
     if sidebar.enable_instructions:
       st.markdown("This is where you write or generate the dialogue. The audio dialogue will use the model and voice settings defined in the sidebar. You can generate the audio multiple times, so click `Generate Audio Dialogue` as often as you would like.")    
       
-    generated_dialogue = create_dialogue_generation(sidebar, saves, characters)
+    # the dialogue table goes below the generation options, but streamed lines are shown in its place while they arrive
+    generation = st.container()
+    dialogue_slot = st.empty()
+    with generation:
+      generated_dialogue = create_dialogue_generation(sidebar, saves, characters, dialogue_slot)
         
     if generated_dialogue is not None: 
       st.session_state["generated_dialogue"] = generated_dialogue
@@ -134,7 +151,7 @@ if __name__ == "__main__":
     else:
       dialogue_df = pd.DataFrame([], columns=["Speaker", "Text"])
     
-    dialogue_table = st.data_editor(
+    dialogue_table = dialogue_slot.data_editor(
       dialogue_df,
       use_container_width=True,
       num_rows="dynamic",
@@ -157,16 +174,8 @@ if __name__ == "__main__":
     
     # extract Dialogues from the dialogue table
     if not dialogue_table.empty:
-      dialogue: list[Dialogue] = []
-      for i, row in dialogue_table.iterrows():
-        try:
-          character_index = character_names.index(row["Speaker"])
-          character = characters[character_index]
-          dialogue.append(Dialogue(character, i+1, row["Text"]))
-        except:
-          print(f"Error: {row['Speaker']} is not a valid character.")
-          pass        
-      dialogue.sort(key=lambda x: x.line)
+      with timing.span("dialogue"):
+        dialogue: list[Dialogue] = get_dialogue(dialogue_table, characters)
       
       with st.expander("Export Characters & Dialogue"):
         prepare_download_dialogue = st.button("Prepare Download", help="This will prepare the dialogue for download.", use_container_width=True)
@@ -185,7 +194,7 @@ if __name__ == "__main__":
       if sidebar.openai_api_key and not dialogue_table.empty:
         continue_btn = st.button("Continue Dialogue", use_container_width=True, help="This uses options set in `Dialogue Generation` to continue the dialogue.")
         if continue_btn:
-          generated_dialogue = create_continue_dialogue(sidebar, characters, dialogue)     
+          generated_dialogue = create_continue_dialogue(sidebar, characters, dialogue, dialogue_slot)     
           if generated_dialogue is not None: 
             st.session_state["generated_dialogue"] = generated_dialogue
             st.rerun()
@@ -201,27 +210,43 @@ if __name__ == "__main__":
         generate_btn = st.button("Generate Audio Dialogue", use_container_width=True, type="primary") 
 
       if generate_btn:
+        saved_dialogues.wait_for_imported_audio()
         st.session_state["final_audio"] = False
-        el_audio.clear_audio_files()
-        audio_files: list[str] = []
-        progress_text = "Generating audio..."
         if "audio_process_error" in st.session_state:
           del st.session_state["audio_process_error"]
-        generate_audio_bar = st.progress(0, text=progress_text)
+      if generate_btn and jobs.get_job_queue() is not None:
+        # the worker clears the audio, so the lines are listed again once it has finished
+        if "audio_files" in st.session_state:
+          del st.session_state["audio_files"]
+        jobs.submit_session_job("synthesize", jobs.get_synthesis_payload(dialogue, sidebar), "synthesis_job")
+      synthesis_job = jobs.follow_session_job("synthesis_job")
+      if synthesis_job is not None:
+        audio_files = synthesis_job.result["audio_files"] if synthesis_job.result else []
+        if synthesis_job.state == "failed":
+          st.session_state["audio_process_error"] = synthesis_job.error
+        elif synthesis_job.result["error"]:
+          st.session_state["audio_process_error"] = synthesis_job.result["error"]
+        elif synthesis_job.result["missing_voice"]:
+          st.toast(f"Error: voice ID not found for `{synthesis_job.result['missing_voice']}`.", icon="👎")
+      elif generate_btn and jobs.get_job_queue() is None:
+        el_audio.clear_audio_files()
+        audio_files: list[str] = []
+        generate_audio_bar = StreamlitProgress("Generating audio...")
         for i, line in enumerate(dialogue):
           if line.character.voice_id is None:
             st.toast(f"Error: voice ID not found for `{line.character.voice}`.", icon="👎")
             break
           try:
-            audio_file = el_audio.generate_and_save(line.text, line.character.voice_id, line.line, sidebar) 
+            audio_file = el_audio.generate_and_save(line.text, line.character.voice_id, line.line, sidebar, on_wait=generate_audio_bar.wait)
             audio_files.append(audio_file)
           except Exception as e:
             print(e)
             st.session_state["audio_process_error"] = f"{line.character.name} with the voice {line.character.voice} (voice_id: {line.character.voice_id})"
             break
-          generate_audio_bar.progress(round((i+1) / len(dialogue), 2), text=progress_text)          
-        generate_audio_bar.empty()
+          generate_audio_bar.update((i+1) / len(dialogue))
+        generate_audio_bar.done()
         
+      if (generate_btn and jobs.get_job_queue() is None) or synthesis_job is not None:
         if "audio_process_error" in st.session_state:
           st.error(f"""An error occured while generating the audio. Please check your API key.
           Error occurred while processing: {st.session_state.audio_process_error}
@@ -232,12 +257,15 @@ if __name__ == "__main__":
           st.session_state["audio_files"] = audio_files
       
       if saves.prepare_project:
-        export_dialogue(character_table, dialogue_table, sidebar.voices)
-        export_path = el_audio.export_audio(get_lines(dialogue))
-        project_path = f"./session/{st.session_state.session_id}/project"
-        os.makedirs(project_path, exist_ok=True)
-        shutil.make_archive(f"{project_path}/project", "zip", export_path)
-        st.rerun()
+        saved_dialogues.wait_for_imported_audio()
+        dialogue_export = get_dialogue_export(character_table, dialogue_table, sidebar.voices)
+        saves.project_download.download_button(
+          label="Download", 
+          data=el_audio.export_project(dialogue_export, get_lines(dialogue)), 
+          file_name="project.zip", 
+          mime="application/zip",
+          use_container_width=True
+        )
       
       if "audio_files" in st.session_state:   
         # display generated audio
@@ -247,31 +275,8 @@ if __name__ == "__main__":
           with st.expander("**WARNING**: deleting dialogue lines requires audio regeneration"):
             st.info("If you delete dialogue lines, you will have to regenerate the audio by clicking the `Generate Audio Dialogue` button above. Adding or modifying dialogue lines will not require regeneration of all lines, but you will likely need to click the `Redo` button for the affected lines.")                 
         
-        for i, line in enumerate(dialogue):
-          st.markdown(f"`{i + 1}.` **:green[{line.character.name}]**: \"{line.text}\"")
-          
-          col1, col2 = st.columns([9, 1])
-          with col1:     
-            audio_file = f"./session/{st.session_state.session_id}/audio/line{line.line}.wav"
-            if os.path.exists(audio_file):     
-              with open(audio_file, "rb") as audio:  
-                st.audio(audio)
-                pass
-              audio_file_found = True
-            else:
-              st.markdown("Audio file not found. Please click the `Redo` button.")  
-              audio_file_found = False
-          with col2:
-            redo_key = f"redo_{line.line}"
-            redo_btn = st.button("Redo", key=redo_key)
-          if redo_btn:
-            with st.spinner("Generating audio..."):
-              el_audio.generate_and_save(line.text, line.character.voice_id, line.line, sidebar)
-            st.rerun()
-            
-          # dialogue audio editing
-          if audio_file_found and sidebar.enable_audio_editing:
-            create_edit_dialogue_line(line, audio_file)    
+        with timing.span("line_list"):
+          create_line_list(sidebar, dialogue)
       
       # join final audio
       if "audio_files" in st.session_state:
@@ -282,23 +287,51 @@ if __name__ == "__main__":
         ):        
           join_dialogue = st.button("Join Dialogue", use_container_width=True, type="primary")
         line_indices = [d.line for d in dialogue]
+        joined = False
         if join_dialogue:          
-          el_audio.join_audio(
-            line_indices
-          )
+          saved_dialogues.wait_for_imported_audio()
+          if jobs.get_job_queue() is not None:
+            st.session_state["final_audio"] = False
+            jobs.submit_session_job("join", {"workspace": get_session_workspace(), "lines": line_indices, "gap": 200}, "join_job")
+          elif audio_pool.is_pooled():
+            try:
+              with st.spinner("Joining audio..."):
+                audio_pool.run_audio_task(
+                  "join_audio",
+                  el_audio.join_audio,
+                  line_indices,
+                  workspace=get_session_workspace(),
+                  progress=SilentProgress
+                )
+              joined = True
+            except audio_pool.PoolBusyError as e:
+              st.warning(str(e))
+          else:
+            el_audio.join_audio(
+              line_indices
+            )
+            joined = True
+        join_job = jobs.follow_session_job("join_job")
+        if join_job is not None and join_job.state == "failed":
+          st.error(f"An error occured while joining the audio: {join_job.error}")
+        elif joined or join_job is not None:
+          if "background_added" in st.session_state:
+            del st.session_state["background_added"]
           st.session_state["final_audio"] = True
       
       # show final audio
       if show_final_audio():
+        saved_dialogues.wait_for_imported_audio()
         st.header("Audio Diatribe")
         if sidebar.enable_instructions:
           st.markdown("Here is the final dialogue with all the lines joined together. If you are unhappy about specific lines, then just click the `Redo` button on the line above and click `Join Dialogue` again.")        
         
         if sidebar.enable_audio_editing:
-          create_edit_diatribe(sidebar, characters, dialogue)
+          with timing.span("edit_diatribe"):
+            create_edit_diatribe(sidebar, characters, dialogue)
         
-        dialogue_path = f"./session/{st.session_state.session_id}/final/audio/dialogue.mp3"
-        st.audio(dialogue_path)
+        dialogue_path = get_session_workspace().final_dialogue_file()
+        audio_server.audio_player(dialogue_path, format="audio/mp3")
         _, fig = el_audio.generate_waveform_from_file(dialogue_path)       
         st.pyplot(fig)
           
@@ -315,4 +348,7 @@ if __name__ == "__main__":
               use_container_width=True,
               type="primary"
             )
-    
\ No newline at end of file
+  
+  timing.finish_rerun()
+  if sidebar.enable_performance:
+    timing.create_performance_panel()
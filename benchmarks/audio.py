@@ -0,0 +1,36 @@
+"""Synthetic audio shared by the benchmarks."""
+import os
+import numpy as np
+from pydub import AudioSegment as seg
+
+FRAME_RATE = 44100
+
+def synthesize_speech(seconds: float, rng: np.random.Generator) -> np.ndarray:
+  """Create speech-like audio: voiced syllables with a moving pitch and formant-ish harmonics, separated by short pauses."""
+  frames = int(seconds * FRAME_RATE)
+  t = np.arange(frames) / FRAME_RATE
+  f0 = rng.uniform(100, 220) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.2, 0.6) * t))
+  phase = 2 * np.pi * np.cumsum(f0) / FRAME_RATE
+  voice = sum(np.sin(h * phase) / h for h in range(1, 9))
+  syllables = np.clip(np.sin(2 * np.pi * rng.uniform(3.5, 5.5) * t), 0, None) ** 2
+  words = np.repeat(rng.random(frames // 4410 + 1) > 0.2, 4410)[:frames]
+  noise = rng.normal(0, 0.05, frames) * syllables
+  samples = (voice * 0.25 + noise) * syllables * words
+  return (np.clip(samples, -1, 1) * 32767 * 0.7).astype(np.int16)
+
+
+def synthesize_bed(seconds: float, rng: np.random.Generator) -> np.ndarray:
+  """Create a stereo ambient bed (filtered noise with a slow swell)."""
+  frames = int(seconds * FRAME_RATE)
+  noise = rng.normal(0, 1, (frames, 2))
+  noise = np.cumsum(noise, axis=0)
+  noise -= np.convolve(noise[:, 0], np.ones(441) / 441, mode="same")[:, None]
+  noise /= np.abs(noise).max() or 1
+  swell = 0.6 + 0.4 * np.sin(2 * np.pi * 0.1 * np.arange(frames) / FRAME_RATE)
+  return (noise * swell[:, None] * 32767 * 0.5).astype(np.int16)
+
+
+def write_wav(path: str, samples: np.ndarray) -> None:
+  channels = 1 if samples.ndim == 1 else samples.shape[1]
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  seg(samples.tobytes(), frame_rate=FRAME_RATE, sample_width=2, channels=channels).export(path, format="wav")
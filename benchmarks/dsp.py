@@ -0,0 +1,286 @@
+"""Offline benchmarks of the el_audio DSP pipeline.
+
+Run from the repository root:
+
+  python benchmarks/dsp.py --lines 10 50 200 --repeat 3 --compare benchmarks/results/<previous>.json
+
+Every case runs on synthetic speech-like dialogue of each length and on the projects in `./saves`.
+The results (time and peak traced memory) are stored in `benchmarks/results` so versions can be compared.
+"""
+import os, sys, json, time, uuid, glob, shutil, zipfile, argparse, platform, subprocess, tracemalloc
+from dataclasses import dataclass, field, asdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import matplotlib.pyplot as plt
+from pydub import AudioSegment as seg
+from pydub.utils import which
+import diatribe.el_audio as el_audio
+from diatribe.el_audio import Soundboard
+from diatribe.workspace import SilentProgress
+from diatribe.edits import *
+from benchmarks.audio import FRAME_RATE, synthesize_speech, synthesize_bed, write_wav
+
+RESULTS_PATH = "./benchmarks/results"
+
+@dataclass
+class BenchmarkConfig:
+  lines: list[int] = field(default_factory=lambda: [10, 50, 200])
+  repeat: int = 3
+  line_seconds: float = 3.0
+  projects: bool = True
+  seed: int = 7
+  output: str = None
+
+
+@dataclass
+class BenchmarkResult:
+  case: str
+  dataset: str
+  lines: int
+  audio_seconds: float
+  times: list[float] = field(default_factory=list)
+  median: float = None
+  best: float = None
+  peak_memory: int = None
+  skipped: str = None
+
+
+@dataclass
+class Dataset:
+  name: str
+  audio_path: str
+  lines: list[int]
+  dialogue: seg = None
+
+
+@dataclass
+class BenchmarkCase:
+  name: str
+  run: callable
+  setup: callable = None
+  needs_ffmpeg: bool = False
+
+
+def join_dataset(audio_path: str, lines: list[int], gap: int = 200) -> seg:
+  """Join the lines in memory (without ffmpeg for wav lines) as the input of the single dialogue cases."""
+  silence = seg.silent(gap, frame_rate=FRAME_RATE)
+  dialogue = None
+  for line in lines:
+    audio = seg.from_file(f"{audio_path}/line{line}.wav")
+    dialogue = audio if dialogue is None else dialogue + silence + audio
+  return dialogue
+
+
+def create_synthetic_dataset(work_path: str, line_count: int, config: BenchmarkConfig) -> Dataset:
+  rng = np.random.default_rng(config.seed + line_count)
+  audio_path = f"{work_path}/synthetic_{line_count}/audio"
+  lines = list(range(1, line_count + 1))
+  for line in lines:
+    write_wav(f"{audio_path}/line{line}.wav", synthesize_speech(config.line_seconds * rng.uniform(0.5, 1.5), rng))
+  return Dataset(f"synthetic_{line_count}", audio_path, lines)
+
+
+def create_project_dataset(work_path: str, project_file: str) -> Dataset:
+  name = os.path.splitext(os.path.basename(project_file))[0]
+  audio_path = f"{work_path}/{name}/audio"
+  os.makedirs(audio_path, exist_ok=True)
+  with zipfile.ZipFile(project_file) as package:
+    members = [m for m in package.namelist() if m.startswith("audio/line") and m.endswith(".wav")]
+    for member in members:
+      with open(f"{audio_path}/{os.path.basename(member)}", "wb") as f:
+        f.write(package.read(member))
+  lines = sorted(int(os.path.basename(m)[4:-4]) for m in members)
+  return Dataset(f"project:{name}", audio_path, lines)
+
+
+def create_cases(dataset: Dataset, work_path: str, bed_file: str) -> list[BenchmarkCase]:
+  dialogue = dataset.dialogue
+  final_path = f"{work_path}/final/audio"
+  master_path = f"{work_path}/master/audio"
+  normalize_path = f"{work_path}/normalize"
+  effects = sorted(glob.glob("./effects/*.wav"))[:3]
+  duration = dialogue.duration_seconds
+
+  basic = Soundboard([BasicEdit(volume=3, fade_in=500, fade_out=500, trim_in=100, trim_out=100, extend_in=200, extend_out=200)])
+  pedals = Soundboard([
+    CompressorEdit(threshold=-20, ratio=3, attack=10, release=100),
+    ReverbEdit(room_size=0.4, damping=0.5, wet_level=0.2, dry_level=0.8),
+    LimiterEdit(threshold=-1, release=250)
+  ])
+  special = Soundboard([
+    SpecialEffectEdit(el_audio.process_audio_file_name(e), e, volume=-3, start=duration * (i + 1) / (len(effects) + 1), repeat=2)
+    for i, e in enumerate(effects)
+  ])
+  background = BackgroundEdit(os.path.basename(bed_file), fade_in=True, fade_out=True, volume=10, duck=True, duck_amount=12)
+  master = Soundboard(basic.edits + pedals.edits[:1] + special.edits)
+  affected = dataset.lines[:max(1, len(dataset.lines) // 4)]
+
+  def reset(path: str) -> None:
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+  def prepare_normalize() -> None:
+    reset(normalize_path)
+    dialogue.export(f"{normalize_path}/dialogue.mp3", format="mp3")
+
+  def prepare_master() -> None:
+    reset(f"{work_path}/master/parts")
+    reset(master_path)
+
+  def run_waveform() -> None:
+    _, fig = el_audio.generate_waveform(dialogue)
+    plt.close(fig)
+
+  speech, bed, gain = el_audio.prepare_background(dialogue, bed_file, background)
+  return [
+    BenchmarkCase(
+      "join_audio",
+      lambda: el_audio.join_audio(dataset.lines, source_path=dataset.audio_path, destination_path=final_path, progress=SilentProgress),
+      needs_ffmpeg=True
+    ),
+    BenchmarkCase("apply_basic", lambda: el_audio.apply_basic(dialogue, basic)),
+    BenchmarkCase("apply_soundboard", lambda: el_audio.apply_soundboard(dialogue, pedals)),
+    BenchmarkCase("apply_special_effect", lambda: el_audio.apply_special_effect(dialogue, special)),
+    BenchmarkCase("prepare_background", lambda: el_audio.prepare_background(dialogue, bed_file, background)),
+    BenchmarkCase("mix_background", lambda: el_audio.mix_background(speech, bed, gain)),
+    BenchmarkCase(
+      "master_audio_parts",
+      lambda: el_audio.master_audio_parts(
+        affected,
+        dataset.lines,
+        master,
+        200,
+        f"{work_path}/master/parts",
+        dataset.audio_path,
+        f"{master_path}/dialogue.mp3"
+      ),
+      setup=prepare_master,
+      needs_ffmpeg=True
+    ),
+    BenchmarkCase("normalize_final_audio", lambda: el_audio.normalize_final_audio(normalize_path), setup=prepare_normalize, needs_ffmpeg=True),
+    BenchmarkCase("generate_waveform", run_waveform)
+  ]
+
+
+def measure(case: BenchmarkCase, dataset: Dataset, repeat: int) -> BenchmarkResult:
+  """Time the case `repeat` times and then run it once more while tracing the peak memory."""
+  result = BenchmarkResult(case.name, dataset.name, len(dataset.lines), round(dataset.dialogue.duration_seconds, 2))
+  if case.needs_ffmpeg and which("ffmpeg") is None:
+    result.skipped = "ffmpeg not found"
+    return result
+  for _ in range(repeat):
+    if case.setup:
+      case.setup()
+    start = time.perf_counter()
+    case.run()
+    result.times.append(time.perf_counter() - start)
+  if case.setup:
+    case.setup()
+  tracemalloc.start()
+  try:
+    case.run()
+    result.peak_memory = tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+  result.median = float(np.median(result.times))
+  result.best = min(result.times)
+  return result
+
+
+def get_git_revision() -> str:
+  try:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return "unknown"
+
+
+def run_suite(config: BenchmarkConfig) -> dict:
+  """Run every case on every dataset inside a benchmark session folder and return the results."""
+  session_id = f"benchmark-{uuid.uuid4()}"
+  work_path = f"./session/{session_id}/benchmark"
+  results = []
+  try:
+    bed_file = f"{work_path}/backgrounds/bed.wav"
+    write_wav(bed_file, synthesize_bed(30, np.random.default_rng(config.seed)))
+    datasets = [create_synthetic_dataset(work_path, n, config) for n in config.lines]
+    if config.projects:
+      datasets += [create_project_dataset(work_path, p) for p in sorted(glob.glob("./saves/*.zip"))]
+    for dataset in datasets:
+      try:
+        dataset.dialogue = join_dataset(dataset.audio_path, dataset.lines)
+      except Exception as e:
+        print(f"skipping {dataset.name}: {e}")
+        continue
+      for case in create_cases(dataset, f"{work_path}/{dataset.name.replace(':', '_')}", bed_file):
+        result = measure(case, dataset, config.repeat)
+        print(format_result(result))
+        results.append(result)
+  finally:
+    shutil.rmtree(f"./session/{session_id}", ignore_errors=True)
+  return {
+    "revision": get_git_revision(),
+    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "python": platform.python_version(),
+    "numpy": np.__version__,
+    "platform": platform.platform(),
+    "ffmpeg": which("ffmpeg") is not None,
+    "config": asdict(config),
+    "results": [asdict(r) for r in results]
+  }
+
+
+def format_result(result: BenchmarkResult) -> str:
+  name = f"{result.case:<24}{result.dataset:<26}{result.audio_seconds:>9.1f}s"
+  if result.skipped:
+    return f"{name}  skipped ({result.skipped})"
+  return f"{name}{result.median * 1000:>11.1f}ms{result.peak_memory / (1024 * 1024):>10.1f}MB"
+
+
+def compare_results(current: dict, baseline: dict) -> None:
+  """Print the change in median time and peak memory of every case also found in the baseline."""
+  previous = {(r["case"], r["dataset"]): r for r in baseline["results"] if not r["skipped"]}
+  print(f"\ncompared with {baseline['revision']} ({baseline['timestamp']})")
+  for r in current["results"]:
+    old = previous.get((r["case"], r["dataset"]))
+    if r["skipped"] or old is None:
+      continue
+    time_change = (r["median"] / old["median"] - 1) * 100 if old["median"] else 0
+    memory_change = (r["peak_memory"] / old["peak_memory"] - 1) * 100 if old["peak_memory"] else 0
+    flag = "  <- slower" if time_change > 10 else ""
+    print(f"{r['case']:<24}{r['dataset']:<26}{time_change:>+9.1f}% time{memory_change:>+9.1f}% memory{flag}")
+
+
+def save_results(results: dict, output: str = None) -> str:
+  output = output or f"{RESULTS_PATH}/{time.strftime('%Y%m%d-%H%M%S')}-{results['revision']}.json"
+  os.makedirs(os.path.dirname(output), exist_ok=True)
+  with open(output, "w") as f:
+    json.dump(results, f, indent=2)
+  return output
+
+
+def parse_args() -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description="Benchmark the el_audio DSP pipeline offline.")
+  parser.add_argument("--lines", type=int, nargs="+", default=[10, 50, 200], help="dialogue lengths (in lines) to synthesize")
+  parser.add_argument("--repeat", type=int, default=3, help="timed runs of every case")
+  parser.add_argument("--line-seconds", type=float, default=3.0, help="average length of a synthetic line")
+  parser.add_argument("--no-projects", action="store_true", help="skip the projects in ./saves")
+  parser.add_argument("--output", help="results file (defaults to benchmarks/results/<time>-<revision>.json)")
+  parser.add_argument("--compare", help="previous results file to compare with")
+  return parser.parse_args()
+
+
+def main() -> None:
+  args = parse_args()
+  config = BenchmarkConfig(args.lines, args.repeat, args.line_seconds, not args.no_projects, output=args.output)
+  results = run_suite(config)
+  output = save_results(results, config.output)
+  print(f"results saved to {output}")
+  if args.compare:
+    with open(args.compare) as f:
+      compare_results(results, json.load(f))
+
+
+if __name__ == "__main__":
+  main()
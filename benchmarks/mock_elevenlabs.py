@@ -0,0 +1,265 @@
+"""A local stand-in for the parts of the ElevenLabs API used by Diatribe.
+
+Run it on its own and point the app at it (the elevenlabs package reads ELEVEN_BASE_URL when it is imported):
+
+  python benchmarks/mock_elevenlabs.py --port 8765 --latency 300 --jitter 100 --error-rate 0.01 --max-concurrent 2
+  ELEVEN_BASE_URL=http://localhost:8765/v1 ELEVENLABS_API_KEY=mock streamlit run app.py
+"""
+import os, sys, io, re, json, time, random, argparse, threading
+from dataclasses import dataclass, field, asdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from pydub import AudioSegment as seg
+from benchmarks.audio import synthesize_speech, FRAME_RATE
+
+CHARACTERS_PER_SECOND = 15
+
+@dataclass
+class MockSettings:
+  latency: float = 300.0
+  per_character: float = 5.0
+  jitter: float = 100.0
+  error_rate: float = 0.0
+  max_concurrent: int = 0
+  requests_per_second: float = 0.0
+  voices: int = 12
+  seed: int = 7
+
+
+@dataclass
+class MockStats:
+  requests: int = 0
+  synthesized: int = 0
+  characters: int = 0
+  errors: int = 0
+  throttled: int = 0
+  peak_concurrent: int = 0
+  latencies: list[float] = field(default_factory=list)
+
+
+def get_mock_voices(count: int) -> list[dict]:
+  genders = ["male", "female"]
+  ages = ["young", "middle aged", "old"]
+  accents = ["american", "british", "australian", "irish"]
+  return [
+    {
+      "voice_id": f"mockvoice{i:011d}",
+      "name": f"Mock {i + 1}",
+      "category": "cloned" if i % 5 == 4 else "premade",
+      "labels": {"gender": genders[i % 2], "age": ages[i % 3], "accent": accents[i % 4]},
+      "preview_url": None
+    }
+    for i in range(count)
+  ]
+
+
+def get_mock_models() -> list[dict]:
+  return [
+    {"model_id": "eleven_turbo_v2", "name": "Eleven Turbo v2", "token_cost_factor": 1.0},
+    {"model_id": "eleven_multilingual_v2", "name": "Eleven Multilingual v2", "token_cost_factor": 1.0},
+    {"model_id": "eleven_monolingual_v1", "name": "Eleven English v1", "token_cost_factor": 1.0}
+  ]
+
+
+class MockElevenLabs:
+  """Serve the voices, models, user and text-to-speech endpoints with configurable latency, errors and rate limits."""
+
+  def __init__(self, settings: MockSettings = None) -> None:
+    self.settings = settings or MockSettings()
+    self.stats = MockStats()
+    self.voices = get_mock_voices(self.settings.voices)
+    self.lock = threading.Lock()
+    self.random = random.Random(self.settings.seed)
+    self.active = 0
+    self.tokens = self.settings.requests_per_second
+    self.refilled = time.monotonic()
+    self.server = None
+
+  @property
+  def url(self) -> str:
+    return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+  def start(self, port: int = 0) -> "MockElevenLabs":
+    mock = self
+    class Handler(MockHandler):
+      server_mock = mock
+    self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    self.server.daemon_threads = True
+    threading.Thread(target=self.server.serve_forever, name="mock-elevenlabs", daemon=True).start()
+    return self
+
+  def stop(self) -> None:
+    if self.server is not None:
+      self.server.shutdown()
+      self.server.server_close()
+
+  def acquire(self) -> str:
+    """Admit a text-to-speech request or return the status it is rejected with."""
+    with self.lock:
+      self.stats.requests += 1
+      if self.settings.requests_per_second > 0:
+        now = time.monotonic()
+        self.tokens = min(self.settings.requests_per_second, self.tokens + (now - self.refilled) * self.settings.requests_per_second)
+        self.refilled = now
+        if self.tokens < 1:
+          self.stats.throttled += 1
+          return "too_many_requests"
+        self.tokens -= 1
+      if self.settings.max_concurrent > 0 and self.active >= self.settings.max_concurrent:
+        self.stats.throttled += 1
+        return "too_many_concurrent_requests"
+      self.active += 1
+      self.stats.peak_concurrent = max(self.stats.peak_concurrent, self.active)
+      return None
+
+  def release(self) -> None:
+    with self.lock:
+      self.active -= 1
+
+  def get_delay(self, text: str) -> (float, bool):
+    with self.lock:
+      jitter = self.random.uniform(-self.settings.jitter, self.settings.jitter)
+      failed = self.random.random() < self.settings.error_rate
+    return max(0.0, self.settings.latency + self.settings.per_character * len(text) + jitter) / 1000, failed
+
+  def synthesize(self, text: str, output_format: str) -> bytes:
+    """Create speech-like audio as long as the text would take to read (wav for mp3 formats, raw samples for pcm)."""
+    seconds = max(0.5, len(text) / CHARACTERS_PER_SECOND)
+    samples = synthesize_speech(seconds, np.random.default_rng(len(text)))
+    if output_format.startswith("pcm_"):
+      return samples.tobytes()
+    buffer = io.BytesIO()
+    seg(samples.tobytes(), frame_rate=FRAME_RATE, sample_width=2, channels=1).export(buffer, format="wav")
+    return buffer.getvalue()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+  server_mock: MockElevenLabs = None
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, format: str, *args) -> None:
+    pass
+
+  def send_json(self, data: any, status: int = 200) -> None:
+    body = json.dumps(data).encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def send_error_detail(self, status: int, detail_status: str, message: str) -> None:
+    self.send_json({"detail": {"status": detail_status, "message": message}}, status)
+
+  def do_GET(self) -> None:
+    mock = self.server_mock
+    path = urlparse(self.path).path
+    if path == "/v1/voices":
+      self.send_json({"voices": mock.voices})
+    elif path == "/v1/models":
+      self.send_json(get_mock_models())
+    elif path in ("/v1/user", "/v1/user/subscription"):
+      subscription = {
+        "tier": "mock",
+        "character_count": mock.stats.characters,
+        "character_limit": 10_000_000,
+        "can_extend_character_limit": False,
+        "allowed_to_extend_character_limit": False,
+        "next_character_count_reset_unix": int(time.time()) + 30 * 24 * 3600,
+        "voice_limit": 100,
+        "professional_voice_limit": 1,
+        "can_extend_voice_limit": False,
+        "can_use_instant_voice_cloning": True,
+        "can_use_professional_voice_cloning": False,
+        "status": "active"
+      }
+      self.send_json({"subscription": subscription} if path == "/v1/user" else subscription)
+    else:
+      self.send_error_detail(404, "not_found", f"{path} is not mocked")
+
+  def do_POST(self) -> None:
+    mock = self.server_mock
+    url = urlparse(self.path)
+    length = int(self.headers.get("Content-Length", 0))
+    request = json.loads(self.rfile.read(length) or b"{}")
+    match = re.match(r"^/v1/text-to-speech/([^/]+)(/stream)?$", url.path)
+    if match is None:
+      self.send_error_detail(404, "not_found", f"{url.path} is not mocked")
+      return
+    if not any(v["voice_id"] == match.group(1) for v in mock.voices):
+      self.send_error_detail(400, "voice_not_found", f"voice {match.group(1)} was not found")
+      return
+
+    rejected = mock.acquire()
+    if rejected:
+      self.send_error_detail(429, rejected, "the mock rate limit was exceeded")
+      return
+    started = time.perf_counter()
+    try:
+      text = request.get("text", "")
+      delay, failed = mock.get_delay(text)
+      time.sleep(delay)
+      if failed:
+        with mock.lock:
+          mock.stats.errors += 1
+        self.send_error_detail(500, "internal_error", "the mock failed this request on purpose")
+        return
+      output_format = parse_qs(url.query).get("output_format", ["mp3_44100_128"])[0]
+      audio = mock.synthesize(text, output_format)
+      self.send_response(200)
+      self.send_header("Content-Type", "audio/mpeg")
+      self.send_header("Content-Length", str(len(audio)))
+      self.end_headers()
+      self.wfile.write(audio)
+      with mock.lock:
+        mock.stats.synthesized += 1
+        mock.stats.characters += len(text)
+        mock.stats.latencies.append(time.perf_counter() - started)
+    finally:
+      mock.release()
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser) -> None:
+  defaults = MockSettings()
+  parser.add_argument("--latency", type=float, default=defaults.latency, help="base text-to-speech latency (ms)")
+  parser.add_argument("--per-character", type=float, default=defaults.per_character, help="extra latency per character (ms)")
+  parser.add_argument("--jitter", type=float, default=defaults.jitter, help="uniform latency jitter (+/- ms)")
+  parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="fraction of requests that fail with a 500")
+  parser.add_argument("--max-concurrent", type=int, default=defaults.max_concurrent, help="concurrent requests before a 429 (0 is unlimited)")
+  parser.add_argument("--requests-per-second", type=float, default=defaults.requests_per_second, help="sustained request rate before a 429 (0 is unlimited)")
+
+
+def get_mock_settings(args: argparse.Namespace) -> MockSettings:
+  return MockSettings(
+    latency=args.latency,
+    per_character=args.per_character,
+    jitter=args.jitter,
+    error_rate=args.error_rate,
+    max_concurrent=args.max_concurrent,
+    requests_per_second=args.requests_per_second
+  )
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Run a mock ElevenLabs API server.")
+  parser.add_argument("--port", type=int, default=8765)
+  add_mock_arguments(parser)
+  args = parser.parse_args()
+  mock = MockElevenLabs(get_mock_settings(args)).start(args.port)
+  print(f"mock ElevenLabs API on {mock.url} with {asdict(mock.settings)}")
+  try:
+    while True:
+      time.sleep(60)
+      stats = asdict(mock.stats)
+      stats.pop("latencies")
+      print(stats)
+  except KeyboardInterrupt:
+    mock.stop()
+
+
+if __name__ == "__main__":
+  main()
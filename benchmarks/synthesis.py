@@ -0,0 +1,201 @@
+"""End-to-end synthesis throughput against the mock ElevenLabs server.
+
+Run from the repository root:
+
+  python benchmarks/synthesis.py --lines 50 --latency 400 --jitter 150 --error-rate 0.01 --concurrency 1 2 4 8
+
+The `app` run clicks `Generate Audio Dialogue` in app.py (through Streamlit's AppTest) for a synthetic dialogue.
+The `concurrency` runs call `el_audio.generate` from a thread pool to size how many requests to keep in flight.
+Both report lines per second and the latency percentiles of the synthesize calls.
+"""
+import os, sys, time, shutil, random, argparse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from benchmarks.mock_elevenlabs import MockElevenLabs, add_mock_arguments, get_mock_settings
+
+WORDS = "the a we you they it was is not just what where when why how there here maybe never always really know think look door house night road river light dark quiet loud find lost keep going".split()
+
+@dataclass
+class ThroughputResult:
+  mode: str
+  concurrency: int
+  lines: int
+  synthesized: int
+  failed: int
+  throttled: int
+  seconds: float
+  lines_per_second: float
+  latency_p50: float = None
+  latency_p95: float = None
+  latency_p99: float = None
+  latency_max: float = None
+
+
+def create_dialogue_text(lines: int, characters: int, line_characters: int, voices: list[dict], seed: int) -> str:
+  """Create a dialogue in the export format with lines of roughly `line_characters` characters."""
+  rng = random.Random(seed)
+  names = [f"Speaker{i + 1}" for i in range(characters)]
+  output = "# CHARACTERS\n"
+  for i, name in enumerate(names):
+    voice = voices[i % len(voices)]
+    voice_name = f"{voice['name']} (cloned)" if voice["category"] == "cloned" else voice["name"]
+    output += f"{name}|{voice_name}|1: synthetic character {i + 1}\n"
+  output += "\n# PLOT\n\n# DIALOGUE\n"
+  for i in range(lines):
+    length = max(10, int(rng.gauss(line_characters, line_characters / 3)))
+    text = ""
+    while len(text) < length:
+      text += rng.choice(WORDS) + " "
+    output += f"{names[i % characters]}: {text.strip().capitalize()}.\n"
+  return output
+
+
+def summarize(mode: str, concurrency: int, lines: int, latencies: list[float], failed: int, seconds: float, mock: MockElevenLabs, throttled: int) -> ThroughputResult:
+  result = ThroughputResult(
+    mode,
+    concurrency,
+    lines,
+    len(latencies),
+    failed,
+    mock.stats.throttled - throttled,
+    round(seconds, 3),
+    round(len(latencies) / seconds, 3) if seconds > 0 else 0.0
+  )
+  if len(latencies) > 0:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    result.latency_p50, result.latency_p95, result.latency_p99 = float(p50), float(p95), float(p99)
+    result.latency_max = max(latencies)
+  return result
+
+
+def run_app(dialogue_text: str, lines: int, mock: MockElevenLabs, timeout: float) -> ThroughputResult:
+  """Import the dialogue into app.py and time one click of `Generate Audio Dialogue`."""
+  from streamlit.testing.v1 import AppTest
+  from diatribe.dialogues import convert_dialogue_import_into_data
+
+  imported = convert_dialogue_import_into_data(dialogue_text)
+  app = AppTest.from_file(os.path.abspath("app.py"), default_timeout=timeout)
+  app.session_state["imported_characters"] = imported["characters"]
+  app.session_state["imported_dialogue"] = imported["dialogue"]
+  app.session_state["imported_plot"] = imported["plot"]
+  app.run()
+  if app.exception:
+    raise RuntimeError(app.exception[0].value)
+  generate_btn = next(b for b in app.button if b.label == "Generate Audio Dialogue")
+
+  throttled = mock.stats.throttled
+  started = time.perf_counter()
+  app = generate_btn.click().run()
+  seconds = time.perf_counter() - started
+  try:
+    if app.exception:
+      raise RuntimeError(app.exception[0].value)
+    rerun = app.session_state["timing_history"][-1]
+    latencies = [s.duration for s in rerun.spans if s.name == "synthesize"]
+    # the app stops at the first failed line, which is the last synthesize span
+    failed = 0
+    if "audio_process_error" in app.session_state:
+      latencies = latencies[:-1]
+      failed = lines - len(latencies)
+    return summarize("app", 1, lines, latencies, failed, seconds, mock, throttled)
+  finally:
+    shutil.rmtree(f"./session/{app.session_state['session_id']}", ignore_errors=True)
+
+
+def run_concurrent(dialogue_text: str, lines: int, concurrency: int, model_id: str, mock: MockElevenLabs) -> ThroughputResult:
+  """Synthesize every line with `concurrency` requests in flight."""
+  from diatribe.el_audio import generate, get_voices, get_voice_ids
+  from diatribe.dialogues import convert_dialogue_import_into_data
+  from diatribe.sidebar import SidebarData
+  from diatribe.utils import extract_name
+
+  imported = convert_dialogue_import_into_data(dialogue_text)
+  voice_ids = get_voice_ids(get_voices())
+  character_voices = {row["Name"]: voice_ids[extract_name(row["Voice"])] for _, row in imported["characters"].iterrows()}
+  sidebar = SidebarData(
+    el_key="mock",
+    model_id=model_id,
+    voices=[],
+    voice_names=[],
+    enable_instructions=False,
+    enable_audio_editing=False,
+    stability=0.35,
+    simarlity_boost=0.80,
+    style=0.0,
+    openai_api_key=None,
+    openai_model=None,
+    openai_temp=None,
+    openai_max_tokens=None
+  )
+
+  def synthesize(row: dict) -> float:
+    started = time.perf_counter()
+    generate(row["Text"], character_voices[row["Speaker"]], sidebar)
+    return time.perf_counter() - started
+
+  latencies = []
+  failed = 0
+  throttled = mock.stats.throttled
+  started = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    futures = [executor.submit(synthesize, row) for row in imported["dialogue"].to_dict("records")]
+    for future in futures:
+      try:
+        latencies.append(future.result())
+      except Exception:
+        failed += 1
+  return summarize("concurrency", concurrency, lines, latencies, failed, time.perf_counter() - started, mock, throttled)
+
+
+def format_result(r: ThroughputResult) -> str:
+  latency = "" if r.latency_p50 is None else f"{r.latency_p50 * 1000:>8.0f}{r.latency_p95 * 1000:>8.0f}{r.latency_p99 * 1000:>8.0f}{r.latency_max * 1000:>8.0f}"
+  return f"{r.mode:<12}{r.concurrency:>4}{r.synthesized:>6}/{r.lines:<6}{r.failed:>8}{r.throttled:>10}{r.seconds:>9.2f}s{r.lines_per_second:>9.2f}{latency}"
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Benchmark synthesis throughput against a mock ElevenLabs server.")
+  parser.add_argument("--lines", type=int, default=50, help="dialogue lines to synthesize")
+  parser.add_argument("--characters", type=int, default=4, help="speakers in the dialogue")
+  parser.add_argument("--line-characters", type=int, default=80, help="average characters per line")
+  parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 2, 4, 8], help="requests in flight for the direct runs")
+  parser.add_argument("--skip-app", action="store_true", help="only run the direct concurrency runs")
+  parser.add_argument("--timeout", type=float, default=3600, help="seconds before the app run is stopped")
+  parser.add_argument("--output", help="results file (defaults to benchmarks/results/synthesis-<time>-<revision>.json)")
+  add_mock_arguments(parser)
+  args = parser.parse_args()
+
+  # the elevenlabs package reads its base url when it is first imported, so the mock has to be up before diatribe is imported
+  mock = MockElevenLabs(get_mock_settings(args)).start()
+  os.environ["ELEVEN_BASE_URL"] = mock.url
+  os.environ["ELEVENLABS_API_KEY"] = "mock"
+  from benchmarks.dsp import save_results, get_git_revision
+
+  dialogue_text = create_dialogue_text(args.lines, args.characters, args.line_characters, mock.voices, mock.settings.seed)
+  print(f"{'mode':<12}{'conc':>4}{'lines':>13}{'failed':>8}{'throttled':>10}{'time':>10}{'lines/s':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}")
+  results = []
+  try:
+    if not args.skip_app:
+      results.append(run_app(dialogue_text, args.lines, mock, args.timeout))
+      print(format_result(results[-1]))
+    for concurrency in args.concurrency:
+      results.append(run_concurrent(dialogue_text, args.lines, concurrency, "eleven_turbo_v2", mock))
+      print(format_result(results[-1]))
+  finally:
+    mock.stop()
+
+  output = args.output or f"./benchmarks/results/synthesis-{time.strftime('%Y%m%d-%H%M%S')}-{get_git_revision()}.json"
+  save_results({
+    "revision": get_git_revision(),
+    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "mock": asdict(mock.settings),
+    "results": [asdict(r) for r in results]
+  }, output)
+  print(f"results saved to {output}")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,10 +1,17 @@
 import streamlit as st
 import diatribe.el_audio as el_audio
+import diatribe.blobs as blobs
+import diatribe.jobs as jobs
 from diatribe.dialogues import Dialogue, Character
 from diatribe.sidebar import SidebarData
-from diatribe.utils import log
+from diatribe.audio_server import audio_player
+from diatribe.audio_pool import PoolBusyError, run_audio_task
+from diatribe.workspace import get_session_workspace
+from diatribe.utils import log, rerun_after
 from diatribe.edits import *
 
+UPLOAD_POLL_INTERVAL = 1.0
+
 def create_compressor(key: str) -> CompressorEdit:
     st.markdown("A compressor controls the dynamic range of an audio signal. In other words, it reduces loud volumes by \"compressing\" the audio range.")
     
@@ -300,6 +307,20 @@ def create_group_options(characters: list[Character]) -> list[str]:
     return [f"{', '.join(groups[c])} (group {c})" for c in groups.keys()]
 
 
+def create_upload_progress(folder: str, key: str) -> None:
+    """Show the uploads of the folder that are being processed, rerunning until they are so the assets selected below include them."""
+    upload_jobs = el_audio.get_upload_jobs(folder)
+    pending = [job for job in upload_jobs if not job.is_done()]
+    for job in pending:
+        st.progress(job.progress, text=f"Processing `{job.name}`...")
+    for job in upload_jobs:
+        if job.status == "failed":
+            st.warning(f"Unable to process `{job.name}`. Please try a different file.")
+    el_audio.clear_finished_upload_jobs(folder)
+    if len(pending) > 0:
+        rerun_after(UPLOAD_POLL_INTERVAL, f"upload_progress_{key}")
+
+
 def create_edit_dialogue_line(line: Dialogue, audio_file: str) -> None:
     edit_audio_line_key = f"editing_audio_line_{line.line}"                                 
 
@@ -315,7 +336,7 @@ def create_edit_dialogue_line(line: Dialogue, audio_file: str) -> None:
         with st.container(border=True):
             speech_duration = el_audio.get_audio_duration(audio_file)  
             speech_duration_int = int(speech_duration * 1000)        
-            basic_tab, soundboard_tab, special_tab,  = st.tabs(["Basic", "Soundboard", "Special Effect"])
+            basic_tab, soundboard_tab, special_tab,  = st.tabs(["Basic", "Soundboard", "Special Effects"])
             
             with basic_tab:
                 st.markdown("### 🔊 Basic Settings")
@@ -389,7 +410,7 @@ def create_edit_dialogue_line(line: Dialogue, audio_file: str) -> None:
                 soundboard.add(basic)
                  
             with special_tab:
-                st.markdown("### 💥 Special Effect")
+                st.markdown("### 💥 Special Effects")
                     
                 with st.expander("Upload Special Effect"):
                     with st.form(f"Audio File {line.line}", clear_on_submit=True, border=False):
@@ -402,65 +423,63 @@ def create_edit_dialogue_line(line: Dialogue, audio_file: str) -> None:
                         submit_uploaded_special_effect = st.form_submit_button("Upload", use_container_width=True)
                         if uploaded_special_effect and submit_uploaded_special_effect:
                             if uploaded_special_effect:
-                                audio_file = uploaded_special_effect.getvalue()
-                                el_audio.save_sound_effect(audio_file, uploaded_special_effect.name)
-                                st.toast("Special effect has been uploaded. Please click refresh to see it.", icon="👍")                      
+                                effect_audio = uploaded_special_effect.getvalue()
+                                el_audio.save_sound_effect(effect_audio, uploaded_special_effect.name)
+                                st.toast("Special effect has been uploaded. It will be available once it has been processed.", icon="👍")                      
+                    create_upload_progress("effects", f"effects_{line.line}")
                     
-                col1, col2 = st.columns([8, 1])
-                with col1:
-                    effect_name = st.selectbox(
-                        "Effects", 
-                        el_audio.get_effect_names(), 
-                        index=None, 
-                        label_visibility="collapsed", 
-                        placeholder="Select an effect",
-                        key=f"effect_{line.line}"
-                    )
-                with col2:
-                    st.button("Refresh", use_container_width=True, key=f"refresh_effect_{line.line}")
+                effect_names = st.multiselect(
+                    "Effects", 
+                    el_audio.get_effect_names(), 
+                    label_visibility="collapsed", 
+                    placeholder="Select one or more effects",
+                    key=f"effect_{line.line}"
+                )
                     
-                if effect_name:
+                for effect_name in effect_names:
+                    effect_key = f"{line.line}_{effect_name.replace(' ', '_')}"
                     effect_path = el_audio.get_effect_path(effect_name)
-                    st.audio(effect_path)                   
-                    
-                    effect_volume_tab, effect_timing_tab = st.tabs(["Volume", "Timing"])
-                    with effect_volume_tab:            
-                        effect_volume = st.slider(
-                            "Adjust Effect Volume (dB)",
-                            -25, 
-                            25, 
-                            0, 
-                            1, 
-                            key=f"effect_volume_{line.line}"
-                        )    
-                        effect_fade_out = st.slider(
-                            "Effect Fade Out (milliseconds)",
-                            0, 
-                            5000, 
-                            0, 
-                            50, 
-                            key=f"effect_fade_out_{line.line}",
-                            help="Fades the effect out, which is particularly helpful if the effect is longer than the speech."
-                        )                      
-                    with effect_timing_tab:          
-                        effect_start = st.slider(
-                            "Effect Start Time (seconds)", 
-                            0.0, 
-                            speech_duration, 
-                            0.0, 
-                            0.1, 
-                            key=f"effect_start_{line.line}",
-                            help="When the effect should start playing. The effect will cut off if it exceeds the speech."
-                        )              
-                        effect_repeat = st.slider(
-                            "Effect Repeat",
-                            1,
-                            10,
-                            1,
-                            1,
-                            key=f"effect_repeat_{line.line}",
-                            help="If you want the effect to repeat itself."
-                        )
+                    with st.expander(effect_name, expanded=len(effect_names) == 1):
+                        audio_player(effect_path)                   
+                        
+                        effect_volume_tab, effect_timing_tab = st.tabs(["Volume", "Timing"])
+                        with effect_volume_tab:            
+                            effect_volume = st.slider(
+                                "Adjust Effect Volume (dB)",
+                                -25, 
+                                25, 
+                                0, 
+                                1, 
+                                key=f"effect_volume_{effect_key}"
+                            )    
+                            effect_fade_out = st.slider(
+                                "Effect Fade Out (milliseconds)",
+                                0, 
+                                5000, 
+                                0, 
+                                50, 
+                                key=f"effect_fade_out_{effect_key}",
+                                help="Fades the effect out, which is particularly helpful if the effect is longer than the speech."
+                            )                      
+                        with effect_timing_tab:          
+                            effect_start = st.slider(
+                                "Effect Start Time (seconds)", 
+                                0.0, 
+                                speech_duration, 
+                                0.0, 
+                                0.1, 
+                                key=f"effect_start_{effect_key}",
+                                help="When the effect should start playing. The effect will cut off if it exceeds the speech."
+                            )              
+                            effect_repeat = st.slider(
+                                "Effect Repeat",
+                                1,
+                                10,
+                                1,
+                                1,
+                                key=f"effect_repeat_{effect_key}",
+                                help="If you want the effect to repeat itself."
+                            )
                     soundboard.add(SpecialEffectEdit(
                         effect_name, 
                         effect_path, 
@@ -477,10 +496,16 @@ def create_edit_dialogue_line(line: Dialogue, audio_file: str) -> None:
                     use_container_width=True
                 )
                 if preview_line:
-                    preview_audio = el_audio.preview_audio(
-                        audio_file, 
-                        soundboard
-                    )                          
+                    try:
+                        preview_audio = run_audio_task(
+                            "preview_audio",
+                            el_audio.preview_audio,
+                            audio_file, 
+                            soundboard
+                        )                          
+                    except PoolBusyError as e:
+                        st.warning(str(e))
+                        st.stop()
                 
                     adjustments = soundboard.adjustments()
                     if len(adjustments) > 0:
@@ -488,7 +513,7 @@ def create_edit_dialogue_line(line: Dialogue, audio_file: str) -> None:
                         org_audio_waveform, new_audio_waveform = st.columns([1, 1])
                         with org_audio_waveform:
                             st.markdown("<p style='font-size:14px'>Original</p>", unsafe_allow_html=True)
-                            st.audio(audio_file)
+                            audio_player(audio_file)
                             y_max, plot = el_audio.generate_waveform_from_file(audio_file)
                             st.pyplot(plot)                  
                         with new_audio_waveform:
@@ -505,10 +530,17 @@ def create_edit_dialogue_line(line: Dialogue, audio_file: str) -> None:
                     use_container_width=True
                 )
                 if apply_edits:
-                    new_line_audio = el_audio.edit_audio(
-                        audio_file,
-                        soundboard                
-                    )
+                    try:
+                        new_line_audio = run_audio_task(
+                            "edit_audio",
+                            el_audio.edit_audio,
+                            audio_file,
+                            soundboard                
+                        )
+                    except PoolBusyError as e:
+                        st.warning(str(e))
+                        st.stop()
+                    blobs.detach(audio_file)
                     new_line_audio.export(audio_file, format="mp3")
                     log(f"saving audio {audio_file}")
                     st.rerun()
@@ -578,30 +610,32 @@ def create_edit_diatribe(sidebar: SidebarData, characters: list[Character], dial
                             submit_uploaded_soundtrack = st.form_submit_button("Upload", use_container_width=True)
                             if uploaded_soundtrack and submit_uploaded_soundtrack:
                                 if uploaded_soundtrack:
-                                    audio_file = uploaded_soundtrack.getvalue()
-                                    el_audio.save_background_audio(audio_file, uploaded_soundtrack.name)
-                                    st.toast("Soundtrack has been uploaded. Please click refresh to see it.", icon="👍")
+                                    soundtrack_audio = uploaded_soundtrack.getvalue()
+                                    el_audio.save_background_audio(soundtrack_audio, uploaded_soundtrack.name)
+                                    st.toast("Soundtrack has been uploaded. It will be available once it has been processed.", icon="👍")
+                        create_upload_progress("backgrounds", "backgrounds")
                     
-                    col1, col2 = st.columns([8, 1])
-                    with col1:
-                        background_audio = st.selectbox(
-                            "Background Audio", 
-                            el_audio.get_background_names(), 
-                            index=None, 
-                            placeholder="select a soundtrack",
-                            label_visibility="collapsed"
-                        )
-                    with col2:
-                        st.button("Refresh", use_container_width=True, key="refresh_background")
+                    background_audio = st.selectbox(
+                        "Background Audio", 
+                        el_audio.get_background_names(), 
+                        index=None, 
+                        placeholder="select a soundtrack",
+                        label_visibility="collapsed"
+                    )
                         
                     if background_audio:
-                        st.audio(el_audio.get_background_path(background_audio))
+                        audio_player(el_audio.get_background_path(background_audio))
                         background_fade, background_volume = st.columns([1, 3])
                         with background_fade:
                             fade_in = st.toggle("Fade In", value=False)
                             fade_out = st.toggle("Fade Out", value=True)
                         with background_volume:
                             lower_db = st.slider("Lower Background Volume (dB)", 0, 25, 0, 1, help="lowers the background audio by specified decibels")
+                        background_duck, background_duck_amount = st.columns([1, 3])
+                        with background_duck:
+                            duck = st.toggle("Auto Duck", value=False, help="Automatically lowers the background audio while someone is speaking.")
+                        with background_duck_amount:
+                            duck_db = st.slider("Duck Amount (dB)", 0, 30, 12, 1, disabled=not duck, help="how far the background audio is lowered underneath speech")
                                     
                 with soundboard_tab:
                     st.markdown("### 👂💫 Soundboard")                      
@@ -616,42 +650,68 @@ def create_edit_diatribe(sidebar: SidebarData, characters: list[Character], dial
 
                 soundboard.add(NormalizationEdit(normalize))
                 if background_audio:
-                    soundboard.add(BackgroundEdit(background_audio, fade_in, fade_out, lower_db))                          
+                    soundboard.add(BackgroundEdit(background_audio, fade_in, fade_out, lower_db, duck, duck_db))                          
                 
             st.divider()
             preview_background_bnt = st.button("Preview", use_container_width=True)
             if preview_background_bnt:
-                with st.spinner("Mastering audio..."):
-                    original_audio, updated_audio = el_audio.preview_mastered_audio(
-                        lines_affected, 
-                        line_indices, 
-                        soundboard, 
-                        join_gap
-                    )
+                try:
+                    with st.spinner("Mastering audio..."):
+                        original_audio, updated_audio = run_audio_task(
+                            "preview_mastered_audio",
+                            el_audio.preview_mastered_audio,
+                            lines_affected, 
+                            line_indices, 
+                            soundboard, 
+                            join_gap,
+                            get_session_workspace()
+                        )
+                except PoolBusyError as e:
+                    st.warning(str(e))
+                    st.stop()
                 adjustments = soundboard.adjustments()
                 if len(adjustments) > 0:
                     st.markdown(f"Adjustments: {' '.join(sorted(adjustments))}")  
                 org_audio_waveform, new_audio_waveform = st.columns([1, 1])
                 with org_audio_waveform:
                     st.markdown("<p style='font-size:14px'>Original</p>", unsafe_allow_html=True)
-                    st.audio(original_audio)
+                    audio_player(original_audio)
                     y_max, plot = el_audio.generate_waveform_from_file(original_audio)
                     st.pyplot(plot)                  
                 with new_audio_waveform:
                     st.markdown("<p style='font-size:14px'>Updated</p>", unsafe_allow_html=True)
-                    st.audio(updated_audio)
+                    audio_player(updated_audio)
                     _, plot = el_audio.generate_waveform_from_file(updated_audio, y_max)
                     st.pyplot(plot)              
                     
             add_background_btn = st.button("Apply", use_container_width=True)
-            if add_background_btn:
-                with st.spinner("Mastering audio..."):
-                    el_audio.apply_mastered_audio(
-                        lines_affected, 
-                        line_indices, 
-                        soundboard, 
-                        join_gap
-                    )
-                    st.toast("Mastering has been applied.", icon="👍")
+            if add_background_btn and jobs.get_job_queue() is not None:
+                jobs.submit_session_job("master", {
+                    "workspace": get_session_workspace(),
+                    "affected_lines": lines_affected,
+                    "lines": line_indices,
+                    "soundboard": soundboard,
+                    "gap": join_gap
+                }, "master_job")
+            elif add_background_btn:
+                try:
+                    with st.spinner("Mastering audio..."):
+                        run_audio_task(
+                            "apply_mastered_audio",
+                            el_audio.apply_mastered_audio,
+                            lines_affected, 
+                            line_indices, 
+                            soundboard, 
+                            join_gap,
+                            get_session_workspace()
+                        )
+                        st.toast("Mastering has been applied.", icon="👍")
+                except PoolBusyError as e:
+                    st.warning(str(e))
+            master_job = jobs.follow_session_job("master_job")
+            if master_job is not None and master_job.state == "failed":
+                st.error(f"An error occured while mastering the audio: {master_job.error}")
+            elif master_job is not None:
+                st.toast("Mastering has been applied.", icon="👍")
                         
                   
\ No newline at end of file
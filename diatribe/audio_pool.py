@@ -0,0 +1,169 @@
+"""A shared process pool for the CPU heavy audio work of every session.
+
+The pool is enabled by setting DIATRIBE_POOL_WORKERS to the number of worker processes.
+Sessions take turns: the next task is always taken from the session after the one that ran last, so one session with a long queue cannot starve the others.
+A session can have DIATRIBE_POOL_SESSION_LIMIT tasks (4 by default) and the server DIATRIBE_POOL_QUEUE_LIMIT tasks (32 by default) waiting or running before new tasks are turned away.
+"""
+import os, time, threading, multiprocessing
+import streamlit as st
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from diatribe.timing import span
+from diatribe.utils import log
+
+_restart_lock = threading.Lock()
+
+@dataclass
+class PoolSettings:
+  workers: int
+  session_limit: int
+  queue_limit: int
+
+
+def get_pool_settings() -> PoolSettings:
+  """Get the pool settings from the environment (the pool is disabled if no workers are set)."""
+  workers = int(os.getenv("DIATRIBE_POOL_WORKERS", "0"))
+  if workers <= 0:
+    return None
+  return PoolSettings(
+    workers,
+    int(os.getenv("DIATRIBE_POOL_SESSION_LIMIT", "4")),
+    int(os.getenv("DIATRIBE_POOL_QUEUE_LIMIT", "32"))
+  )
+
+
+class PoolBusyError(RuntimeError):
+  pass
+
+
+@dataclass
+class PoolTask:
+  session_id: str
+  func: callable
+  args: tuple
+  kwargs: dict
+  future: Future = field(default_factory=Future)
+  dispatched: threading.Event = field(default_factory=threading.Event)
+  queued: float = field(default_factory=time.perf_counter)
+
+
+def init_pool_worker() -> None:
+  import streamlit.config, streamlit.logger
+  # the cached functions warn about the missing Streamlit runtime on every call
+  streamlit.config.get_config_options()
+  streamlit.logger.set_log_level("error")
+
+
+class FairPool:
+  """Runs the tasks of every session on a bounded process pool, taking turns between the sessions."""
+  def __init__(self, settings: PoolSettings) -> None:
+    self.settings = settings
+    # the server runs threads, so the workers are spawned rather than forked
+    self.executor = ProcessPoolExecutor(
+      settings.workers,
+      mp_context=multiprocessing.get_context("spawn"),
+      initializer=init_pool_worker
+    )
+    self.queues: OrderedDict[str, deque[PoolTask]] = OrderedDict()
+    self.pending: dict[str, int] = {}
+    self.running = 0
+    self.condition = threading.Condition()
+    threading.Thread(target=self.dispatch, name="audio-pool", daemon=True).start()
+
+  def submit(self, session_id: str, func: callable, *args, **kwargs) -> PoolTask:
+    """Queue a task for the session unless the session or the server already has too many tasks."""
+    with self.condition:
+      if self.pending.get(session_id, 0) >= self.settings.session_limit:
+        raise PoolBusyError("This session is already processing too much audio. Please wait for it to finish.")
+      if sum(self.pending.values()) >= self.settings.queue_limit:
+        raise PoolBusyError("The server is busy processing audio. Please try again in a moment.")
+      task = PoolTask(session_id, func, args, kwargs)
+      self.queues.setdefault(session_id, deque()).append(task)
+      self.pending[session_id] = self.pending.get(session_id, 0) + 1
+      self.condition.notify()
+    return task
+
+  def next_task(self) -> PoolTask:
+    """Take the oldest task of the next session in turn and send that session to the back of the line."""
+    session_id, queue = self.queues.popitem(last=False)
+    task = queue.popleft()
+    if len(queue) > 0:
+      self.queues[session_id] = queue
+    return task
+
+  def dispatch(self) -> None:
+    while True:
+      with self.condition:
+        while self.running >= self.settings.workers or len(self.queues) == 0:
+          self.condition.wait()
+        task = self.next_task()
+        self.running += 1
+      task.dispatched.set()
+      try:
+        future = self.executor.submit(task.func, *task.args, **task.kwargs)
+      except Exception as e:
+        self.finish(task, None, e)
+        continue
+      future.add_done_callback(lambda f, task=task: self.finish(task, f))
+
+  def finish(self, task: PoolTask, future: Future, error: Exception = None) -> None:
+    with self.condition:
+      self.running -= 1
+      self.pending[task.session_id] -= 1
+      if self.pending[task.session_id] == 0:
+        del self.pending[task.session_id]
+      self.condition.notify()
+    error = error or future.exception()
+    if error is not None:
+      task.future.set_exception(error)
+    else:
+      task.future.set_result(future.result())
+
+
+  def close(self) -> None:
+    self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+@st.cache_resource
+def get_audio_pool() -> FairPool:
+  """Get the shared pool once per server if it is enabled."""
+  settings = get_pool_settings()
+  if settings is None:
+    return None
+  log(f"starting an audio pool with {settings.workers} workers")
+  return FairPool(settings)
+
+
+def run_audio_task(name: str, func: callable, *args, **kwargs) -> any:
+  """Run a picklable function on the shared pool for this session (or in the script thread if the pool is disabled)."""
+  pool = get_audio_pool()
+  if pool is None:
+    return func(*args, **kwargs)
+  task = pool.submit(st.session_state.session_id, func, *args, **kwargs)
+  with span("pool.wait"):
+    task.dispatched.wait()
+  try:
+    with span(f"pool.{name}"):
+      return task.future.result()
+  except BrokenProcessPool:
+    restart_audio_pool(pool)
+  # the task runs in the script thread this once, like it would without the pool
+  with span(f"pool.{name}.inline"):
+    return func(*args, **kwargs)
+
+
+def restart_audio_pool(pool: FairPool) -> None:
+  """Drop a pool whose worker died so the next task starts a new one."""
+  with _restart_lock:
+    # the other sessions using the broken pool only need one of them to replace it
+    if get_audio_pool() is not pool:
+      return
+    log("an audio pool worker died, starting a new pool")
+    get_audio_pool.clear()
+  pool.close()
+
+
+def is_pooled() -> bool:
+  return get_audio_pool() is not None
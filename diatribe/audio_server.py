@@ -0,0 +1,98 @@
+import os, threading, asyncio, mimetypes
+import streamlit as st
+import tornado.web
+import tornado.httpserver
+from urllib.parse import quote
+from dataclasses import dataclass
+from diatribe.utils import log
+
+AUDIO_ROOTS = {
+  "session": "./session",
+  "effects": "./effects"
+}
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".ogg", ".flac", ".m4a")
+
+@dataclass
+class AudioServerSettings:
+  port: int
+  url: str
+
+
+def get_audio_server_settings() -> AudioServerSettings:
+  """Get the audio server settings from the environment (the server is disabled if no port is set)."""
+  port = os.getenv("DIATRIBE_AUDIO_PORT")
+  if not port:
+    return None
+  url = os.getenv("DIATRIBE_AUDIO_URL", f"http://localhost:{port}")
+  return AudioServerSettings(int(port), url.rstrip("/"))
+
+
+class AudioFileHandler(tornado.web.StaticFileHandler):
+  """Serve audio files with range requests and ETags based on the file's inode, size and modified time."""
+
+  def validate_absolute_path(self, root: str, absolute_path: str) -> str:
+    if not absolute_path.lower().endswith(AUDIO_EXTENSIONS):
+      raise tornado.web.HTTPError(404)
+    return super().validate_absolute_path(root, absolute_path)
+
+  def compute_etag(self) -> str:
+    # the default etag hashes the whole file once and caches it forever, which breaks when a line is redone
+    stat = os.stat(self.absolute_path)
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+  def set_extra_headers(self, path: str) -> None:
+    # versioned urls never change, unversioned ones are revalidated with the etag
+    if self.get_query_argument("v", None):
+      self.set_header("Cache-Control", "private, max-age=31536000, immutable")
+    else:
+      self.set_header("Cache-Control", "private, no-cache")
+
+
+def run_audio_server(settings: AudioServerSettings) -> None:
+  asyncio.set_event_loop(asyncio.new_event_loop())
+  app = tornado.web.Application([
+    (f"/{name}/(.*)", AudioFileHandler, {"path": os.path.abspath(root)})
+    for name, root in AUDIO_ROOTS.items()
+  ])
+  server = tornado.httpserver.HTTPServer(app)
+  server.listen(settings.port)
+  log(f"serving audio on port {settings.port}")
+  asyncio.get_event_loop().run_forever()
+
+
+@st.cache_resource
+def start_audio_server() -> threading.Thread:
+  """Start serving audio files once per server if it is enabled."""
+  settings = get_audio_server_settings()
+  if settings is None:
+    return None
+  server = threading.Thread(
+    target=run_audio_server,
+    args=(settings,),
+    name="audio-server",
+    daemon=True
+  )
+  server.start()
+  return server
+
+
+def get_audio_url(audio_file: str) -> str:
+  """Get the url the browser can load and cache the audio file from (or the path if it is not being served)."""
+  settings = get_audio_server_settings()
+  if settings is None or not os.path.exists(audio_file):
+    return audio_file
+  absolute_path = os.path.abspath(audio_file)
+  for name, root in AUDIO_ROOTS.items():
+    absolute_root = os.path.abspath(root)
+    if os.path.commonpath([absolute_path, absolute_root]) == absolute_root:
+      relative_path = os.path.relpath(absolute_path, absolute_root).replace(os.sep, "/")
+      stat = os.stat(absolute_path)
+      return f"{settings.url}/{name}/{quote(relative_path)}?v={stat.st_ino:x}-{stat.st_mtime_ns:x}"
+  return audio_file
+
+
+def audio_player(audio_file: str, format: str = None) -> None:
+  """Show an audio player for a file, served by url when the audio server is enabled."""
+  if format is None:
+    format = mimetypes.guess_type(audio_file)[0] or "audio/wav"
+  st.audio(get_audio_url(audio_file), format=format)
@@ -0,0 +1,102 @@
+import os, shutil, hashlib, uuid, time
+from diatribe.utils import log
+
+BLOB_ROOT = "./blobs"
+
+def get_file_hash(filename: str) -> str:
+  """Get the SHA-1 hash of a file's contents."""
+  file_hash = hashlib.sha1()
+  with open(filename, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      file_hash.update(chunk)
+  return file_hash.hexdigest()
+
+
+def get_blob_path(blob_hash: str) -> str:
+  return f"{BLOB_ROOT}/{blob_hash[:2]}/{blob_hash}"
+
+
+def link_or_copy(src: str, dst: str) -> None:
+  """Atomically replace the destination with a hardlink to the source (or a copy if linking is not possible)."""
+  os.makedirs(os.path.dirname(dst), exist_ok=True)
+  temp_file = f"{dst}.{uuid.uuid4()}.tmp"
+  try:
+    os.link(src, temp_file)
+  except OSError:
+    shutil.copyfile(src, temp_file)
+  os.replace(temp_file, dst)
+
+
+def store_file(src: str) -> str:
+  """Add a file to the blob store (linking it rather than copying) and return its hash."""
+  blob_hash = get_file_hash(src)
+  blob_path = get_blob_path(blob_hash)
+  if not os.path.exists(blob_path):
+    link_or_copy(src, blob_path)
+  return blob_hash
+
+
+def store_stream(stream) -> str:
+  """Write a readable stream straight into the blob store and return its hash."""
+  os.makedirs(BLOB_ROOT, exist_ok=True)
+  temp_file = f"{BLOB_ROOT}/{uuid.uuid4()}.tmp"
+  file_hash = hashlib.sha1()
+  with open(temp_file, "wb") as f:
+    for chunk in iter(lambda: stream.read(1 << 20), b""):
+      file_hash.update(chunk)
+      f.write(chunk)
+  blob_hash = file_hash.hexdigest()
+  blob_path = get_blob_path(blob_hash)
+  if os.path.exists(blob_path):
+    os.remove(temp_file)
+  else:
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    os.replace(temp_file, blob_path)
+  return blob_hash
+
+
+def link_blob(blob_hash: str, dst: str) -> None:
+  """Make the destination reference a blob."""
+  link_or_copy(get_blob_path(blob_hash), dst)
+
+
+def link_file(src: str, dst: str) -> str:
+  """Make the destination reference the blob of the source file."""
+  blob_hash = store_file(src)
+  link_or_copy(get_blob_path(blob_hash), dst)
+  return blob_hash
+
+
+def link_tree(src_dir: str, dst_dir: str) -> None:
+  """Like `shutil.copytree(dirs_exist_ok=True)` but every file references a blob."""
+  for root, _, files in os.walk(src_dir):
+    relative_root = os.path.relpath(root, src_dir)
+    for file in files:
+      link_file(os.path.join(root, file), os.path.normpath(os.path.join(dst_dir, relative_root, file)))
+
+
+def detach(path: str) -> None:
+  """Unlink a shared file before it is written so the blob and other references are left untouched."""
+  if os.path.exists(path) and os.stat(path).st_nlink > 1:
+    os.remove(path)
+
+
+def collect_blobs(min_age: float = 300.0) -> int:
+  """Delete the blobs that are no longer referenced by any session and return how many were deleted."""
+  if not os.path.exists(BLOB_ROOT):
+    return 0
+  now = time.time()
+  removed = 0
+  for root, _, files in os.walk(BLOB_ROOT):
+    for file in files:
+      blob_path = os.path.join(root, file)
+      try:
+        blob_stat = os.stat(blob_path)
+        if blob_stat.st_nlink == 1 and now - blob_stat.st_ctime > min_age:
+          os.remove(blob_path)
+          removed += 1
+      except OSError:
+        pass
+  if removed > 0:
+    log(f"removed {removed} unreferenced blobs")
+  return removed
@@ -1,11 +1,14 @@
-import os, re
+import os, io, hashlib
 import pandas as pd
 import streamlit as st
 from elevenlabs import Voice
-from diatribe.el_audio import get_voice_id
+from diatribe.el_audio import get_voice_ids
+import diatribe.utils as utils
 from diatribe.utils import log
 
 class Character:
+  __slots__ = ("name", "voice", "voice_id", "description", "group")
+  
   def __init__(self, name: str, voice: str, voice_id: str, description: str = "", group: int = 1) -> None:
     self.name = name
     self.voice = voice
@@ -30,6 +33,8 @@ class Character:
 
 
 class Dialogue:
+  __slots__ = ("character", "line", "text")
+  
   def __init__(self, character: Character, line: int, text: str):
     self.character = character
     self.line = line
@@ -52,6 +57,79 @@ class Dialogue:
     return f"[{self.line}] {self.character.name}: {self.text}"
 
 
+def get_table_hash(table: pd.DataFrame) -> str:
+  """Get a hash of the contents (and index) of an edited table."""
+  if table.empty:
+    return "empty"
+  table_hash = hashlib.sha1(pd.util.hash_pandas_object(table, index=True).values.tobytes())
+  table_hash.update(",".join(map(str, table.columns)).encode("utf-8"))
+  return table_hash.hexdigest()
+
+
+def get_voices_hash(voices: list[Voice]) -> str:
+  return hashlib.sha1("|".join(f"{v.name}:{v.voice_id}" for v in voices).encode("utf-8")).hexdigest()
+
+
+def get_group(group: any, default: any = 1) -> any:
+  return default if group is None or pd.isna(group) else group
+
+
+def build_characters(characters_df: pd.DataFrame, voices: list[Voice], group_as_int: bool = True) -> list[Character]:
+  """Build the characters from the character table column by column."""
+  if characters_df.empty:
+    return []
+  voice_ids = get_voice_ids(voices)
+  columns = characters_df[["Name", "Voice", "Description", "Group"]].to_dict("list")
+  return [
+    Character(
+      name,
+      voice,
+      voice_ids.get(utils.extract_name(voice)) if voice is not None else None,
+      description=description,
+      group=int(get_group(group)) if group_as_int else group
+    )
+    for name, voice, description, group in zip(columns["Name"], columns["Voice"], columns["Description"], columns["Group"])
+  ]
+
+
+def build_dialogue(dialogue_df: pd.DataFrame, characters: list[Character], line_offset: int = 1) -> list[Dialogue]:
+  """Build the dialogue from the dialogue table using a name to character lookup."""
+  if dialogue_df.empty:
+    return []
+  characters_by_name: dict[str, Character] = {}
+  for c in characters:
+    characters_by_name.setdefault(c.name, c)
+  dialogue: list[Dialogue] = []
+  for i, speaker, text in zip(dialogue_df.index, dialogue_df["Speaker"], dialogue_df["Text"]):
+    character = characters_by_name.get(speaker)
+    if character is None:
+      print(f"Error: {speaker} is not a valid character.")
+      continue
+    dialogue.append(Dialogue(character, int(i) + line_offset, text))
+  dialogue.sort(key=lambda x: x.line)
+  return dialogue
+
+
+def get_characters(characters_df: pd.DataFrame, voices: list[Voice]) -> list[Character]:
+  """Get the characters of the character table, rebuilt only when the table or voices change."""
+  key = (get_table_hash(characters_df), get_voices_hash(voices))
+  cached = st.session_state.get("characters_model")
+  if cached is None or cached[0] != key:
+    cached = (key, build_characters(characters_df, voices))
+    st.session_state["characters_model"] = cached
+  return cached[1]
+
+
+def get_dialogue(dialogue_df: pd.DataFrame, characters: list[Character]) -> list[Dialogue]:
+  """Get the dialogue of the dialogue table, rebuilt only when the table or characters change."""
+  key = (get_table_hash(dialogue_df), hash(tuple(str(c) for c in characters)))
+  cached = st.session_state.get("dialogue_model")
+  if cached is None or cached[0] != key:
+    cached = (key, build_dialogue(dialogue_df, characters))
+    st.session_state["dialogue_model"] = cached
+  return cached[1]
+
+
 def generate_dialogue_details(
   characters_df: pd.DataFrame, 
   dialogue_df: pd.DataFrame, 
@@ -59,56 +137,95 @@ def generate_dialogue_details(
   plot: str = None
 ) -> dict:
   """Generate dialogue details in a common format suitiable for JSON."""
-  characters: list[Character] = []
-  for i, c in characters_df.iterrows():
-    characters.append(Character(c["Name"], c["Voice"], get_voice_id(c["Voice"], voices), description=c["Description"], group=c["Group"]))
-  dialogue: list[Dialogue] = []
-  for i, d in dialogue_df.iterrows():
-    character = next((c for c in characters if c.name == d["Speaker"]), None)
-    dialogue.append(Dialogue(character, i, d["Text"]).to_dict()) 
+  characters = build_characters(characters_df, voices, group_as_int=False)
+  dialogue = build_dialogue(dialogue_df, characters, line_offset=0)
   dialogue_details = {
     "characters": [c.to_dict() for c in characters],
     "plot": plot,
-    "dialogue": dialogue
+    "dialogue": [d.to_dict() for d in dialogue]
   }  
   return dialogue_details 
 
+class DialogueImportError(ValueError):
+  def __init__(self, line_number: int, message: str) -> None:
+    super().__init__(f"line {line_number}: {message}")
+    self.line_number = line_number
+
+
+IMPORT_SECTIONS = ["characters", "plot", "dialogue"]
+# the export writes empty table cells as None or nan
+EMPTY_VALUES = ("", "None", "nan")
+
+def parse_import_character(line: str, line_number: int) -> dict:
+  """Parse a `Name|Voice|Group: Description` character line."""
+  name, separator, description = line.partition(":")
+  if not separator:
+    raise DialogueImportError(line_number, f"expected `Name|Voice|Group: Description` but found `{line}`")
+  name, *voice_and_group = name.split("|")
+  if len(voice_and_group) == 0 or len(voice_and_group) > 2:
+    raise DialogueImportError(line_number, f"expected `Name|Voice|Group` but found `{line.partition(':')[0]}`")
+  voice = voice_and_group[0].strip()
+  group = voice_and_group[1].strip() if len(voice_and_group) == 2 else "None"
+  if group in EMPTY_VALUES:
+    group = 1
+  else:
+    try:
+      group = int(float(group))
+    except ValueError:
+      raise DialogueImportError(line_number, f"the group `{group}` is not a number")
+  return { "Name": name.strip(), "Voice": voice, "Description": description.strip(), "Group": group }
+
+
 def convert_dialogue_import_into_data(data: str) -> dict:
-  """Convert the imported dialogue into a common format."""
-  import_parts = re.split(r'\n\n|\r\n\r\n', data)
-  if len(import_parts) == 3:
-    characters_input, plot, dialogue_input = import_parts
-  else:    
-    return None
-
-  plot = plot.split("\n")
-  plot = plot[1] if len(plot) > 1 else "" 
-  characters = []
-  dialogues = []      
+  """Convert the imported dialogue into a common format in a single pass over the lines."""
+  characters: dict[str, dict] = {}
+  plot_lines = []
+  dialogues = []
+  section = 0
+  headers_found = False
+  section_has_content = False
   
-  for character in characters_input.split("\n"):
-    if character.startswith("#"):
+  for line_number, line in enumerate(io.StringIO(data), start=1):
+    line = line.strip()
+    if line.startswith("#"):
+      header = line.lstrip("#").strip().lower()
+      if header in IMPORT_SECTIONS:
+        section = IMPORT_SECTIONS.index(header)
+        headers_found = True
+        section_has_content = False
+      continue
+    if len(line) == 0:
+      # without headers the sections are separated by blank lines
+      if not headers_found and section_has_content and section < len(IMPORT_SECTIONS) - 1:
+        section += 1
+        section_has_content = False
       continue
-    name, description = character.split(":")
-    name, voice, *group = name.split("|")
-    if len(group) == 0 or group[0] == "None":
-      group = 1
+    
+    section_has_content = True
+    if IMPORT_SECTIONS[section] == "characters":
+      character = parse_import_character(line, line_number)
+      if character["Name"] in characters:
+        raise DialogueImportError(line_number, f"the character `{character['Name']}` is defined more than once")
+      characters[character["Name"]] = character
+    elif IMPORT_SECTIONS[section] == "plot":
+      plot_lines.append(line)
     else:
-      group = group[0]
-    characters.append({ "Name": name, "Voice": voice, "Description": description.strip(), "Group": group })
+      speaker, separator, text = line.partition(":")
+      speaker = speaker.strip()
+      if not separator:
+        raise DialogueImportError(line_number, f"expected `Speaker: Text` but found `{line}`")
+      # lines without a speaker are kept like the table has them and skipped when the dialogue is built
+      if speaker not in characters and speaker not in EMPTY_VALUES:
+        raise DialogueImportError(line_number, f"the speaker `{speaker}` is not one of the characters")
+      dialogues.append({ "Speaker": speaker, "Text": text.strip() })
   
-  for line in dialogue_input.split("\n"):
-    if line.startswith("#"):
-      continue
-    speaker, *text = line.split(":")
-    text = text[0]
-    character = next((c for c in characters if c["Name"] == speaker), None)
-    dialogues.append({ "Speaker": speaker, "Text": text.strip() })
+  if len(characters) == 0:
+    raise DialogueImportError(1, "no characters were found")
   
   return {
-    "characters": pd.DataFrame(characters, columns=["Name", "Voice", "Group", "Description"]), 
+    "characters": pd.DataFrame(list(characters.values()), columns=["Name", "Voice", "Group", "Description"]), 
     "dialogue": pd.DataFrame(dialogues, columns=["Speaker", "Text"]), 
-    "plot": plot
+    "plot": "\n".join(plot_lines)
   }
 
 def convert_dialogue_details_into_export(dialogue_details: dict) -> str:
@@ -127,15 +244,23 @@ def convert_dialogue_details_into_export(dialogue_details: dict) -> str:
     dialogue_output += f"{line['Speaker']}: {line['Text']}\n"
   return f"{characters_output}\n# PLOT\n{plot}{dialogue_output.strip()}"
 
-def export_dialogue(
+def get_dialogue_export(
   characters: pd.DataFrame, 
   dialogue: pd.DataFrame, 
   voices: list[Voice]
 ) -> str:
-  save_filename = f"./session/{st.session_state.session_id}/export/dialogue.txt"
+  """Get the characters, plot, and dialogue in the export format."""
   plot = st.session_state["plot"] if "plot" in st.session_state else None
   dialogue_details = generate_dialogue_details(characters, dialogue, voices, plot=plot)
-  dialogue_export = convert_dialogue_details_into_export(dialogue_details)
+  return convert_dialogue_details_into_export(dialogue_details)
+
+def export_dialogue(
+  characters: pd.DataFrame, 
+  dialogue: pd.DataFrame, 
+  voices: list[Voice]
+) -> str:
+  save_filename = f"./session/{st.session_state.session_id}/export/dialogue.txt"
+  dialogue_export = get_dialogue_export(characters, dialogue, voices)
   os.makedirs(os.path.dirname(save_filename), exist_ok=True)     
   with open(save_filename, "w") as f:
     f.write(dialogue_export)  
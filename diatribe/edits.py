@@ -178,12 +178,17 @@ class BackgroundEdit(AudioEdit):
     fade_in: bool = False
     fade_out: bool = False
     volume: float = 0.0
+    duck: bool = False
+    duck_amount: float = 12.0
     
     def is_enabled(self) -> bool:
-        return self.name and (self.fade_in or self.fade_out or self.volume != 0.0)
+        return self.name and (self.fade_in or self.fade_out or self.volume != 0.0 or self.duck)
     
     def adjustments(self) -> list[str]:
-        return [f"Background:{self.name}"]    
+        a = [f"Background:{self.name}"]
+        if self.duck:
+            a.append(f"Ducking:{self.duck_amount}dB")
+        return a
     
 @dataclass
 class NormalizationEdit(AudioEdit):
@@ -1,17 +1,26 @@
-import os, glob, shutil, io, traceback
+import os, re, glob, shutil, io, traceback, uuid, hashlib, threading, zipfile
 import streamlit as st
 import numpy as np
 import matplotlib.pyplot as plt
 import diatribe.utils as utils
+import diatribe.blobs as blobs
+import diatribe.rate_limit as rate_limit
+from diatribe.timing import span, timed
+from diatribe.audio_pool import PoolBusyError, run_audio_task
+from diatribe.workspace import Workspace, Progress, StreamlitProgress, get_session_workspace
 from elevenlabs import Voice, VoiceSettings, Model, Models, voices as el_voices, generate as el_generate
 from pydub import AudioSegment as seg
 from pedalboard import Pedalboard, Plugin
-from pedalboard.io import AudioFile
 from math import ceil
+from concurrent.futures import ThreadPoolExecutor, Future
 from diatribe.sidebar import SidebarData
 from diatribe.utils import log
 from diatribe.edits import *
 
+LIBRARY_FRAME_RATE = 44100
+THROTTLE_RETRIES = 3
+PIPELINE_WORKERS = 2
+
 class Soundboard:
   def __init__(self, edits: list[AudioEdit] = []) -> None:
     self.edits = edits
@@ -39,6 +48,9 @@ class Soundboard:
   def special_effect(self) -> SpecialEffectEdit:
     return self._get(SpecialEffectEdit)
   
+  def special_effects(self) -> list[SpecialEffectEdit]:
+    return [e for e in self.edits if isinstance(e, SpecialEffectEdit) and e.is_enabled()]
+  
   def normalization(self) -> NormalizationEdit:
     return self._get(NormalizationEdit)
   
@@ -84,6 +96,91 @@ class AudioLine:
   file: str = None
 
 
+@dataclass
+class AudioMetadata:
+  duration: float
+  peaks: np.ndarray
+
+
+@dataclass
+class UploadJob:
+  name: str
+  folder: str
+  path: str
+  staging_path: str
+  hash: str
+  status: str = "queued"
+  progress: float = 0.0
+  
+  def is_done(self) -> bool:
+    return self.status in ["ready", "failed"]
+
+
+@dataclass
+class AssetInfo:
+  name: str
+  path: str
+  duration: float = None
+  frame_rate: int = None
+  channels: int = None
+  hash: str = None
+  modified: float = None
+
+
+class AssetCatalog:
+  """An index of the effects or backgrounds in a folder by name, refreshed when the folder changes."""
+  def __init__(self, folder: str) -> None:
+    self.folder = folder
+    self.assets: dict[str, AssetInfo] = {}
+    self.sorted_names: list[str] = []
+    self.folder_modified: float = None
+    self.lock = threading.Lock()
+  
+  def refresh(self) -> "AssetCatalog":
+    """Re-index the folder only if it has changed since the last refresh."""
+    folder_modified = os.path.getmtime(self.folder) if os.path.exists(self.folder) else None
+    if folder_modified == self.folder_modified:
+      return self
+    with self.lock:
+      if folder_modified != self.folder_modified:
+        paths = glob.glob(f"{self.folder}/*.*")
+        names = set(process_audio_file_name(path) for path in paths)
+        for name in list(self.assets.keys()):
+          if name not in names:
+            del self.assets[name]
+        for path in paths:
+          self._add(path)
+        self.sorted_names = sorted(self.assets.keys())
+        self.folder_modified = folder_modified
+    return self
+  
+  def _add(self, path: str) -> AssetInfo:
+    name = process_audio_file_name(path)
+    existing = self.assets.get(name)
+    if existing and existing.path == path and existing.modified == os.path.getmtime(path):
+      return existing
+    info = get_asset_info(path)
+    self.assets[name] = info
+    return info
+  
+  def add(self, path: str) -> AssetInfo:
+    """Index a single new or updated asset."""
+    with self.lock:
+      info = self._add(path)
+      self.sorted_names = sorted(self.assets.keys())
+    return info
+  
+  def names(self) -> list[str]:
+    return self.refresh().sorted_names
+  
+  def paths(self) -> list[str]:
+    return [a.path for a in self.refresh().assets.values()]
+  
+  def get(self, name: str) -> AssetInfo:
+    return self.refresh().assets.get(name)
+
+
+@timed("elevenlabs.voices")
 @st.cache_data
 def get_voices() -> list[Voice]:
   """Get a list of voices from the Eleven Labs API."""
@@ -92,6 +189,14 @@ def get_voices() -> list[Voice]:
   return voices
 
 
+def get_voice_ids(voices: list[Voice]) -> dict[str, str]:
+  """Get the voice IDs by voice name (the first voice wins when names repeat)."""
+  voice_ids = {}
+  for v in voices:
+    voice_ids.setdefault(v.name, v.voice_id)
+  return voice_ids
+
+
 def get_voice_id(voice_name: str, voices: list[Voice]) -> str:
   """Get the voice ID from the voice name."""
   voice_name = utils.extract_name(voice_name)
@@ -102,93 +207,162 @@ def get_voice_id(voice_name: str, voices: list[Voice]) -> str:
     return None
 
 
+@timed("elevenlabs.models")
 @st.cache_data
 def get_models() -> list[Model]:
   """Get a list of speech models from the Eleven Labs API."""
   return list(Models.from_api())
 
 
-def generate(
+def request_speech(
   text: str,
   voice_id: str,
   sidebar_data: SidebarData 
 ) -> bytes:
-  """Generate audio from a dialogue."""
-  try:
-    audio = el_generate(
-      text=text,
-      model=sidebar_data.model_id,
-      voice = Voice(
-        voice_id=voice_id,
-        settings=VoiceSettings(
-          stability=sidebar_data.stability,
-          similarity_boost=sidebar_data.simarlity_boost,
-          style=sidebar_data.style
-        )
+  return el_generate(
+    text=text,
+    model=sidebar_data.model_id,
+    voice = Voice(
+      voice_id=voice_id,
+      settings=VoiceSettings(
+        stability=sidebar_data.stability,
+        similarity_boost=sidebar_data.simarlity_boost,
+        style=sidebar_data.style
       )
-    ) 
+    )
+  ) 
+
+
+@timed("synthesize")
+def generate(
+  text: str,
+  voice_id: str,
+  sidebar_data: SidebarData,
+  priority: int = rate_limit.BULK,
+  on_wait: callable = None
+) -> bytes:
+  """Generate audio from a dialogue, taking turns with the other sessions if the API key is rate limited."""
+  limiter = rate_limit.get_rate_limiter()
+  try:
+    if limiter is None:
+      return request_speech(text, voice_id, sidebar_data)
+    for attempt in range(THROTTLE_RETRIES + 1):
+      with limiter.acquire(sidebar_data.el_key, len(text), priority, on_wait):
+        try:
+          return request_speech(text, voice_id, sidebar_data)
+        except Exception as e:
+          if attempt == THROTTLE_RETRIES or not rate_limit.is_throttled(e):
+            raise
+      limiter.back_off(sidebar_data.el_key, 2 ** attempt)
   except:
     traceback.print_exc()
-  return audio
+    raise
 
 
 def generate_and_save(
   text: str,
   voice_id: str,
   line: int,
-  sidebar_data: SidebarData
+  sidebar_data: SidebarData,
+  workspace: Workspace = None,
+  priority: int = rate_limit.BULK,
+  on_wait: callable = None
 ) -> str:
   """Generate audio from a dialogue and save it to a file."""
-  audio = generate(text, voice_id, sidebar_data)
-  audio_file = f"./session/{st.session_state.session_id}/audio/line{line}.wav"
+  audio = generate(text, voice_id, sidebar_data, priority, on_wait)
+  audio_file = (workspace or get_session_workspace()).line_file(line)
   os.makedirs(os.path.dirname(audio_file), exist_ok=True)
-  with open(audio_file, "wb") as f:
+  blobs.detach(audio_file)
+  with span("write"), open(audio_file, "wb") as f:
     f.write(audio)  
   return audio_file
 
 
-def export_source_audio(
+class SpeechPipeline:
+  """Synthesizes lines in the background while the rest of the dialogue is still being written."""
+  def __init__(self, sidebar_data: SidebarData, workspace: Workspace, workers: int = PIPELINE_WORKERS) -> None:
+    self.sidebar_data = sidebar_data
+    self.workspace = workspace
+    self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="speech")
+    self.futures: dict[int, Future] = {}
+
+  def submit(self, line: int, text: str, voice_id: str) -> None:
+    self.futures[line] = self.executor.submit(generate_and_save, text, voice_id, line, self.sidebar_data, self.workspace)
+
+  def wait(self, progress: type[Progress] = StreamlitProgress) -> (list[str], list[int]):
+    """Wait for the submitted lines, returning their audio files in line order and the lines that failed."""
+    audio_files = []
+    failed = []
+    if len(self.futures) > 0:
+      generate_audio_bar = progress("Generating audio...")
+      for i, (line, future) in enumerate(sorted(self.futures.items())):
+        try:
+          audio_files.append(future.result())
+        except Exception as e:
+          log(f"unable to synthesize line {line}: {e}")
+          failed.append(line)
+        generate_audio_bar.update((i+1) / len(self.futures))
+      generate_audio_bar.done()
+    self.executor.shutdown()
+    return audio_files, failed
+
+  def cancel(self) -> None:
+    """Drop the lines that have not started and wait for the ones being synthesized, so nothing is written afterwards."""
+    self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def get_export_entries(
   lines_to_copy: list[int], 
   src_dir: str, 
-  dst_dir: str,
+  archive_dir: str,
   include_dialogue: bool
-) -> None:
-  """Export the audio files from source to destination."""
-  if not os.path.exists(src_dir) or len(os.listdir(src_dir)) == 0:
-    return
-  if os.path.exists(dst_dir):
-    shutil.rmtree(dst_dir)
-  os.makedirs(dst_dir, exist_ok=True)
-  
+) -> list[(str, str)]:
+  """Get the session audio files to export with their names in the project archive."""
+  if not os.path.exists(src_dir):
+    return []
+  entries = []
   for line in lines_to_copy:
-    try:
-      shutil.copy(f"{src_dir}/line{line}.wav", f"{dst_dir}/line{line}.wav")
-    except:
+    if os.path.exists(f"{src_dir}/line{line}.wav"):
+      entries.append((f"{src_dir}/line{line}.wav", f"{archive_dir}/line{line}.wav"))
+    else:
       log(f"line{line}.wav does not exist")
-      
   if include_dialogue and os.path.exists(f"{src_dir}/dialogue.mp3"):
-    shutil.copy(f"{src_dir}/dialogue.mp3", f"{dst_dir}/dialogue.mp3")
-
+    entries.append((f"{src_dir}/dialogue.mp3", f"{archive_dir}/dialogue.mp3"))
+  return entries
 
-def export_audio(lines_to_copy: list[int], include_dialogue: bool = True) -> str:
-  """Export the audio files from the audio folder to the export folder."""
-  line_src_dir = f"./session/{st.session_state.session_id}/audio"
-  final_src_dir = f"./session/{st.session_state.session_id}/final/audio"
-  line_dst_dir = f"./session/{st.session_state.session_id}/export/audio"
-  final_dst_dir = f"./session/{st.session_state.session_id}/export/final/audio"
 
-  export_source_audio(lines_to_copy, line_src_dir, line_dst_dir, include_dialogue)
-  export_source_audio(lines_to_copy, final_src_dir, final_dst_dir, include_dialogue)
-  return f"./session/{st.session_state.session_id}/export"  
+def write_project(
+  file: any, 
+  dialogue_export: str, 
+  lines_to_copy: list[int], 
+  include_dialogue: bool = True,
+  workspace: Workspace = None
+) -> None:
+  """Write the project archive to a file, storing the audio uncompressed straight from the session files."""
+  workspace = workspace or get_session_workspace()
+  entries = get_export_entries(lines_to_copy, workspace.audio_path, "audio", include_dialogue)
+  entries += get_export_entries(lines_to_copy, workspace.final_audio_path, "final/audio", include_dialogue)
+  with zipfile.ZipFile(file, "w") as package:
+    package.writestr("dialogue.txt", dialogue_export, compress_type=zipfile.ZIP_DEFLATED)
+    for src, archive_name in entries:
+      package.write(src, archive_name, compress_type=zipfile.ZIP_STORED)
+
+
+def export_project(dialogue_export: str, lines_to_copy: list[int], include_dialogue: bool = True, workspace: Workspace = None) -> bytes:
+  """Create the project archive in memory (the audio is stored straight from the session files, so nothing is written to disk)."""
+  buffer = io.BytesIO()
+  write_project(buffer, dialogue_export, lines_to_copy, include_dialogue, workspace)
+  return buffer.getvalue()
 
 
 def import_source_audio(src_dir: str, dst_dir: str) -> None:
-  shutil.copytree(src_dir, dst_dir, dirs_exist_ok=True) 
+  blobs.link_tree(src_dir, dst_dir)
 
 
-def import_audio(src_dir: str) -> list[str]:
-  dest_audio = f"./session/{st.session_state.session_id}/audio"
-  dest_final_audio = f"./session/{st.session_state.session_id}/final/audio"
+def import_audio(src_dir: str, workspace: Workspace = None) -> list[str]:
+  workspace = workspace or get_session_workspace()
+  dest_audio = workspace.audio_path
+  dest_final_audio = workspace.final_audio_path
   if os.path.exists(dest_audio):
     shutil.rmtree(dest_audio)
   if os.path.exists(dest_final_audio):
@@ -204,16 +378,101 @@ def import_audio(src_dir: str) -> list[str]:
     import_source_audio(final_dir, dest_final_audio)
   else:
     if os.path.exists(f"{final_dir}/dialogue.mp3"):
-      shutil.copy(f"{final_dir}/dialogue.mp3", f"{dest_final_audio}/dialogue.mp3")
+      blobs.link_file(f"{final_dir}/dialogue.mp3", f"{dest_final_audio}/dialogue.mp3")
     import_source_audio(line_dir, dest_final_audio)
   return glob.glob(f"{dest_audio}/line*.wav")
 
 
-def get_generated_audio() -> list[str]:
+LINE_MEMBER_PATTERN = re.compile(r"audio/line\d+\.wav")
+FINAL_MEMBER_PATTERN = re.compile(r"final/audio/(line\d+\.wav|dialogue\.mp3)")
+
+def is_project_audio_member(member: str) -> bool:
+  """Check whether a project zip member is one of the audio files the app exports."""
+  return LINE_MEMBER_PATTERN.fullmatch(member) is not None or FINAL_MEMBER_PATTERN.fullmatch(member) is not None
+
+
+def plan_zip_import(members: list[str], workspace: Workspace = None) -> list[(str, list[str])]:
+  """Map each audio member of a project zip to the session files it should be extracted to."""
+  workspace = workspace or get_session_workspace()
+  dest_audio = workspace.audio_path
+  dest_final_audio = workspace.final_audio_path
+  # only the files the app writes are accepted, so a crafted member name cannot point outside the session
+  line_members = [m for m in members if LINE_MEMBER_PATTERN.fullmatch(m)]
+  final_members = [m for m in members if FINAL_MEMBER_PATTERN.fullmatch(m)]
+  final_lines_included = any(os.path.basename(m).startswith("line") for m in final_members)
+  
+  plan = []
+  if "final/audio/dialogue.mp3" in final_members and not final_lines_included:
+    plan.append(("final/audio/dialogue.mp3", [f"{dest_final_audio}/dialogue.mp3"]))
+  for member in line_members:
+    relative_path = member[len("audio/"):]
+    destinations = [f"{dest_audio}/{relative_path}"]
+    if not final_lines_included:
+      destinations.append(f"{dest_final_audio}/{relative_path}")
+    plan.append((member, destinations))
+  if final_lines_included:
+    for member in final_members:
+      plan.append((member, [f"{dest_final_audio}/{member[len('final/audio/'):]}"]))
+  return plan
+
+
+def extract_zip_audio(package: zipfile.ZipFile, plan: list[(str, list[str])]) -> None:
+  """Extract each planned member once into the blob store and link it to its session files."""
+  for member, destinations in plan:
+    with package.open(member) as stream:
+      blob_hash = blobs.store_stream(stream)
+    for destination in destinations:
+      blobs.link_blob(blob_hash, destination)
+  log(f"extracted {len(plan)} audio files")
+
+
+def clear_session_audio(workspace: Workspace = None) -> None:
+  """Remove the line and final audio of the session."""
+  workspace = workspace or get_session_workspace()
+  dest_audio = workspace.audio_path
+  dest_final_audio = workspace.final_audio_path
+  if os.path.exists(dest_audio):
+    shutil.rmtree(dest_audio)
+  if os.path.exists(dest_final_audio):
+    shutil.rmtree(dest_final_audio)
+  os.makedirs(dest_audio, exist_ok=True)
+  os.makedirs(dest_final_audio, exist_ok=True)
+
+
+def get_import_line_files(plan: list[(str, list[str])], workspace: Workspace = None) -> list[str]:
+  """Get the session line files that a project import will create."""
+  dest_audio = (workspace or get_session_workspace()).audio_path
+  return [f"{dest_audio}/{m[len('audio/'):]}" for m, _ in plan if LINE_MEMBER_PATTERN.fullmatch(m)]
+
+
+def import_audio_from_zip(package: zipfile.ZipFile, executor: ThreadPoolExecutor, workspace: Workspace = None) -> (list[str], Future):
+  """Clear the session audio and extract the project audio in the background, returning the expected line files."""
+  workspace = workspace or get_session_workspace()
+  clear_session_audio(workspace)
+  plan = plan_zip_import(package.namelist(), workspace)
+  return get_import_line_files(plan, workspace), executor.submit(extract_zip_audio, package, plan)
+
+
+def link_project_audio(members: dict[str, str], metadata: dict[str, AudioMetadata] = None, workspace: Workspace = None) -> list[str]:
+  """Replace the session audio with links to the blobs of an already extracted project."""
+  metadata = metadata or {}
+  workspace = workspace or get_session_workspace()
+  clear_session_audio(workspace)
+  plan = plan_zip_import(list(members.keys()), workspace)
+  for member, destinations in plan:
+    for destination in destinations:
+      blobs.link_blob(members[member], destination)
+      if member in metadata:
+        remember_audio_metadata(destination, metadata[member])
+  return get_import_line_files(plan, workspace)
+
+
+def get_generated_audio(workspace: Workspace = None) -> list[str]:
   """Return whether the audio files have been generated."""
-  return glob.glob(f"./session/{st.session_state.session_id}/audio/line*.wav")
+  return glob.glob(f"{(workspace or get_session_workspace()).audio_path}/line*.wav")
 
 
+@timed("waveform")
 def generate_waveform(audio: seg, y_max: float = None) -> (int, plt.Figure):
   """Generate a waveform plot figure from the mp3 file."""  
   audio_array = np.frombuffer(audio.raw_data, dtype=np.int16)
@@ -233,30 +492,96 @@ def generate_waveform(audio: seg, y_max: float = None) -> (int, plt.Figure):
   return max_y, fig
 
 
+def get_peaks(audio: seg, bins: int = 2000) -> np.ndarray:
+  """Get the lowest and highest sample of each bin of the audio for drawing its waveform."""
+  audio_array = np.frombuffer(audio.raw_data, dtype=np.int16)
+  if len(audio_array) == 0:
+    return np.zeros((1, 2), dtype=np.int16)
+  bins = min(bins, len(audio_array))
+  starts = np.linspace(0, len(audio_array), bins + 1).astype(int)[:-1]
+  return np.stack([np.minimum.reduceat(audio_array, starts), np.maximum.reduceat(audio_array, starts)], axis=1)
+
+
+def get_audio_metadata(audio_file: str) -> AudioMetadata:
+  audio: seg = seg.from_file(audio_file)
+  return AudioMetadata(audio.duration_seconds, get_peaks(audio))
+
+
+def get_wav_metadata(audio_bytes: bytes) -> AudioMetadata:
+  audio: seg = seg.from_wav(io.BytesIO(audio_bytes))
+  return AudioMetadata(audio.duration_seconds, get_peaks(audio))
+
+
+def run_waveform_task(func: callable, *args) -> AudioMetadata:
+  """Get the waveform peaks on the audio pool, or in the script thread if the pool is turning work away."""
+  try:
+    return run_audio_task("waveform", func, *args)
+  except PoolBusyError:
+    return func(*args)
+
+
+def remember_audio_metadata(audio_file: str, metadata: AudioMetadata) -> None:
+  """Remember precomputed metadata for a session file until the file is replaced."""
+  if "audio_metadata" not in st.session_state:
+    st.session_state["audio_metadata"] = {}
+  st.session_state["audio_metadata"][audio_file] = (os.stat(audio_file).st_ino, metadata)
+
+
+def get_remembered_audio_metadata(audio_file: str) -> AudioMetadata:
+  if "audio_metadata" not in st.session_state or audio_file not in st.session_state["audio_metadata"]:
+    return None
+  inode, metadata = st.session_state["audio_metadata"][audio_file]
+  if not os.path.exists(audio_file) or os.stat(audio_file).st_ino != inode:
+    del st.session_state["audio_metadata"][audio_file]
+    return None
+  return metadata
+
+
+@timed("waveform")
+def generate_waveform_from_peaks(metadata: AudioMetadata, y_max: float = None) -> (int, plt.Figure):
+  """Generate a waveform plot figure from precomputed peaks."""
+  time_axis = np.linspace(0, metadata.duration, len(metadata.peaks))
+  fig, ax = plt.subplots()
+  plt.gca().axis("off")
+  ax.fill_between(time_axis, metadata.peaks[:, 0], metadata.peaks[:, 1])
+  
+  if y_max:
+    ax.set_ylim(-y_max, y_max)
+  _, max_y = ax.get_ylim()
+  fig.set_figheight(2)
+  
+  return max_y, fig
+
+
 def generate_waveform_from_file(audio_file: str, y_max: float = None) -> (int, plt.Figure):
-  status = st.spinner("Generating waveform...")
-  with status:
-    audio: seg = seg.from_mp3(audio_file)
-    result = generate_waveform(audio, y_max)
-  return result
+  metadata = get_remembered_audio_metadata(audio_file)
+  if metadata is not None:
+    return generate_waveform_from_peaks(metadata, y_max)
+  with st.spinner("Generating waveform..."):
+    metadata = run_waveform_task(get_audio_metadata, audio_file)
+  return generate_waveform_from_peaks(metadata, y_max)
 
 
 def generate_waveform_from_bytes(audio_bytes: bytes, y_max: float) -> (int, plt.Figure):
   with st.spinner("Generating waveform..."):
-    audio: seg = seg.from_wav(io.BytesIO(audio_bytes))
-    return generate_waveform(audio, y_max)
+    metadata = run_waveform_task(get_wav_metadata, audio_bytes)
+  return generate_waveform_from_peaks(metadata, y_max)
 
 
+@timed("master")
 def normalize_final_audio(dialogue_path: str) -> None:
   """Normalize the final audio."""
   log("applying audiobook normalization")
-  audio = seg.from_mp3(f"{dialogue_path}/dialogue.mp3")
+  with span("decode"):
+    audio = seg.from_mp3(f"{dialogue_path}/dialogue.mp3")
   soundboard = Soundboard([
     CompressorEdit(threshold=-23, ratio=2, attack=150, release=150), 
     LimiterEdit(threshold=-1, release=250)
   ])
   audio = apply_soundboard(audio, soundboard)
-  audio.export(f"{dialogue_path}/dialogue.mp3", format="mp3")   
+  blobs.detach(f"{dialogue_path}/dialogue.mp3")
+  with span("encode"):
+    audio.export(f"{dialogue_path}/dialogue.mp3", format="mp3")   
 
 
 def overlap_and_extend(one: seg, two: seg, overlap: int) -> seg:
@@ -276,15 +601,17 @@ def join_files(
   for line in audio_lines:
     audio_file = f"{source_path}/{line.file}"
     if os.path.exists(audio_file):
-      if final_audio is None:
-        final_audio = seg.from_file(audio_file)
-      else:
-        final_audio += gap + seg.from_file(audio_file).fade_out(300)
+      with span("decode"):
+        audio = seg.from_file(audio_file)
+      with span("join"):
+        final_audio = audio if final_audio is None else final_audio + gap + audio.fade_out(300)
     else:
       log(f"audio file does not exist: {audio_file}")
 
   format = os.path.splitext(os.path.basename(destination_filename))[1].replace(".", "")
-  final_audio.export(destination_filename, format=format)  
+  blobs.detach(destination_filename)
+  with span("encode"):
+    final_audio.export(destination_filename, format=format)  
 
 
 def join_lines(
@@ -324,18 +651,22 @@ def join_parts(
   )
   
 
+@timed("join_audio")
 def join_audio(
   line_indices: list[int], 
   join_gap: int = 200, 
   source_path: str = None,
   destination_path: str = None,
-  copy_lines: bool = True
+  copy_lines: bool = True,
+  workspace: Workspace = None,
+  progress: type[Progress] = StreamlitProgress
 ) -> None:
   """Join audio files found in the audio folder together with a gap in between with optional normalization."""
   if source_path is None or destination_path is None:
-    source_path = f"./session/{st.session_state.session_id}/audio"
-    destination_path = f"./session/{st.session_state.session_id}/final/audio"
-    parts_path = f"./session/{st.session_state.session_id}/final/parts"
+    workspace = workspace or get_session_workspace()
+    source_path = workspace.audio_path
+    destination_path = workspace.final_audio_path
+  parts_path = f"{os.path.dirname(destination_path)}/parts"
     
   if os.path.exists(destination_path):
     shutil.rmtree(destination_path)
@@ -346,48 +677,63 @@ def join_audio(
   
   audio_files = [f"{source_path}/line{i}.wav" for i in line_indices]
   if copy_lines:
-    shutil.copytree(source_path, destination_path, dirs_exist_ok=True)
+    blobs.link_tree(source_path, destination_path)
   log(f"joining {len(audio_files)} audio files: {line_indices}")
   
   gap = seg.silent(join_gap)
   segments: list[seg] = []
-  progress_text = "Preparing audio..."
-  joining_audio_bar = st.progress(0, text=progress_text)          
+  joining_audio_bar = progress("Preparing audio...")
   for i, file in enumerate(audio_files):
     if os.path.exists(file):
-      segments.append(seg.from_mp3(file))
-    joining_audio_bar.progress(round((i+1) / len(audio_files), 2), text=progress_text)
-  joining_audio_bar.empty()
+      with span("decode"):
+        segments.append(seg.from_mp3(file))
+    joining_audio_bar.update((i+1) / len(audio_files))
+  joining_audio_bar.done()
     
-  progress_text = "Joining audio..."
-  joining_audio_bar = st.progress(0, text=progress_text) 
+  joining_audio_bar = progress("Joining audio...")
   final_audio = segments[0]
-  for i, s in enumerate(segments[1:]):
-    final_audio += gap + s.fade_out(300)
-    joining_audio_bar.progress(round((i+1) / len(segments[1:]), 2), text=progress_text)  
-  
-  final_audio.export(f"{destination_path}/dialogue.mp3", format="mp3") 
-  joining_audio_bar.empty()
+  with span("join"):
+    for i, s in enumerate(segments[1:]):
+      final_audio += gap + s.fade_out(300)
+      joining_audio_bar.update((i+1) / len(segments[1:]))
   
-  if "background_added" in st.session_state:
-    del st.session_state["background_added"]
+  with span("encode"):
+    final_audio.export(f"{destination_path}/dialogue.mp3", format="mp3") 
+  joining_audio_bar.done()
   
   
-def clear_audio_files() -> None:
+def clear_audio_files(workspace: Workspace = None) -> None:
   """Clear all audio files from the audio directory."""
-  shutil.rmtree(f"./session/{st.session_state.session_id}/audio", ignore_errors=True)
-  os.makedirs(f"./session/{st.session_state.session_id}/audio", exist_ok=True)
+  audio_path = (workspace or get_session_workspace()).audio_path
+  shutil.rmtree(audio_path, ignore_errors=True)
+  os.makedirs(audio_path, exist_ok=True)
 
  
 def segment_to_bytes(segment: seg) -> bytes:
   if segment is None:
     return None
   buffer = io.BytesIO()
-  segment.export(buffer, format="wav")
+  with span("encode"):
+    segment.export(buffer, format="wav")
   audio_bytes = buffer.getvalue()
   return audio_bytes 
 
 
+def segment_to_array(segment: seg) -> np.ndarray:
+  """Convert an audio segment into a float array of shape (frames, channels) in the range [-1, 1]."""
+  samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
+  samples = samples.reshape((-1, segment.channels))
+  return samples / float(1 << (8 * segment.sample_width - 1))
+
+
+def array_to_segment(samples: np.ndarray, like: seg) -> seg:
+  """Convert a float array of shape (frames, channels) back into an audio segment shaped like `like`."""
+  scale = float(1 << (8 * like.sample_width - 1))
+  dtype = { 1: np.int8, 2: np.int16, 4: np.int32 }[like.sample_width]
+  samples = np.clip(samples * scale, -scale, scale - 1).astype(dtype)
+  return like._spawn(samples.tobytes())
+
+
 def apply_soundboard(audio: seg, soundboard: Soundboard) -> seg:
   """Apply the soundboard to the audio."""
   pedals = soundboard.enabled_pedals()
@@ -396,28 +742,10 @@ def apply_soundboard(audio: seg, soundboard: Soundboard) -> seg:
     return audio
   
   log(f"applying soundboard {', '.join(soundboard.pedal_adjustments())}")
-  temp_input_filepath = f"./session/{st.session_state.session_id}/temp/in.wav"
-  temp_output_filepath = f"./session/{st.session_state.session_id}/temp/out.wav"
-  os.makedirs(os.path.dirname(temp_input_filepath), exist_ok=True)
-  os.makedirs(os.path.dirname(temp_output_filepath), exist_ok=True)
-  
-  audio.export(temp_input_filepath, format="wav")
-  samplerate = 44100.0
-  with AudioFile(temp_input_filepath).resampled_to(samplerate) as f:
-    temp_in = f.read(f.frames)
-    
-  pedalboard = Pedalboard(pedals)  
-  samples = pedalboard(temp_in, samplerate)
-  with AudioFile(
-    temp_output_filepath, 
-    "w", 
-    samplerate, 
-    samples.shape[0]
-  ) as f:
-    f.write(samples)
-  new_audio = seg.from_wav(temp_output_filepath)
-  os.remove(temp_input_filepath)
-  os.remove(temp_output_filepath)
+  audio = audio.set_frame_rate(44100)
+  pedalboard = Pedalboard(pedals)
+  samples = pedalboard(segment_to_array(audio).T, float(audio.frame_rate))
+  new_audio = array_to_segment(samples.T, audio)
   return new_audio
 
 
@@ -447,63 +775,204 @@ def apply_basic(audio: seg, soundboard: Soundboard) -> seg:
   return audio  
 
 
-def prepare_background(dialogue_file: str, background_file: str, edit: BackgroundEdit) -> (seg, seg):
+def speech_envelope(
+  speech: np.ndarray, 
+  frame_rate: int, 
+  window: int = 20, 
+  threshold: float = -40.0
+) -> np.ndarray:
+  """Get whether the windowed RMS level (dBFS) of the speech is above the threshold for each window."""
+  window_frames = max(1, int(frame_rate * window / 1000))
+  num_windows = ceil(len(speech) / window_frames)
+  mono = speech.mean(axis=1) if speech.ndim > 1 else speech
+  padded = np.zeros(num_windows * window_frames, dtype=np.float32)
+  padded[:len(mono)] = mono
+  rms = np.sqrt(np.mean(padded.reshape((num_windows, window_frames)) ** 2, axis=1))
+  rms_db = 20 * np.log10(np.maximum(rms, 1e-10))
+  return rms_db > threshold
+
+
+def ducking_gain(
+  active: np.ndarray, 
+  window: int = 20, 
+  attack: int = 150, 
+  release: int = 600, 
+  amount: float = 12.0
+) -> np.ndarray:
+  """Get the per window gain (linear) that ducks by `amount` dB whenever speech is active.
+  
+  The gain ramps down `attack` ms before speech starts and ramps back up `release` ms after it stops.
+  """
+  indices = np.arange(len(active))
+  never = len(active) + max(attack, release)
+  last_active = np.maximum.accumulate(np.where(active, indices, -never))
+  next_active = np.minimum.accumulate(np.where(active, indices, 2 * never)[::-1])[::-1]
+  release_depth = np.clip(1 - (indices - last_active) * window / max(release, 1), 0, 1)
+  attack_depth = np.clip(1 - (next_active - indices) * window / max(attack, 1), 0, 1)
+  depth = np.maximum(release_depth, attack_depth)
+  return 10 ** (-amount * depth / 20)
+
+
+def duck_background_gain(speech: np.ndarray, frame_rate: int, amount: float, window: int = 20) -> np.ndarray:
+  """Get the per frame gain (linear) that lowers the background audio underneath the speech."""
+  log(f"ducking background by {amount}dB")
+  active = speech_envelope(speech, frame_rate, window)
+  gain = ducking_gain(active, window, amount=amount)
+  window_frames = max(1, int(frame_rate * window / 1000))
+  window_centers = np.arange(len(gain)) * window_frames + window_frames / 2
+  return np.interp(np.arange(len(speech)), window_centers, gain).astype(np.float32)
+
+
+def fade_gain(frames: int, fade_frames: int, fade_in: bool, fade_out: bool) -> np.ndarray:
+  """Get the per frame gain (linear) of a fade in and/or fade out over `fade_frames` frames."""
+  gain = np.ones(frames, dtype=np.float32)
+  fade_frames = min(fade_frames, frames)
+  if fade_frames == 0:
+    return gain
+  # linear in amplitude from -120 dBFS like the pydub fades
+  ramp = np.linspace(10 ** -6, 1, fade_frames, dtype=np.float32)
+  if fade_in:
+    gain[:fade_frames] *= ramp
+  if fade_out:
+    gain[frames - fade_frames:] *= ramp[::-1]
+  return gain
+
+
+@st.cache_resource(max_entries=32)
+def load_asset_samples(asset_file: str, frame_rate: int, channels: int, modified: float) -> np.ndarray:
+  """Decode an effect or background once into a read-only array matching the dialogue format."""
+  log(f"decoding {asset_file}")
+  asset: seg = seg.from_file(asset_file)
+  asset = asset.set_frame_rate(frame_rate).set_channels(channels)
+  samples = segment_to_array(asset)
+  samples.flags.writeable = False
+  return samples
+
+
+def get_library_path(asset_file: str) -> str:
+  """Get the pre-transcoded library file of an asset (e.g. `./effects/x.wav` is `./library/effects/x.npy`)."""
+  asset_dir, asset_name = os.path.split(asset_file)
+  root, folder = os.path.split(asset_dir)
+  name = os.path.splitext(asset_name)[0]
+  return f"{root}/library/{folder}/{name}.npy"
+
+
+def transcode_asset(asset_file: str, library_file: str = None) -> str:
+  """Transcode an asset into the library at the library frame rate unless it is already up to date."""
+  library_file = library_file or get_library_path(asset_file)
+  if os.path.exists(library_file) and os.path.getmtime(library_file) >= os.path.getmtime(asset_file):
+    return library_file
+  
+  log(f"transcoding {asset_file}")
+  asset: seg = seg.from_file(asset_file).set_frame_rate(LIBRARY_FRAME_RATE)
+  samples = segment_to_array(asset)
+  os.makedirs(os.path.dirname(library_file), exist_ok=True)
+  temp_file = f"{library_file}.{uuid.uuid4()}.tmp"
+  with open(temp_file, "wb") as f:
+    np.save(f, samples)
+  os.replace(temp_file, library_file)
+  return library_file
+
+
+def build_library(asset_files: list[str]) -> None:
+  """Transcode the assets into the library."""
+  for asset_file in asset_files:
+    try:
+      transcode_asset(asset_file)
+    except:
+      log(f"unable to transcode {asset_file}")
+
+
+@st.cache_resource
+def build_default_library() -> None:
+  """Transcode the default effects and backgrounds once per server."""
+  build_library(get_default_effects() + get_default_backgrounds())
+
+
+def match_channels(samples: np.ndarray, channels: int) -> np.ndarray:
+  """Match the channels of the samples, using a broadcast view when going from mono to more channels."""
+  if samples.shape[1] == channels:
+    return samples
+  if samples.shape[1] == 1:
+    return np.broadcast_to(samples, (len(samples), channels))
+  mono = samples.mean(axis=1, keepdims=True)
+  return mono if channels == 1 else np.broadcast_to(mono, (len(mono), channels))
+
+
+def get_asset_samples(asset_file: str, frame_rate: int, channels: int) -> np.ndarray:
+  """Get an effect or background as a memory-mapped library array (decoded from the cache when the rate differs)."""
+  if frame_rate != LIBRARY_FRAME_RATE:
+    return load_asset_samples(asset_file, frame_rate, channels, os.path.getmtime(asset_file))
+  library_file = transcode_asset(asset_file)
+  samples = np.load(library_file, mmap_mode="r")
+  return match_channels(samples, channels)
+
+
+def prepare_background(dialogue: seg, background_file: str, edit: BackgroundEdit) -> (np.ndarray, np.ndarray, np.ndarray):
+  """Get the dialogue samples, the background bed, and the per frame gain to mix the bed with."""
   if not edit.is_enabled():
     return None
   
-  dialogue: seg = seg.from_mp3(dialogue_file)
-  background: seg = seg.from_mp3(background_file)
-  if len(background) > len(dialogue):
-    background = background[:len(dialogue)]
-  if len(dialogue) > len(background):
-    difference = len(dialogue) - len(background)
-    repeats = ceil(difference / len(background)) + 1
-    background = background * repeats
-    background = background[:len(dialogue)]
-  if edit.volume > 0:
-    background = background - edit.volume
-  if edit.fade_in:
-    background = background.fade_in(800)
-  if edit.fade_out:
-    background = background.fade_out(800)
-  return dialogue, background
+  speech = segment_to_array(dialogue)
+  bed = get_asset_samples(background_file, dialogue.frame_rate, dialogue.channels)
+  gain = np.full(len(speech), 10 ** (-edit.volume / 20) if edit.volume > 0 else 1.0, dtype=np.float32)
+  if edit.duck:
+    gain *= duck_background_gain(speech, dialogue.frame_rate, edit.duck_amount)
+  if edit.fade_in or edit.fade_out:
+    gain *= fade_gain(len(speech), int(dialogue.frame_rate * 0.8), edit.fade_in, edit.fade_out)
+  return speech, bed, gain
+
+
+def add_looped(buffer: np.ndarray, source: np.ndarray, gain: np.ndarray, start: int = 0) -> None:
+  """Add the source into the buffer at `start` for `len(gain)` frames, looping the source by index instead of copying it."""
+  frames = len(gain)
+  source_frames = len(source)
+  for offset in range(0, frames, source_frames):
+    end = min(offset + source_frames, frames)
+    buffer[start + offset:start + end] += source[:end - offset] * gain[offset:end, None]
+
+
+def mix_background(speech: np.ndarray, bed: np.ndarray, gain: np.ndarray) -> np.ndarray:
+  """Mix the background bed underneath the speech."""
+  if len(bed) == 0:
+    return speech
+  mixed = speech.copy()
+  add_looped(mixed, bed, gain)
+  return mixed
 
 
 def apply_special_effect(audio: seg, soundboard: Soundboard) -> seg:
-  special_effect = soundboard.special_effect()
-  if special_effect.is_enabled():
-    log("applying effect")
-    effect_path = special_effect.path
-    effect_volume = special_effect.volume
-    effect_repeat = special_effect.repeat
-    start_effect = special_effect.start
-    effect_fade_out = special_effect.fade_out
-    
-    effect: seg = seg.from_file(effect_path)
-    if effect_volume:
-      effect = effect + effect_volume
-    if effect_repeat:
-      effect = effect * effect_repeat
-    
-    audio_duration = audio.duration_seconds
-    effect_duration = effect.duration_seconds
-    effect_total_duration = effect_duration + start_effect
-    default_effect_fade_out = effect_fade_out if effect_fade_out is not None and effect_fade_out > 0 else 1000
-
-    if effect_total_duration > audio_duration:
-      effect_excess = effect_total_duration - audio_duration
-      effect = effect[:int((effect_duration - effect_excess) * 1000)]
-      effect = effect.fade_out(default_effect_fade_out)
-    elif effect_fade_out:
-      effect = effect.fade_out(effect_fade_out)
+  """Mix every special effect into the audio in a single pass."""
+  special_effects = soundboard.special_effects()
+  if len(special_effects) == 0:
+    return audio
+  
+  log(f"applying effects {', '.join(e.name for e in special_effects)}")
+  mixed = segment_to_array(audio)
+  for special_effect in special_effects:
+    start = int(special_effect.start * audio.frame_rate)
+    if start >= len(mixed):
+      continue
+    effect = get_asset_samples(special_effect.path, audio.frame_rate, audio.channels)
+    if len(effect) == 0:
+      continue
+    repeat = max(special_effect.repeat or 1, 1)
+    frames = min(len(effect) * repeat, len(mixed) - start)
     
-    audio = audio.overlay(effect, position=start_effect * 1000)  
-  return audio
+    effect_exceeds = len(effect) * repeat > frames
+    fade_out = special_effect.fade_out if special_effect.fade_out else (1000 if effect_exceeds else 0)
+    gain = fade_gain(frames, int(audio.frame_rate * fade_out / 1000), False, True)
+    if special_effect.volume:
+      gain *= 10 ** (special_effect.volume / 20)
+    add_looped(mixed, effect, gain, start)
+  return array_to_segment(mixed, audio)
 
 
+@timed("edit")
 def apply_edits(audio_path: str, soundboard: Soundboard) -> seg:
   """Apply the soundboard edits to the audio."""
-  audio: seg = seg.from_mp3(audio_path)
+  with span("decode"):
+    audio: seg = seg.from_mp3(audio_path)
   audio = apply_basic(audio, soundboard)
   audio = apply_soundboard(audio, soundboard)
   audio = apply_special_effect(audio, soundboard)
@@ -536,11 +1005,6 @@ def get_default_effects() -> list[str]:
   return glob.glob("./effects/*")
 
 
-def get_session_effects() -> list[str]:
-  """Get the effects from the effects folder."""
-  return glob.glob(f"./session/{st.session_state.session_id}/effects/*")
-
-
 def process_audio_file_name(file: str) -> str:
   """Process the effect filename."""
   name = os.path.splitext(os.path.basename(file))[0]
@@ -548,71 +1012,174 @@ def process_audio_file_name(file: str) -> str:
   return name
 
 
-@st.cache_data
+def get_asset_info(asset_file: str) -> AssetInfo:
+  """Get the metadata of an asset from its library file."""
+  info = AssetInfo(
+    process_audio_file_name(asset_file), 
+    asset_file, 
+    hash=blobs.get_file_hash(asset_file), 
+    modified=os.path.getmtime(asset_file)
+  )
+  try:
+    samples = np.load(transcode_asset(asset_file), mmap_mode="r")
+    info.frame_rate = LIBRARY_FRAME_RATE
+    info.channels = samples.shape[1]
+    info.duration = len(samples) / LIBRARY_FRAME_RATE
+  except:
+    log(f"unable to read metadata for {asset_file}")
+  return info
+
+
+@st.cache_resource
+def get_default_catalog(folder: str) -> AssetCatalog:
+  """Get the catalog of the default assets (shared by all sessions)."""
+  return AssetCatalog(f"./{folder}")
+
+
+def get_session_catalog(folder: str) -> AssetCatalog:
+  """Get the catalog of the assets uploaded in this session."""
+  key = f"{folder}_catalog"
+  if key not in st.session_state:
+    st.session_state[key] = AssetCatalog(f"./session/{st.session_state.session_id}/{folder}")
+  return st.session_state[key]
+
+
 def get_default_effect_names() -> list[str]:
   """Get the effect names from the effects folder."""
-  names = [process_audio_file_name(f) for f in get_default_effects()]
-  return names
+  return get_default_catalog("effects").names()
 
 
 def get_session_effect_names() -> list[str]:
   """Get the effect names from the session effects folder."""
-  names = [process_audio_file_name(f) for f in get_session_effects()]
-  return names
+  return get_session_catalog("effects").names()
 
 
 def get_effect_names() -> list[str]:
   default_effects = get_default_effect_names()
   session_effects = get_session_effect_names()
-  return sorted(default_effects + session_effects)
+  return sorted(set(default_effects + session_effects))
+
+
+@st.cache_resource
+def get_upload_executor() -> ThreadPoolExecutor:
+  """Get the background worker that transcodes uploads (shared by all sessions)."""
+  return ThreadPoolExecutor(max_workers=2, thread_name_prefix="upload")
+
+
+@st.cache_resource
+def get_transcoded_hashes() -> dict[str, str]:
+  """Get the library files of already transcoded uploads by content hash (shared by all sessions)."""
+  return {}
+
+
+def link_library_file(src: str, dst: str) -> None:
+  """Hardlink (or copy) a library file and mark it as newer than its asset."""
+  os.makedirs(os.path.dirname(dst), exist_ok=True)
+  temp_file = f"{dst}.{uuid.uuid4()}.tmp"
+  try:
+    os.link(src, temp_file)
+  except OSError:
+    shutil.copyfile(src, temp_file)
+  os.replace(temp_file, dst)
+  os.utime(dst)
 
 
-def save_sound_effect(audio: bytes, name: str) -> None:
-  audio: seg = seg.from_file(io.BytesIO(audio))
-  name = os.path.splitext(name)[0]
-  output_path = f"./session/{st.session_state.session_id}/effects/{name}.wav"
+def process_upload(job: UploadJob, catalog: AssetCatalog, transcoded_hashes: dict[str, str]) -> None:
+  """Transcode a staged upload into the library and then publish it to the catalog."""
+  try:
+    job.status = "transcoding"
+    job.progress = 0.2
+    library_file = get_library_path(job.path)
+    existing_file = transcoded_hashes.get(job.hash)
+    if existing_file and os.path.exists(existing_file):
+      log(f"reusing transcoded upload {existing_file}")
+      link_library_file(existing_file, library_file)
+    else:
+      transcode_asset(job.staging_path, library_file)
+    job.progress = 0.8
+    os.replace(job.staging_path, job.path)
+    os.utime(library_file)
+    transcoded_hashes[job.hash] = library_file
+    catalog.add(job.path)
+    job.status = "ready"
+    job.progress = 1.0
+  except:
+    traceback.print_exc()
+    job.status = "failed"
+    if os.path.exists(job.staging_path):
+      os.remove(job.staging_path)
+
+
+def get_upload_jobs(folder: str) -> list[UploadJob]:
+  """Get the uploads of this session for the folder."""
+  jobs = st.session_state["upload_jobs"] if "upload_jobs" in st.session_state else []
+  return [job for job in jobs if job.folder == folder]
+
+
+def clear_finished_upload_jobs(folder: str) -> None:
+  """Forget the uploads of this session for the folder that are done."""
+  if "upload_jobs" in st.session_state:
+    st.session_state["upload_jobs"] = [j for j in st.session_state["upload_jobs"] if j.folder != folder or not j.is_done()]
+
+
+def save_upload(audio: bytes, name: str, folder: str) -> UploadJob:
+  """Store the raw upload immediately and transcode it in the background."""
+  name, extension = os.path.splitext(name)
+  audio_hash = hashlib.sha1(audio).hexdigest()
+  catalog = get_session_catalog(folder)
+  output_path = f"./session/{st.session_state.session_id}/{folder}/{name}{extension.lower()}"
+  staging_path = f"./session/{st.session_state.session_id}/uploads/{audio_hash}_{name}{extension.lower()}"
+  job = UploadJob(process_audio_file_name(output_path), folder, output_path, staging_path, audio_hash)
+  if "upload_jobs" not in st.session_state:
+    st.session_state["upload_jobs"] = []
+  st.session_state["upload_jobs"].append(job)
+  
+  existing = catalog.get(job.name)
+  if existing and existing.hash == audio_hash:
+    log(f"upload {name} already exists")
+    job.status = "ready"
+    job.progress = 1.0
+    return job
+  
   os.makedirs(os.path.dirname(output_path), exist_ok=True)
-  audio.export(output_path, format="wav") 
+  os.makedirs(os.path.dirname(staging_path), exist_ok=True)
+  with open(staging_path, "wb") as f:
+    f.write(audio)
+  get_upload_executor().submit(process_upload, job, catalog, get_transcoded_hashes())
+  return job
 
 
-def get_default_backgrounds() -> list[str]:
-  """Get the backgrounds from the backgrounds folder."""
-  return glob.glob("./backgrounds/*")
+def save_sound_effect(audio: bytes, name: str) -> UploadJob:
+  return save_upload(audio, name, "effects")
 
 
-def get_session_backgrounds() -> list[str]:
+def get_default_backgrounds() -> list[str]:
   """Get the backgrounds from the backgrounds folder."""
-  return glob.glob(f"./session/{st.session_state.session_id}/backgrounds/*")
+  return glob.glob("./backgrounds/*")
 
 
 def get_default_background_names() -> list[str]:
   """Get the background names from the backgrounds folder."""
-  names = [process_audio_file_name(f) for f in get_default_backgrounds()]
-  return names
+  return get_default_catalog("backgrounds").names()
 
 
 def get_session_background_names() -> list[str]:
   """Get the background names from the session backgrounds folder."""
-  names = [process_audio_file_name(f) for f in get_session_backgrounds()]
-  return names
+  return get_session_catalog("backgrounds").names()
 
 
 def get_background_files() -> list[str]:
-  return get_default_backgrounds() + get_session_backgrounds()
+  return get_default_catalog("backgrounds").paths() + get_session_catalog("backgrounds").paths()
 
 
 def get_background_names() -> list[str]:
   default_backgrounds = get_default_background_names()
   session_backgrounds = get_session_background_names()
-  return sorted(default_backgrounds + session_backgrounds)
+  return sorted(set(default_backgrounds + session_backgrounds))
 
 
-def save_background_audio(audio: bytes, name: str) -> None:
-  audio: seg = seg.from_file(io.BytesIO(audio))
-  name = os.path.splitext(name)[0]
-  output_path = f"./session/{st.session_state.session_id}/backgrounds/{name}.mp3"
-  os.makedirs(os.path.dirname(output_path), exist_ok=True)
-  audio.export(output_path, format="mp3")
+def save_background_audio(audio: bytes, name: str) -> UploadJob:
+  return save_upload(audio, name, "backgrounds")
 
 
 def get_audio_duration(filename: str) -> float:
@@ -621,9 +1188,9 @@ def get_audio_duration(filename: str) -> float:
   return audio.duration_seconds
 
 
-def get_line_duration(line: int) -> float:
+def get_line_duration(line: int, workspace: Workspace = None) -> float:
   """Get the duration of the speech in seconds."""
-  filename = f"./session/{st.session_state.session_id}/audio/line{line}.wav"
+  filename = (workspace or get_session_workspace()).line_file(line)
   return len(seg.from_mp3(filename))
 
 
@@ -633,17 +1200,12 @@ def get_audio_max_decibels(filename: str) -> (int, int):
   return audio.max_dBFS
 
 
-def get_asset_path_from_name(name: str, folder: str) -> str:
-  name = name.replace(' ', '_')
-  files = glob.glob(f"./{folder}/{name}.*")
-  if files:
-    return files[0]
-  else:
-    files = glob.glob(f"./session/{st.session_state.session_id}/{folder}/{name}.*")
-    if files:
-      return files[0]
-    else:
-      return None
+def get_asset_path_from_name(name: str, folder: str, workspace: Workspace = None) -> str:
+  """Find an asset in the defaults or the uploads of the workspace (the browser session if it is not given)."""
+  name = name.replace('_', ' ')
+  uploads = get_session_catalog(folder) if workspace is None else AssetCatalog(f"{workspace.path}/{folder}")
+  asset = get_default_catalog(folder).get(name) or uploads.get(name)
+  return asset.path if asset else None
 
 
 def get_effect_path(name: str) -> str:
@@ -651,17 +1213,17 @@ def get_effect_path(name: str) -> str:
   return get_asset_path_from_name(name, "effects")
 
 
-def get_background_path(name: str) -> str:
+def get_background_path(name: str, workspace: Workspace = None) -> str:
   """Get the background path from the background name."""
-  return get_asset_path_from_name(name, "backgrounds")
+  return get_asset_path_from_name(name, "backgrounds", workspace)
 
 
-def apply_background_audio(background_edit: BackgroundEdit, destination_path: str) -> None:
-  background_files = get_background_files()
-  background_index = background_files.index(get_background_path(background_edit.name))
-  background_file = background_files[background_index]  
-  dialogue, background = prepare_background(destination_path, background_file, background_edit)
-  final_dialogue: seg = dialogue.overlay(background)
+@timed("background")
+def apply_background_audio(background_edit: BackgroundEdit, destination_path: str, workspace: Workspace = None) -> None:
+  background_file = get_background_path(background_edit.name, workspace)
+  dialogue: seg = seg.from_file(destination_path)
+  speech, bed, gain = prepare_background(dialogue, background_file, background_edit)
+  final_dialogue = array_to_segment(mix_background(speech, bed, gain), dialogue)
   final_dialogue.export(destination_path, format="wav")  
 
 
@@ -683,6 +1245,7 @@ def get_contiguous_lines(affected_lines: list[int], all_lines: list[int]) -> lis
   return parts
   
 
+@timed("master")
 def master_audio_parts(
   affected_lines: list[int], 
   lines: list[int], 
@@ -690,7 +1253,8 @@ def master_audio_parts(
   gap: int, 
   parts_audio_path: str, 
   destination_audio_path: str,
-  dialogue_path: str
+  dialogue_path: str,
+  workspace: Workspace = None
 ) -> None:
   audio_parts: list[AudioPart] = get_contiguous_lines(affected_lines, lines)
   for i, part in enumerate(audio_parts):
@@ -704,10 +1268,11 @@ def master_audio_parts(
       )
     if part.edited:
       part_audio = apply_edits(part_path, soundboard)
-      part_audio.export(part_path, format="wav")
+      with span("encode"):
+        part_audio.export(part_path, format="wav")
       background_edit = soundboard.background()
       if background_edit is not None and background_edit.is_enabled():
-        apply_background_audio(background_edit, part_path)      
+        apply_background_audio(background_edit, part_path, workspace)
   
   join_parts(
     gap, 
@@ -720,12 +1285,14 @@ def preview_mastered_audio(
   affected_lines: list[int], 
   lines: list[int], 
   soundboard: Soundboard, 
-  gap: int
+  gap: int,
+  workspace: Workspace = None
 ) -> (str, str):  
-  src_audio_path = f"./session/{st.session_state.session_id}/final/audio"
-  src_parts_path = f"./session/{st.session_state.session_id}/final/parts"
-  destination_audio_path = f"./session/{st.session_state.session_id}/temp/audio"
-  parts_audio_path = f"./session/{st.session_state.session_id}/temp/parts"
+  workspace = workspace or get_session_workspace()
+  src_audio_path = workspace.final_audio_path
+  src_parts_path = workspace.final_parts_path
+  destination_audio_path = f"{workspace.temp_path}/audio"
+  parts_audio_path = f"{workspace.temp_path}/parts"
     
   dialogue_path = f"{destination_audio_path}/dialogue.mp3"
   os.makedirs(parts_audio_path, exist_ok=True)
@@ -747,7 +1314,8 @@ def preview_mastered_audio(
     gap,
     parts_audio_path,
     src_audio_path,
-    dialogue_path
+    dialogue_path,
+    workspace
   )
   
   if soundboard.normalization().is_enabled():
@@ -761,16 +1329,19 @@ def apply_mastered_audio(
   affected_lines: list[int], 
   lines: list[int], 
   soundboard: Soundboard, 
-  gap: int
+  gap: int,
+  workspace: Workspace = None
 ) -> None:
-  src_audio_path = f"./session/{st.session_state.session_id}/final/audio"
-  src_parts_path = f"./session/{st.session_state.session_id}/final/parts"
-  destination_audio_path = f"./session/{st.session_state.session_id}/final/audio"
+  workspace = workspace or get_session_workspace()
+  src_audio_path = workspace.final_audio_path
+  src_parts_path = workspace.final_parts_path
+  destination_audio_path = workspace.final_audio_path
   parts_audio_path = src_parts_path
   dialogue_path = f"{destination_audio_path}/dialogue.mp3"
   
   os.makedirs(src_parts_path, exist_ok=True)
   
+  blobs.detach(f"{src_audio_path}/dialogue_org.mp3")
   shutil.copy(
     f"{src_audio_path}/dialogue.mp3", 
     f"{src_audio_path}/dialogue_org.mp3"
@@ -783,7 +1354,8 @@ def apply_mastered_audio(
     gap,
     parts_audio_path,
     destination_audio_path,
-    dialogue_path
+    dialogue_path,
+    workspace
   )
   
   if soundboard.normalization().is_enabled():
@@ -0,0 +1,106 @@
+"""Render a folder of dialogues in parallel.
+
+Run from the repository root:
+
+  python -m diatribe.farm ./scripts --workers 4 --max-requests 2 --output ./render/output
+
+Every `dialogue.txt` style script and project zip in the folder is rendered by a pool of processes.
+The processes share one limit on the text-to-speech requests in flight (the ElevenLabs concurrency limit of the account) and the speech cache of `diatribe.render`.
+Each project renders in its own workspace and keeps its progress in `<workspace>/<name>/status.json`.
+"""
+import os, sys, glob, json, time, argparse, multiprocessing
+import diatribe.render as render
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict
+from dotenv import load_dotenv
+from elevenlabs import Voice, set_api_key
+from diatribe.utils import log
+from diatribe.workspace import SilentProgress
+
+FARM_STATUS_FILE = "farm.json"
+_worker = {}
+
+def find_inputs(folder: str, recursive: bool = False) -> list[str]:
+  """Find the scripts and project zips in a folder."""
+  pattern = "**/*" if recursive else "*"
+  return sorted(
+    f for f in glob.glob(f"{folder}/{pattern}", recursive=recursive)
+    if os.path.isfile(f) and os.path.splitext(f)[1].lower() in (".txt", ".zip")
+  )
+
+
+def get_duplicate_names(inputs: list[str]) -> list[str]:
+  """Get the names that more than one input would render into (they would share a workspace)."""
+  names = [render.get_job_name(f) for f in inputs]
+  return sorted({n for n in names if names.count(n) > 1})
+
+
+def init_worker(args: argparse.Namespace, voices: list[Voice], limiter: any) -> None:
+  set_api_key(args.api_key)
+  _worker["args"] = args
+  _worker["voices"] = voices
+  _worker["limiter"] = limiter
+
+
+def render_in_worker(input_file: str) -> render.RenderStatus:
+  return render.render_file(input_file, _worker["args"], _worker["voices"], _worker["limiter"], SilentProgress)
+
+
+def save_farm_status(output: str, statuses: list[render.RenderStatus], started: float) -> None:
+  os.makedirs(output, exist_ok=True)
+  with open(f"{output}/{FARM_STATUS_FILE}", "w") as f:
+    json.dump({
+      "started": started,
+      "finished": time.time(),
+      "rendered": sum(s.state == "done" for s in statuses),
+      "projects": [asdict(s) for s in statuses]
+    }, f, indent=2)
+
+
+def run_farm(inputs: list[str], args: argparse.Namespace, voices: list[Voice]) -> list[render.RenderStatus]:
+  """Render the inputs with `args.workers` processes sharing `args.max_requests` text-to-speech requests."""
+  started = time.time()
+  statuses = []
+  with multiprocessing.Manager() as manager:
+    limiter = manager.BoundedSemaphore(args.max_requests)
+    with ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=(args, voices, limiter)) as executor:
+      futures = {executor.submit(render_in_worker, f): f for f in inputs}
+      for future in as_completed(futures):
+        try:
+          status = future.result()
+        except Exception as e:
+          status = render.RenderStatus(render.get_job_name(futures[future]), futures[future], state="failed", error=str(e))
+        statuses.append(status)
+        log(f"[{len(statuses)}/{len(inputs)}] {status.name}: {status.state} ({status.synthesized} synthesized, {status.cached} cached, {status.failed} failed)")
+  save_farm_status(args.output, statuses, started)
+  return statuses
+
+
+def main() -> None:
+  load_dotenv()
+  parser = argparse.ArgumentParser(description="Render a folder of dialogues in parallel.")
+  parser.add_argument("folder", help="folder of dialogue.txt files (in the export format) and project zips")
+  parser.add_argument("--recursive", action="store_true", help="also render the inputs in subfolders")
+  parser.add_argument("--workers", type=int, default=os.cpu_count(), help="projects rendered at the same time")
+  parser.add_argument("--max-requests", type=int, default=2, help="text-to-speech requests in flight across all workers")
+  render.add_render_arguments(parser)
+  args = parser.parse_args()
+
+  inputs = find_inputs(args.folder, args.recursive)
+  if len(inputs) == 0:
+    sys.exit(f"no .txt or .zip files were found in {args.folder}")
+  duplicates = get_duplicate_names(inputs)
+  if len(duplicates) > 0:
+    sys.exit(f"more than one input would render into the same workspace: {', '.join(duplicates)}")
+  voices = render.get_api_voices(args)
+
+  log(f"rendering {len(inputs)} dialogues with {args.workers} workers and {args.max_requests} requests in flight")
+  statuses = run_farm(inputs, args, voices)
+  rendered = sum(s.state == "done" for s in statuses)
+  log(f"rendered {rendered} of {len(inputs)} dialogues to {args.output}")
+  if rendered < len(inputs):
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
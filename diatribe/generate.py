@@ -1,12 +1,16 @@
-import json
+import os, json, time
 import streamlit as st
 import pandas as pd
+import diatribe.el_audio as el_audio
+from typing import Iterator
 from diatribe.dialogues import Character, Dialogue
 from openai import OpenAI
-from jsonschema import validate
+from jsonschema import validate, ValidationError
 from diatribe.utils import log
+from diatribe.timing import span, timed
 from diatribe.sidebar import SidebarData
 from diatribe.saved_dialogues import SavedDialogueData
+from diatribe.workspace import get_session_workspace
 
 openai_dialogue_schema = {
   "type": "object",
@@ -37,26 +41,163 @@ openai_dialogue_schema = {
   }
 }
 
-def generate_dialogue(system_prompt: str, input_prompt: str, sidebar: SidebarData) -> str:
-  """Generate the dialogue using OpenAI."""
-  client = OpenAI(api_key=sidebar.openai_api_key, timeout=180)  
-  messages = [
-    {"role": "system", "content": system_prompt},
-    {"role": "user", "content": input_prompt}
-  ]
-  chat_options = {
+class DialogueStreamParser:
+  """Finds the complete lines of the `dialogue` array in the JSON received so far, so they can be used before the rest arrives."""
+  def __init__(self) -> None:
+    self.text = ""
+    self.position = 0
+    self.containers = []
+    self.in_string = False
+    self.escaped = False
+    self.string_start = 0
+    self.last_key = None
+    self.in_dialogue = False
+    self.line_start = None
+
+  def feed(self, chunk: str) -> list[dict]:
+    """Add the next part of the response, returning the valid lines it completed."""
+    self.text += chunk
+    lines = []
+    for i in range(self.position, len(self.text)):
+      c = self.text[i]
+      if self.in_string:
+        if self.escaped:
+          self.escaped = False
+        elif c == "\\":
+          self.escaped = True
+        elif c == '"':
+          self.in_string = False
+          # a string closed in the top level object is the key of the next value
+          if len(self.containers) == 1:
+            self.last_key = self.text[self.string_start:i + 1]
+      elif len(self.containers) == 0 and c != "{":
+        # skip anything the model writes before the JSON
+        continue
+      elif c == '"':
+        self.in_string = True
+        self.string_start = i
+      elif c in "{[":
+        self.containers.append(c)
+        if c == "[" and len(self.containers) == 2 and json.loads(self.last_key or '""') == "dialogue":
+          self.in_dialogue = True
+        elif c == "{" and self.in_dialogue and len(self.containers) == 3:
+          self.line_start = i
+      elif c in "}]":
+        if c == "}" and self.line_start is not None and len(self.containers) == 3:
+          line = self.parse_line(self.text[self.line_start:i + 1])
+          if line is not None:
+            lines.append(line)
+          self.line_start = None
+        elif c == "]" and self.in_dialogue and len(self.containers) == 2:
+          self.in_dialogue = False
+        self.containers.pop()
+    self.position = len(self.text)
+    return lines
+
+  def parse_line(self, text: str) -> dict:
+    try:
+      line = json.loads(text)
+      validate(instance=line, schema=openai_dialogue_schema["properties"]["dialogue"]["items"])
+      return line
+    except (json.JSONDecodeError, ValidationError):
+      log(f"skipping a streamed dialogue line that is not valid: {text}")
+      return None
+
+
+def get_chat_request(system_prompt: str, input_prompt: str, sidebar: SidebarData) -> dict:
+  return {
     "model": sidebar.openai_model,
     "temperature": sidebar.openai_temp,
     "max_tokens": sidebar.openai_max_tokens,
+    "messages": [
+      {"role": "system", "content": system_prompt},
+      {"role": "user", "content": input_prompt}
+    ]
   }
-  
+
+@timed("openai.generate")
+def generate_dialogue(system_prompt: str, input_prompt: str, sidebar: SidebarData) -> str:
+  """Generate the dialogue using OpenAI."""
+  client = OpenAI(api_key=sidebar.openai_api_key, timeout=180)  
   response = client.chat.completions.create(
-    **chat_options,
-    messages=messages
+    **get_chat_request(system_prompt, input_prompt, sidebar)
   )
   new_dialogue = response.choices[0].message.content
   return new_dialogue
 
+def stream_dialogue(system_prompt: str, input_prompt: str, sidebar: SidebarData) -> Iterator[str]:
+  """Generate the dialogue using OpenAI, yielding the text as it is written."""
+  client = OpenAI(api_key=sidebar.openai_api_key, timeout=180)
+  stream = client.chat.completions.create(
+    **get_chat_request(system_prompt, input_prompt, sidebar),
+    stream=True
+  )
+  for chunk in stream:
+    if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+      yield chunk.choices[0].delta.content
+
+def get_character_line(line: dict, characters: list[Character]) -> dict:
+  """Get the table row of a generated line if it is spoken by one of the characters."""
+  character_found = next((c for c in characters if c.name == line.get("Speaker")), None)
+  if character_found and "Text" in line:
+    return { "Speaker": line["Speaker"], "Text": line["Text"] }
+  return None
+
+def show_dialogue_preview(preview: any, lines: list[dict]) -> None:
+  if preview is not None:
+    preview.dataframe(pd.DataFrame(lines, columns=["Speaker", "Text"]), use_container_width=True, hide_index=True)
+
+def generate_dialogue_lines(
+  system_prompt: str, 
+  input_prompt: str, 
+  sidebar: SidebarData, 
+  characters: list[Character], 
+  lines: list[dict], 
+  preview: any = None,
+  on_line: callable = None
+) -> list[dict]:
+  """Generate the lines spoken by the characters and add them to `lines` (showing each one in the preview as it arrives when streaming).
+  
+  `on_line(number, line)` is called with the line number (its position in `lines` from 1) of every added line.
+  """
+  if not sidebar.openai_stream:
+    dialogue = generate_dialogue(system_prompt, input_prompt, sidebar)
+    with span("openai.parse"):
+      dialogue = json.loads(dialogue)
+      validate(instance=dialogue, schema=openai_dialogue_schema)
+    for line in dialogue["dialogue"]:
+      line = get_character_line(line, characters)
+      if line is not None:
+        lines.append(line)
+        if on_line is not None:
+          on_line(len(lines), line)
+    return lines
+  
+  parser = DialogueStreamParser()
+  started = time.perf_counter()
+  streamed = 0
+  with span("openai.stream"):
+    for chunk in stream_dialogue(system_prompt, input_prompt, sidebar):
+      for line in parser.feed(chunk):
+        line = get_character_line(line, characters)
+        if line is None:
+          continue
+        if streamed == 0:
+          log(f"first dialogue line streamed after {time.perf_counter() - started:.1f}s")
+        streamed += 1
+        lines.append(line)
+        show_dialogue_preview(preview, lines)
+        if on_line is not None:
+          on_line(len(lines), line)
+  try:
+    validate(instance=json.loads(parser.text), schema=openai_dialogue_schema)
+  except (json.JSONDecodeError, ValidationError) as e:
+    if streamed == 0:
+      raise
+    log(f"the streamed dialogue is not valid JSON, keeping the {streamed} lines that were complete: {e}")
+    st.warning("OpenAI stopped before finishing the dialogue, so only the lines it completed were added.")
+  return lines
+
 def load_dialogue_system_prompt() -> str:
   """Load the dialogue system prompt from the file."""
   with open("prompts/openai_dialogue_system_prompt.txt", "r") as f:
@@ -95,7 +236,42 @@ def generate_continue_dialogue_input_prompt(characters: list[Character], number_
     input_prompt += f"<Dialogue><Speaker>{line.character.name}</Speaker>\n<Number>{line.line}</Number><Text>{line.text}</Text></Dialogue>\n\n\n"
   return input_prompt
 
-def create_continue_dialogue(sidebar: SidebarData, characters: list[Character], dialogue: list[Dialogue]) -> pd.DataFrame:
+def start_speech_pipeline(sidebar: SidebarData, characters: list[Character], clear_audio: bool) -> (el_audio.SpeechPipeline, callable):
+  """Start synthesizing the generated lines as they arrive if the sidebar asks for it, returning the pipeline and the line callback."""
+  if not sidebar.openai_pipeline:
+    return None, None
+  workspace = get_session_workspace()
+  if clear_audio:
+    el_audio.clear_audio_files(workspace)
+  pipeline = el_audio.SpeechPipeline(sidebar, workspace)
+  def on_line(number: int, line: dict) -> None:
+    character = next(c for c in characters if c.name == line["Speaker"])
+    if character.voice_id is None:
+      log(f"voice ID not found for `{character.voice}`, line {number} will not be synthesized")
+    else:
+      pipeline.submit(number, line["Text"], character.voice_id)
+  return pipeline, on_line
+
+def finish_speech_pipeline(pipeline: el_audio.SpeechPipeline, line_count: int) -> None:
+  """Wait for the pipelined lines, show the audio of every line that has some and remember the lines that failed."""
+  if pipeline is None:
+    return
+  _, failed = pipeline.wait()
+  workspace = get_session_workspace()
+  audio_files = [workspace.line_file(line) for line in range(1, line_count + 1) if os.path.exists(workspace.line_file(line))]
+  if len(audio_files) > 0:
+    st.session_state["audio_files"] = audio_files
+  if len(failed) > 0:
+    # Continue Dialogue reruns the script right away, so the warning is shown by the next run
+    st.session_state["pipeline_failed_lines"] = failed
+
+def create_pipeline_warning() -> None:
+  """Show the lines the last pipelined generation could not synthesize (once)."""
+  failed = st.session_state.pop("pipeline_failed_lines", [])
+  if len(failed) > 0:
+    st.warning(f"The audio of line{'s' if len(failed) > 1 else ''} {', '.join(str(l) for l in failed)} could not be generated. Use `Redo` to try again.")
+
+def create_continue_dialogue(sidebar: SidebarData, characters: list[Character], dialogue: list[Dialogue], preview: any = None) -> pd.DataFrame:
   with st.spinner("Generating dialogue..."):
     input_prompt = generate_continue_dialogue_input_prompt(
       characters, 
@@ -104,6 +280,7 @@ def create_continue_dialogue(sidebar: SidebarData, characters: list[Character],
       dialogue
     )
     system_prompt = load_continue_dialogue_system_prompt()
+    pipeline = None
     try:
       if "audio_files" in st.session_state:
         del st.session_state["audio_files"]
@@ -111,22 +288,20 @@ def create_continue_dialogue(sidebar: SidebarData, characters: list[Character],
         del st.session_state["final_audio"]
         
       lines = [d.to_dict(without_line=True) for d in dialogue]
-      dialogue = generate_dialogue(system_prompt, input_prompt, sidebar)
-      dialogue = json.loads(dialogue)
-      validate(instance=dialogue, schema=openai_dialogue_schema)
-      for line in dialogue["dialogue"]:
-        character_found = next((c for c in characters if c.name == line["Speaker"]), None)
-        if character_found:
-          lines.append({ "Speaker": line["Speaker"], "Text": line["Text"] })
+      pipeline, on_line = start_speech_pipeline(sidebar, characters, clear_audio=False)
+      generate_dialogue_lines(system_prompt, input_prompt, sidebar, characters, lines, preview, on_line)
+      finish_speech_pipeline(pipeline, len(lines))
       log(f"continued lines produced: {len(lines)}")
       result = pd.DataFrame(lines, columns=["Speaker", "Text"])
       return result
     except Exception as e:
       log(e)
+      if pipeline is not None:
+        pipeline.cancel()
       st.error("An error occured while generating the dialogue. Please try again.") 
       return None
 
-def create_dialogue_generation(sidebar: SidebarData, saves: SavedDialogueData, characters: list[Character]) -> pd.DataFrame:
+def create_dialogue_generation(sidebar: SidebarData, saves: SavedDialogueData, characters: list[Character], preview: any = None) -> pd.DataFrame:
   result = None
   
   if sidebar.openai_api_key:
@@ -170,23 +345,22 @@ def create_dialogue_generation(sidebar: SidebarData, saves: SavedDialogueData, c
         with st.spinner("Generating dialogue..."):
           input_prompt = generate_dialogue_input_prompt(characters, number_of_lines, plot)
           system_prompt = load_dialogue_system_prompt()
+          pipeline = None
           try:
             if "audio_files" in st.session_state:
               del st.session_state["audio_files"]
             if "final_audio" in st.session_state:
               del st.session_state["final_audio"]
               
-            dialogue = generate_dialogue(system_prompt, input_prompt, sidebar)
-            dialogue = json.loads(dialogue)
-            validate(instance=dialogue, schema=openai_dialogue_schema)
-            lines = []
-            for line in dialogue["dialogue"]:
-              character_found = next((c for c in characters if c.name == line["Speaker"]), None)
-              if character_found:
-                lines.append({ "Speaker": line["Speaker"], "Text": line["Text"] })
+            pipeline, on_line = start_speech_pipeline(sidebar, characters, clear_audio=True)
+            lines = generate_dialogue_lines(system_prompt, input_prompt, sidebar, characters, [], preview, on_line)
+            finish_speech_pipeline(pipeline, len(lines))
             log(f"lines produced: {len(lines)}")
             result = pd.DataFrame(lines, columns=["Speaker", "Text"])
           except Exception as e:
             log(e)
+            if pipeline is not None:
+              pipeline.cancel()
             st.error("An error occured while generating the dialogue. Please try again.")
+    create_pipeline_warning()
   return result
\ No newline at end of file
@@ -0,0 +1,373 @@
+"""A persistent queue for the long audio operations (synthesis, joining and mastering).
+
+The queue is a SQLite database that is enabled by setting DIATRIBE_JOB_QUEUE to its path.
+The app starts DIATRIBE_JOB_WORKERS local workers (1 by default, 0 to only use external ones).
+More workers can run on any host sharing the filesystem, started from the app folder (the session paths are relative to it):
+
+  DIATRIBE_JOB_QUEUE=./jobs/jobs.db python -m diatribe.jobs
+
+The database uses the default rollback journal rather than WAL, which does not work on network filesystems.
+"""
+import os, sys, time, uuid, pickle, atexit, socket, sqlite3, argparse, threading, subprocess
+import streamlit as st
+import streamlit.config
+import streamlit.logger
+import diatribe.el_audio as el_audio
+from dataclasses import dataclass
+from elevenlabs import set_api_key
+from diatribe.utils import log, rerun_after
+from diatribe.workspace import Progress, Workspace, get_session_workspace, get_wait_text
+
+JOB_QUEUE_ENV = "DIATRIBE_JOB_QUEUE"
+JOB_WORKERS_ENV = "DIATRIBE_JOB_WORKERS"
+POLL_INTERVAL = 0.5
+FOLLOW_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 5.0
+STALE_AFTER = 60.0
+MAX_ATTEMPTS = 3
+PURGE_AFTER = 24 * 3600
+FINISHED_STATES = ("done", "failed")
+
+@dataclass
+class Job:
+  id: str
+  kind: str
+  key: str
+  session_id: str
+  state: str
+  progress: float
+  message: str
+  result: any
+  error: str
+  worker: str
+  attempts: int
+  created: float
+  started: float
+  updated: float
+  finished: float
+  payload: any = None
+
+  def is_finished(self) -> bool:
+    return self.state in FINISHED_STATES
+
+
+JOB_COLUMNS = "id, kind, key, session_id, state, progress, message, result, error, worker, attempts, created, started, updated, finished"
+
+class JobQueue:
+  """Jobs stored in SQLite so they outlive the script run (and server) that submitted them."""
+  def __init__(self, path: str) -> None:
+    self.path = path
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with self.connect() as db:
+      db.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+          id TEXT PRIMARY KEY,
+          kind TEXT NOT NULL,
+          key TEXT,
+          session_id TEXT,
+          state TEXT NOT NULL,
+          progress REAL NOT NULL DEFAULT 0,
+          message TEXT,
+          payload BLOB,
+          result BLOB,
+          error TEXT,
+          worker TEXT,
+          attempts INTEGER NOT NULL DEFAULT 0,
+          created REAL NOT NULL,
+          started REAL,
+          updated REAL,
+          finished REAL
+        )
+      """)
+      db.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, state)")
+      db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)")
+
+  def connect(self) -> sqlite3.Connection:
+    return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+  def transaction(self) -> sqlite3.Connection:
+    """Open a connection holding the write lock until it is committed."""
+    db = self.connect()
+    db.execute("BEGIN IMMEDIATE")
+    return db
+
+  def to_job(self, row: tuple) -> Job:
+    job = Job(*row)
+    job.result = pickle.loads(job.result) if job.result is not None else None
+    return job
+
+  def submit(self, kind: str, payload: any, key: str = None, session_id: str = None) -> Job:
+    """Queue a job unless a job with the same idempotency key is still queued or running (that job is returned instead)."""
+    db = self.transaction()
+    try:
+      if key is not None:
+        row = db.execute(
+          f"SELECT {JOB_COLUMNS} FROM jobs WHERE key = ? AND state IN ('queued', 'running')", (key,)
+        ).fetchone()
+        if row is not None:
+          db.execute("COMMIT")
+          return self.to_job(row)
+      job_id = str(uuid.uuid4())
+      db.execute(
+        "INSERT INTO jobs (id, kind, key, session_id, state, payload, created, updated) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+        (job_id, kind, key, session_id, pickle.dumps(payload), time.time(), time.time())
+      )
+      db.execute("COMMIT")
+    finally:
+      db.close()
+    log(f"queued {kind} job {job_id}")
+    return self.get(job_id)
+
+  def get(self, job_id: str) -> Job:
+    with self.connect() as db:
+      row = db.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return self.to_job(row) if row is not None else None
+
+  def requeue_stale(self, db: sqlite3.Connection) -> None:
+    """Requeue the running jobs whose worker stopped sending heartbeats (or give up after MAX_ATTEMPTS)."""
+    stale = time.time() - STALE_AFTER
+    db.execute(
+      "UPDATE jobs SET state = 'failed', error = 'the job was abandoned by its workers', payload = NULL, finished = ? WHERE state = 'running' AND updated < ? AND attempts >= ?",
+      (time.time(), stale, MAX_ATTEMPTS)
+    )
+    db.execute("UPDATE jobs SET state = 'queued', worker = NULL WHERE state = 'running' AND updated < ?", (stale,))
+
+  def claim(self, worker: str) -> Job:
+    """Take the oldest queued job (with its pickled payload) for the worker."""
+    db = self.transaction()
+    try:
+      self.requeue_stale(db)
+      row = db.execute(
+        f"SELECT {JOB_COLUMNS}, payload FROM jobs WHERE state = 'queued' ORDER BY created LIMIT 1"
+      ).fetchone()
+      if row is None:
+        db.execute("COMMIT")
+        return None
+      now = time.time()
+      db.execute(
+        "UPDATE jobs SET state = 'running', worker = ?, attempts = attempts + 1, started = ?, updated = ?, progress = 0, message = NULL WHERE id = ?",
+        (worker, now, now, row[0])
+      )
+      db.execute("COMMIT")
+    finally:
+      db.close()
+    job = self.to_job(row[:-1])
+    job.payload = row[-1]
+    job.state, job.worker, job.attempts = "running", worker, job.attempts + 1
+    return job
+
+  def update(self, job_id: str, progress: float = None, message: str = None) -> None:
+    """Record the progress of a running job (which also counts as a heartbeat)."""
+    with self.connect() as db:
+      db.execute(
+        "UPDATE jobs SET progress = COALESCE(?, progress), message = COALESCE(?, message), updated = ? WHERE id = ? AND state = 'running'",
+        (progress, message, time.time(), job_id)
+      )
+
+  def finish(self, job_id: str, result: any = None, error: str = None) -> None:
+    """Finish the job, dropping its payload (it can hold the API key)."""
+    with self.connect() as db:
+      db.execute(
+        "UPDATE jobs SET state = ?, progress = ?, result = ?, error = ?, payload = NULL, updated = ?, finished = ? WHERE id = ?",
+        ("failed" if error else "done", 0 if error else 1, pickle.dumps(result), error, time.time(), time.time(), job_id)
+      )
+
+  def purge(self, max_age: float = PURGE_AFTER) -> int:
+    """Delete the jobs that finished more than `max_age` seconds ago."""
+    with self.connect() as db:
+      return db.execute(
+        "DELETE FROM jobs WHERE state IN ('done', 'failed') AND finished < ?", (time.time() - max_age,)
+      ).rowcount
+
+
+class JobProgress(Progress):
+  """Reports the progress of a step of a job to the queue (at most every POLL_INTERVAL seconds)."""
+  def __init__(self, queue: JobQueue, job_id: str, text: str) -> None:
+    self.queue = queue
+    self.job_id = job_id
+    self.text = text
+    self.reported = 0.0
+    queue.update(job_id, 0.0, text)
+
+  def update(self, fraction: float) -> None:
+    if time.monotonic() - self.reported >= POLL_INTERVAL or fraction >= 1.0:
+      self.reported = time.monotonic()
+      self.queue.update(self.job_id, min(max(fraction, 0.0), 1.0), self.text)
+
+  def done(self) -> None:
+    pass
+
+  def wait(self, seconds: float) -> None:
+    self.queue.update(self.job_id, message=get_wait_text(self.text, seconds))
+
+
+def run_synthesize(payload: dict, progress: type[Progress]) -> dict:
+  """Synthesize the lines into the workspace, stopping at the first line that fails like the app does."""
+  workspace: Workspace = payload["workspace"]
+  sidebar = payload["sidebar"]
+  set_api_key(sidebar.el_key)
+  el_audio.clear_audio_files(workspace)
+  audio_files = []
+  generate_audio_bar = progress("Generating audio...")
+  lines = payload["lines"]
+  for i, (line, text, voice, voice_id, description) in enumerate(lines):
+    if voice_id is None:
+      return { "audio_files": audio_files, "error": None, "missing_voice": voice }
+    try:
+      audio_files.append(el_audio.generate_and_save(text, voice_id, line, sidebar, workspace, on_wait=generate_audio_bar.wait))
+    except Exception as e:
+      log(f"unable to synthesize line {line}: {e}")
+      return { "audio_files": audio_files, "error": description, "missing_voice": None }
+    generate_audio_bar.update((i+1) / len(lines))
+  generate_audio_bar.done()
+  return { "audio_files": audio_files, "error": None, "missing_voice": None }
+
+
+def run_join(payload: dict, progress: type[Progress]) -> None:
+  el_audio.join_audio(payload["lines"], payload["gap"], workspace=payload["workspace"], progress=progress)
+
+
+def run_master(payload: dict, progress: type[Progress]) -> None:
+  mastering_bar = progress("Mastering audio...")
+  el_audio.apply_mastered_audio(
+    payload["affected_lines"],
+    payload["lines"],
+    payload["soundboard"],
+    payload["gap"],
+    payload["workspace"]
+  )
+  mastering_bar.update(1.0)
+
+
+JOB_HANDLERS = {
+  "synthesize": run_synthesize,
+  "join": run_join,
+  "master": run_master
+}
+
+def run_job(queue: JobQueue, job: Job) -> None:
+  """Run a claimed job, sending heartbeats until it finishes."""
+  stopped = threading.Event()
+  def heartbeat() -> None:
+    while not stopped.wait(HEARTBEAT_INTERVAL):
+      queue.update(job.id)
+  threading.Thread(target=heartbeat, name=f"job-heartbeat-{job.id}", daemon=True).start()
+  log(f"running {job.kind} job {job.id} (attempt {job.attempts})")
+  try:
+    result = JOB_HANDLERS[job.kind](pickle.loads(job.payload), lambda text: JobProgress(queue, job.id, text))
+    queue.finish(job.id, result)
+  except Exception as e:
+    log(f"{job.kind} job {job.id} failed: {e}")
+    queue.finish(job.id, error=str(e) or type(e).__name__)
+  finally:
+    stopped.set()
+
+
+def get_worker_name() -> str:
+  return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_worker(queue: JobQueue, poll_interval: float = POLL_INTERVAL) -> None:
+  """Run the queued jobs one at a time until interrupted."""
+  worker = get_worker_name()
+  log(f"job worker {worker} is using {queue.path}")
+  purged = time.monotonic()
+  while True:
+    try:
+      job = queue.claim(worker)
+    except sqlite3.Error as e:
+      log(f"unable to claim a job: {e}")
+      job = None
+    if job is None:
+      time.sleep(poll_interval)
+    else:
+      run_job(queue, job)
+    if time.monotonic() - purged > 3600:
+      purged = time.monotonic()
+      queue.purge()
+
+
+@st.cache_resource
+def get_job_queue() -> JobQueue:
+  """Get the job queue if it is enabled (the long operations run in the script thread otherwise)."""
+  path = os.getenv(JOB_QUEUE_ENV)
+  return JobQueue(path) if path else None
+
+
+@st.cache_resource
+def start_job_workers() -> list[subprocess.Popen]:
+  """Start the local workers once per server if the queue is enabled."""
+  queue = get_job_queue()
+  if queue is None:
+    return []
+  workers = [
+    subprocess.Popen([sys.executable, "-m", "diatribe.jobs", "--queue", queue.path])
+    for _ in range(int(os.getenv(JOB_WORKERS_ENV, "1")))
+  ]
+  atexit.register(lambda: [w.terminate() for w in workers])
+  log(f"started {len(workers)} job workers")
+  return workers
+
+
+def submit_session_job(kind: str, payload: dict, state_key: str, key: str = None) -> Job:
+  """Queue a job for the session and remember it under `state_key` so later reruns can follow it."""
+  session_id = st.session_state.session_id
+  job = get_job_queue().submit(kind, payload, key or f"{session_id}:{kind}", session_id)
+  st.session_state[state_key] = job.id
+  return job
+
+
+def follow_session_job(state_key: str) -> Job:
+  """Show the progress of the session job remembered under `state_key`, returning it once when it has finished.
+
+  The job is read once per run and the script reruns until it finishes, so the rest of the page is not held up.
+  """
+  queue = get_job_queue()
+  if queue is None or state_key not in st.session_state:
+    return None
+  job = queue.get(st.session_state[state_key])
+  if job is None or job.is_finished():
+    del st.session_state[state_key]
+    return job
+  if job.state == "running":
+    st.progress(round(job.progress, 2), text=job.message or "Working...")
+  else:
+    st.progress(0, text="Waiting for a worker...")
+  rerun_after(FOLLOW_INTERVAL, state_key)
+  return None
+
+
+def get_synthesis_payload(dialogue: list, sidebar: any) -> dict:
+  return {
+    "workspace": get_session_workspace(),
+    "sidebar": sidebar,
+    "lines": [
+      (
+        d.line,
+        d.text,
+        d.character.voice,
+        d.character.voice_id,
+        f"{d.character.name} with the voice {d.character.voice} (voice_id: {d.character.voice_id})"
+      )
+      for d in dialogue
+    ]
+  }
+
+
+def main() -> None:
+  # the cached functions warn about the missing Streamlit runtime on every call
+  streamlit.config.get_config_options()
+  streamlit.logger.set_log_level("error")
+  parser = argparse.ArgumentParser(description="Run the queued Diatribe audio jobs.")
+  parser.add_argument("--queue", default=os.getenv(JOB_QUEUE_ENV), help=f"queue database (defaults to {JOB_QUEUE_ENV})")
+  args = parser.parse_args()
+  if not args.queue:
+    sys.exit(f"the queue database is required (--queue or {JOB_QUEUE_ENV})")
+  try:
+    run_worker(JobQueue(args.queue))
+  except KeyboardInterrupt:
+    pass
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,85 @@
+import os
+import math
+import streamlit as st
+import diatribe.el_audio as el_audio
+import diatribe.saved_dialogues as saved_dialogues
+import diatribe.rate_limit as rate_limit
+from diatribe.dialogues import Dialogue
+from diatribe.sidebar import SidebarData
+from diatribe.audio_edit import create_edit_dialogue_line
+from diatribe.audio_server import audio_player
+from diatribe.workspace import get_session_workspace
+
+LINES_PER_PAGE_OPTIONS = [10, 25, 50]
+
+def get_page_count(line_count: int, lines_per_page: int) -> int:
+  return max(1, math.ceil(line_count / lines_per_page))
+
+
+def get_page_lines(dialogue: list[Dialogue], page: int, lines_per_page: int) -> list[tuple[int, Dialogue]]:
+  """Get the numbered lines shown on a page (pages start at 1)."""
+  start = (page - 1) * lines_per_page
+  return list(enumerate(dialogue[start:start + lines_per_page], start=start + 1))
+
+
+def create_page_controls(line_count: int, key: str) -> tuple[int, int]:
+  """Create the page selection controls and return the page and the lines per page."""
+  page_key = f"{key}_page"
+  col1, col2, col3 = st.columns([2, 2, 6])
+  with col1:
+    lines_per_page = st.selectbox("Lines per page", LINES_PER_PAGE_OPTIONS, key=f"{key}_lines_per_page")
+  page_count = get_page_count(line_count, lines_per_page)
+  if st.session_state.get(page_key, 1) > page_count:
+    st.session_state[page_key] = page_count
+  with col2:
+    page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, step=1, key=page_key)
+  with col3:
+    first_line = (page - 1) * lines_per_page + 1
+    last_line = min(page * lines_per_page, line_count)
+    st.markdown("")
+    st.caption(f"Showing lines {first_line}-{last_line} of {line_count}")
+  return page, lines_per_page
+
+
+def create_line_audio(audio_file: str) -> bool:
+  """Show the audio player for a line and return whether its audio exists."""
+  if not os.path.exists(audio_file) and saved_dialogues.is_importing_audio():
+    with st.spinner("Importing audio..."):
+      saved_dialogues.wait_for_imported_audio()
+  if os.path.exists(audio_file):
+    audio_player(audio_file, format="audio/wav")
+    return True
+  st.markdown("Audio file not found. Please click the `Redo` button.")
+  return False
+
+
+def create_line_list(sidebar: SidebarData, dialogue: list[Dialogue]) -> None:
+  """Show the generated audio of the dialogue one page of lines at a time."""
+  page, lines_per_page = create_page_controls(len(dialogue), "audio_lines")
+  for i, line in get_page_lines(dialogue, page, lines_per_page):
+    st.markdown(f"`{i}.` **:green[{line.character.name}]**: \"{line.text}\"")
+
+    col1, col2 = st.columns([9, 1])
+    with col1:
+      audio_file = get_session_workspace().line_file(line.line)
+      audio_file_found = create_line_audio(audio_file)
+    with col2:
+      redo_btn = st.button("Redo", key=f"redo_{line.line}")
+    if redo_btn:
+      waiting = st.empty()
+      with st.spinner("Generating audio..."):
+        el_audio.generate_and_save(
+          line.text,
+          line.character.voice_id,
+          line.line,
+          sidebar,
+          priority=rate_limit.INTERACTIVE,
+          on_wait=lambda seconds: waiting.caption(f"Waiting for the speech rate limit ({seconds:.0f}s)...") if seconds > 0 else waiting.empty()
+        )
+      st.rerun()
+
+    # dialogue audio editing
+    if audio_file_found and sidebar.enable_audio_editing:
+      create_edit_dialogue_line(line, audio_file)
+  if get_page_count(len(dialogue), lines_per_page) > 1:
+    st.caption(f"Page {page} of {get_page_count(len(dialogue), lines_per_page)}. Use the page selector above to see the other lines.")
@@ -0,0 +1,244 @@
+"""A shared limit on the text-to-speech requests of each ElevenLabs API key.
+
+Every session using the same key (like the one in ELEVENLABS_API_KEY) draws from the same token buckets, so they take turns instead of all getting 429s from the API.
+The limits are enabled by setting any of:
+
+  DIATRIBE_TTS_REQUESTS_PER_MINUTE   sustained request rate
+  DIATRIBE_TTS_CHARACTERS_PER_MINUTE sustained character rate (the account quota)
+  DIATRIBE_TTS_MAX_CONCURRENT        requests in flight (the account concurrency limit)
+  DIATRIBE_TTS_BURST_SECONDS         seconds of the sustained rates a full bucket allows at once (10 by default)
+
+The buckets are kept in the server process unless DIATRIBE_RATE_LIMIT_DB is set to a SQLite file, which shares them with the job workers, batch renders and other servers.
+Interactive requests (Redo) are served before bulk generation, and bulk generation always leaves a request and a concurrent slot for them.
+"""
+import os, json, time, uuid, heapq, hashlib, itertools, sqlite3, threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from elevenlabs.api.error import APIError
+from diatribe.timing import span
+from diatribe.utils import log
+
+INTERACTIVE = 0
+BULK = 1
+POLL_INTERVAL = 0.25
+LEASE_TIMEOUT = 300.0
+THROTTLED_STATUSES = ("too_many_requests", "too_many_concurrent_requests", "system_busy")
+_limiter = {}
+_limiter_lock = threading.Lock()
+
+@dataclass
+class RateLimitSettings:
+  requests_per_minute: float
+  characters_per_minute: float
+  max_concurrent: int
+  burst_seconds: float
+  db_path: str = None
+  interactive_reserve: int = 1
+
+  def request_capacity(self) -> float:
+    return max(self.requests_per_minute * self.burst_seconds / 60, 1.0)
+
+  def character_capacity(self) -> float:
+    return self.characters_per_minute * self.burst_seconds / 60
+
+
+def get_rate_limit_settings() -> RateLimitSettings:
+  """Get the limits from the environment (there is no limit if none are set)."""
+  settings = RateLimitSettings(
+    float(os.getenv("DIATRIBE_TTS_REQUESTS_PER_MINUTE", "0")),
+    float(os.getenv("DIATRIBE_TTS_CHARACTERS_PER_MINUTE", "0")),
+    int(os.getenv("DIATRIBE_TTS_MAX_CONCURRENT", "0")),
+    float(os.getenv("DIATRIBE_TTS_BURST_SECONDS", "10")),
+    os.getenv("DIATRIBE_RATE_LIMIT_DB")
+  )
+  if settings.requests_per_minute <= 0 and settings.characters_per_minute <= 0 and settings.max_concurrent <= 0:
+    return None
+  return settings
+
+
+@dataclass
+class BucketState:
+  requests: float
+  characters: float
+  updated: float
+  blocked_until: float = 0.0
+  leases: dict[str, float] = field(default_factory=dict)
+
+
+class MemoryBucketStore:
+  """Keeps the buckets in this process."""
+  def __init__(self) -> None:
+    self.lock = threading.Lock()
+    self.states: dict[str, BucketState] = {}
+
+  def update(self, key: str, func: callable) -> any:
+    """Change the bucket state of a key with `func(state) -> (state, result)`, returning the result."""
+    with self.lock:
+      state, result = func(self.states.get(key))
+      self.states[key] = state
+      return result
+
+
+class SqliteBucketStore:
+  """Keeps the buckets in a SQLite database shared by every process using it (with the rollback journal so it works on network filesystems)."""
+  def __init__(self, path: str) -> None:
+    self.path = path
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with self.connect() as db:
+      db.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, state TEXT NOT NULL)")
+
+  def connect(self) -> sqlite3.Connection:
+    return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+  def update(self, key: str, func: callable) -> any:
+    """Change the bucket state of a key with `func(state) -> (state, result)` while holding the write lock."""
+    db = self.connect()
+    try:
+      db.execute("BEGIN IMMEDIATE")
+      row = db.execute("SELECT state FROM buckets WHERE key = ?", (key,)).fetchone()
+      state, result = func(BucketState(**json.loads(row[0])) if row else None)
+      db.execute("INSERT OR REPLACE INTO buckets (key, state) VALUES (?, ?)", (key, json.dumps(asdict(state))))
+      db.execute("COMMIT")
+      return result
+    finally:
+      db.close()
+
+
+def get_key_id(api_key: str) -> str:
+  """Identify the buckets of an API key without storing the key."""
+  return hashlib.sha1((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+def is_throttled(error: Exception) -> bool:
+  """Check whether the API turned a request away because of its rate or concurrency limits."""
+  return isinstance(error, APIError) and error.status in THROTTLED_STATUSES
+
+
+class RateLimiter:
+  """Token buckets for the requests and characters of each API key, handed out by priority and then in order of arrival."""
+  def __init__(self, settings: RateLimitSettings) -> None:
+    self.settings = settings
+    self.store = SqliteBucketStore(settings.db_path) if settings.db_path else MemoryBucketStore()
+    self.condition = threading.Condition()
+    self.waiting: dict[str, list[tuple[int, int]]] = {}
+    self.arrivals = itertools.count()
+
+  def refill(self, state: BucketState, now: float) -> BucketState:
+    if state is None:
+      return BucketState(self.settings.request_capacity(), self.settings.character_capacity(), now)
+    elapsed = max(now - state.updated, 0.0)
+    state.requests = min(state.requests + elapsed * self.settings.requests_per_minute / 60, self.settings.request_capacity())
+    state.characters = min(state.characters + elapsed * self.settings.characters_per_minute / 60, self.settings.character_capacity())
+    state.updated = now
+    # leases of processes that died without releasing them run out eventually
+    state.leases = {lease: expires for lease, expires in state.leases.items() if expires > now}
+    return state
+
+  def get_wait(self, state: BucketState, characters: int, priority: int, now: float) -> float:
+    """Get the seconds until the request can be sent (0 if it can be sent now)."""
+    settings = self.settings
+    reserve = settings.interactive_reserve if priority == BULK else 0
+    wait = max(state.blocked_until - now, 0.0)
+    if settings.requests_per_minute > 0:
+      needed = 1 + (reserve if settings.request_capacity() >= 1 + reserve else 0)
+      wait = max(wait, (needed - state.requests) * 60 / settings.requests_per_minute)
+    if settings.characters_per_minute > 0:
+      # a line longer than the bucket only waits for a full bucket and leaves it in debt
+      needed = min(characters, settings.character_capacity())
+      wait = max(wait, (needed - state.characters) * 60 / settings.characters_per_minute)
+    if settings.max_concurrent > 0:
+      slots = settings.max_concurrent - (reserve if settings.max_concurrent > reserve else 0)
+      if len(state.leases) >= slots:
+        wait = max(wait, POLL_INTERVAL)
+    return wait
+
+  def take(self, state: BucketState, lease: str, characters: int, priority: int) -> (BucketState, float):
+    now = time.time()
+    state = self.refill(state, now)
+    wait = self.get_wait(state, characters, priority, now)
+    if wait <= 0:
+      state.requests -= 1 if self.settings.requests_per_minute > 0 else 0
+      state.characters -= characters if self.settings.characters_per_minute > 0 else 0
+      state.leases[lease] = now + LEASE_TIMEOUT
+    return state, wait
+
+  def release_lease(self, state: BucketState, lease: str) -> (BucketState, None):
+    state = self.refill(state, time.time())
+    state.leases.pop(lease, None)
+    return state, None
+
+  def block(self, state: BucketState, seconds: float) -> (BucketState, None):
+    now = time.time()
+    state = self.refill(state, now)
+    state.blocked_until = max(state.blocked_until, now + seconds)
+    return state, None
+
+  def wait_for_turn(self, key: str, lease: str, characters: int, priority: int, on_wait: callable) -> float:
+    """Wait until the request is first in line for its key and the buckets allow it, returning the seconds waited."""
+    started = time.monotonic()
+    reported = 0.0
+    turn = (priority, next(self.arrivals))
+    with self.condition:
+      waiting = self.waiting.setdefault(key, [])
+      heapq.heappush(waiting, turn)
+    try:
+      while True:
+        with self.condition:
+          is_first = waiting[0] == turn
+        # the store (a SQLite transaction) and the callback (a Streamlit update) can be slow, so they run without the lock
+        wait = POLL_INTERVAL
+        if is_first:
+          wait = self.store.update(key, lambda state: self.take(state, lease, characters, priority))
+          if wait <= 0:
+            break
+        waited = time.monotonic() - started
+        if on_wait is not None and waited - reported >= 1.0:
+          reported = waited
+          on_wait(waited)
+        with self.condition:
+          # a turn that came up in the meantime is not waited out
+          if is_first or waiting[0] != turn:
+            self.condition.wait(min(max(wait, 0.01), POLL_INTERVAL))
+    finally:
+      with self.condition:
+        waiting.remove(turn)
+        heapq.heapify(waiting)
+        if len(waiting) == 0:
+          del self.waiting[key]
+        self.condition.notify_all()
+    if on_wait is not None and reported > 0:
+      on_wait(0.0)
+    return time.monotonic() - started
+
+  @contextmanager
+  def acquire(self, api_key: str, characters: int, priority: int = BULK, on_wait: callable = None):
+    """Hold a request to the API for the block, calling `on_wait(seconds)` every second it waits (and with 0 when it stops)."""
+    key = get_key_id(api_key)
+    lease = str(uuid.uuid4())
+    with span("tts.wait"):
+      waited = self.wait_for_turn(key, lease, characters, priority, on_wait)
+    if waited >= 1.0:
+      log(f"waited {waited:.1f}s for the text-to-speech rate limit")
+    try:
+      yield waited
+    finally:
+      self.store.update(key, lambda state: self.release_lease(state, lease))
+      with self.condition:
+        self.condition.notify_all()
+
+  def back_off(self, api_key: str, seconds: float) -> None:
+    """Hold every request of the key for a while after the API turned one away."""
+    log(f"the text-to-speech API is throttling requests, backing off for {seconds:.1f}s")
+    self.store.update(get_key_id(api_key), lambda state: self.block(state, seconds))
+
+
+def get_rate_limiter() -> RateLimiter:
+  """Get the limiter shared by every session of the server (or every thread of the process) if any limits are set."""
+  # st.cache_resource does not keep anything outside the Streamlit runtime, and the job workers and batch renders need one limiter per process too
+  with _limiter_lock:
+    if "limiter" not in _limiter:
+      settings = get_rate_limit_settings()
+      _limiter["limiter"] = RateLimiter(settings) if settings else None
+      if settings:
+        log(f"limiting text-to-speech to {settings.requests_per_minute:g} requests and {settings.characters_per_minute:g} characters per minute with {settings.max_concurrent} in flight (0 is unlimited)")
+    return _limiter["limiter"]
@@ -0,0 +1,289 @@
+"""Render dialogues to audio without the Streamlit app.
+
+Run from the repository root:
+
+  python -m diatribe.render test/sample_dialogue.txt saves/knock_knock.zip --output ./render/output
+
+Each input is a `dialogue.txt` in the export format or a project zip (its audio is reused).
+Every input gets its own workspace in `./render/<name>`, so an interrupted batch only synthesizes the missing lines when it is run again.
+Synthesized lines are kept in `./render/cache` and reused by any later render of the same text, voice and settings.
+"""
+import os, sys, json, time, uuid, shutil, hashlib, zipfile, argparse
+import streamlit.config
+import streamlit.logger
+
+# the cached functions warn about the missing Streamlit runtime on every call (the config resets the level when it is parsed)
+streamlit.config.get_config_options()
+streamlit.logger.set_log_level("error")
+
+import diatribe.el_audio as el_audio
+import diatribe.blobs as blobs
+from contextlib import nullcontext
+from dataclasses import dataclass, asdict
+from dotenv import load_dotenv
+from elevenlabs import Voice, set_api_key
+from diatribe.dialogues import Dialogue, build_characters, build_dialogue, convert_dialogue_import_into_data, get_lines
+from diatribe.sidebar import SidebarData
+from diatribe.utils import log
+from diatribe.workspace import Workspace, Progress, ConsoleProgress
+
+RENDER_PATH = "./render"
+DIALOGUE_FILE = "dialogue.txt"
+STATUS_FILE = "status.json"
+
+@dataclass
+class RenderJob:
+  name: str
+  dialogue_text: str
+  project_file: str = None
+
+
+@dataclass
+class RenderStatus:
+  name: str
+  input_file: str
+  state: str = "queued"
+  lines: int = 0
+  synthesized: int = 0
+  cached: int = 0
+  failed: int = 0
+  error: str = None
+  started: float = None
+  finished: float = None
+
+  def save(self, workspace: Workspace) -> None:
+    """Replace the status file of the workspace so readers never see a partial write."""
+    os.makedirs(workspace.path, exist_ok=True)
+    temp_file = f"{workspace.path}/{STATUS_FILE}.{uuid.uuid4()}.tmp"
+    with open(temp_file, "w") as f:
+      json.dump(asdict(self), f, indent=2)
+    os.replace(temp_file, f"{workspace.path}/{STATUS_FILE}")
+
+
+def get_job_name(input_file: str) -> str:
+  return os.path.splitext(os.path.basename(input_file))[0]
+
+
+def load_job(input_file: str) -> RenderJob:
+  """Read the dialogue of a `dialogue.txt` or project zip."""
+  name = get_job_name(input_file)
+  if zipfile.is_zipfile(input_file):
+    with zipfile.ZipFile(input_file) as package:
+      return RenderJob(name, package.read(DIALOGUE_FILE).decode("utf-8"), input_file)
+  with open(input_file, encoding="utf-8") as f:
+    return RenderJob(name, f.read())
+
+
+def prepare_workspace(job: RenderJob, workspace: Workspace, force: bool) -> None:
+  """Keep the audio of the last render of the same dialogue, otherwise start over from the project audio (if any)."""
+  dialogue_file = f"{workspace.path}/{DIALOGUE_FILE}"
+  previous_text = None
+  if os.path.exists(dialogue_file):
+    with open(dialogue_file, encoding="utf-8") as f:
+      previous_text = f.read()
+  if force or previous_text != job.dialogue_text:
+    el_audio.clear_session_audio(workspace)
+    if job.project_file is not None and not force:
+      with zipfile.ZipFile(job.project_file) as package:
+        el_audio.extract_zip_audio(package, el_audio.plan_zip_import(package.namelist(), workspace))
+  os.makedirs(workspace.path, exist_ok=True)
+  with open(dialogue_file, "w", encoding="utf-8") as f:
+    f.write(job.dialogue_text)
+
+
+def get_sidebar_data(args: argparse.Namespace, voices: list[Voice]) -> SidebarData:
+  """Get the speech settings the app would otherwise take from the sidebar."""
+  return SidebarData(
+    el_key=args.api_key,
+    model_id=args.model,
+    voices=voices,
+    voice_names=[v.name for v in voices],
+    enable_instructions=False,
+    enable_audio_editing=False,
+    stability=args.stability,
+    simarlity_boost=args.similarity,
+    style=args.style,
+    openai_api_key=None,
+    openai_model=None,
+    openai_temp=None,
+    openai_max_tokens=None
+  )
+
+
+def get_speech_file(cache_path: str, line: Dialogue, sidebar: SidebarData) -> str:
+  """Get the cache file of the speech for a line with the voice and settings used to synthesize it."""
+  key = json.dumps([line.text, line.character.voice_id, sidebar.model_id, sidebar.stability, sidebar.simarlity_boost, sidebar.style])
+  speech_hash = hashlib.sha1(key.encode("utf-8")).hexdigest()
+  return f"{cache_path}/{speech_hash[:2]}/{speech_hash}.wav"
+
+
+def synthesize_line(
+  line: Dialogue,
+  sidebar: SidebarData,
+  workspace: Workspace,
+  cache_path: str,
+  limiter: any,
+  refresh: bool = False,
+  on_wait: callable = None
+) -> bool:
+  """Synthesize a line (waiting for the limiter) unless it is cached, returning whether it was cached."""
+  speech_file = get_speech_file(cache_path, line, sidebar) if cache_path else None
+  if speech_file is not None and not refresh and os.path.exists(speech_file):
+    blobs.link_or_copy(speech_file, workspace.line_file(line.line))
+    return True
+  with limiter:
+    audio_file = el_audio.generate_and_save(line.text, line.character.voice_id, line.line, sidebar, workspace, on_wait=on_wait)
+  if speech_file is not None:
+    blobs.link_file(audio_file, speech_file)
+  return False
+
+
+def synthesize_lines(
+  dialogue: list[Dialogue],
+  sidebar: SidebarData,
+  workspace: Workspace,
+  status: RenderStatus,
+  cache_path: str = None,
+  limiter: any = None,
+  progress: type[Progress] = ConsoleProgress,
+  refresh: bool = False
+) -> list[Dialogue]:
+  """Synthesize the lines without audio in the workspace, returning the lines that failed."""
+  limiter = limiter or nullcontext()
+  pending = [d for d in dialogue if not os.path.exists(workspace.line_file(d.line))]
+  log(f"synthesizing {len(pending)} of {len(dialogue)} lines")
+  failed = []
+  if len(pending) == 0:
+    return failed
+  synthesizing_bar = progress("Generating audio...")
+  for i, line in enumerate(pending):
+    if line.character.voice_id is None:
+      log(f"voice ID not found for `{line.character.voice}` on line {line.line}")
+      failed.append(line)
+    else:
+      try:
+        if synthesize_line(line, sidebar, workspace, cache_path, limiter, refresh, synthesizing_bar.wait):
+          status.cached += 1
+        else:
+          status.synthesized += 1
+      except Exception as e:
+        log(f"unable to synthesize line {line.line} for {line.character.name} with the voice {line.character.voice}: {e}")
+        failed.append(line)
+    status.failed = len(failed)
+    status.save(workspace)
+    synthesizing_bar.update((i+1) / len(pending))
+  synthesizing_bar.done()
+  return failed
+
+
+def render(
+  job: RenderJob,
+  args: argparse.Namespace,
+  voices: list[Voice],
+  status: RenderStatus,
+  limiter: any = None,
+  progress: type[Progress] = ConsoleProgress
+) -> bool:
+  """Synthesize, join, master and export one dialogue, returning whether it was rendered."""
+  workspace = Workspace(f"{args.workspace}/{job.name}")
+  data = convert_dialogue_import_into_data(job.dialogue_text)
+  characters = build_characters(data["characters"], voices)
+  dialogue = build_dialogue(data["dialogue"], characters)
+  status.lines = len(dialogue)
+  if len(dialogue) == 0:
+    status.error = "the dialogue has no lines"
+    return False
+
+  prepare_workspace(job, workspace, args.force)
+  status.state = "synthesizing"
+  status.save(workspace)
+  cache_path = None if args.no_cache else f"{args.workspace}/cache"
+  failed = synthesize_lines(dialogue, get_sidebar_data(args, voices), workspace, status, cache_path, limiter, progress, args.force)
+  if len(failed) > 0:
+    status.error = f"{len(failed)} lines failed (run it again to retry them)"
+    return False
+
+  lines = get_lines(dialogue)
+  status.state = "joining"
+  status.save(workspace)
+  el_audio.join_audio(lines, args.gap, workspace=workspace, progress=progress)
+  if not args.no_master:
+    status.state = "mastering"
+    status.save(workspace)
+    el_audio.normalize_final_audio(workspace.final_audio_path)
+
+  status.state = "exporting"
+  status.save(workspace)
+  os.makedirs(args.output, exist_ok=True)
+  if args.format in ("mp3", "both"):
+    shutil.copyfile(workspace.final_dialogue_file(), f"{args.output}/{job.name}.mp3")
+  if args.format in ("zip", "both"):
+    with open(f"{args.output}/{job.name}.zip", "wb") as f:
+      el_audio.write_project(f, job.dialogue_text, lines, workspace=workspace)
+  return True
+
+
+def render_file(
+  input_file: str,
+  args: argparse.Namespace,
+  voices: list[Voice],
+  limiter: any = None,
+  progress: type[Progress] = ConsoleProgress
+) -> RenderStatus:
+  """Render one input and record how it went in the status file of its workspace."""
+  status = RenderStatus(get_job_name(input_file), input_file, started=time.time())
+  workspace = Workspace(f"{args.workspace}/{status.name}")
+  log(f"rendering {input_file}")
+  try:
+    rendered = render(load_job(input_file), args, voices, status, limiter, progress)
+  except Exception as e:
+    status.error = str(e)
+    rendered = False
+  status.state = "done" if rendered else "failed"
+  status.finished = time.time()
+  status.save(workspace)
+  if rendered:
+    log(f"rendered {input_file} in {status.finished - status.started:.1f}s")
+  else:
+    log(f"unable to render {input_file}: {status.error}")
+  return status
+
+
+def add_render_arguments(parser: argparse.ArgumentParser) -> None:
+  parser.add_argument("--output", default=f"{RENDER_PATH}/output", help="folder for the rendered files")
+  parser.add_argument("--workspace", default=RENDER_PATH, help="folder for the working audio of each input")
+  parser.add_argument("--format", choices=["mp3", "zip", "both"], default="both", help="export the dialogue mp3, the project zip or both")
+  parser.add_argument("--api-key", default=os.getenv("ELEVENLABS_API_KEY"), help="ElevenLabs API key (defaults to ELEVENLABS_API_KEY)")
+  parser.add_argument("--model", default="eleven_turbo_v2", help="speech model ID")
+  parser.add_argument("--stability", type=float, default=0.35)
+  parser.add_argument("--similarity", type=float, default=0.80, help="clarity + similarity enhancement")
+  parser.add_argument("--style", type=float, default=0.0, help="style exaggeration")
+  parser.add_argument("--gap", type=int, default=200, help="silence between the lines (ms)")
+  parser.add_argument("--no-master", action="store_true", help="skip the audiobook normalization of the joined audio")
+  parser.add_argument("--force", action="store_true", help="synthesize every line again (replacing its cached speech)")
+  parser.add_argument("--no-cache", action="store_true", help="do not reuse or keep synthesized lines in the speech cache")
+
+
+def get_api_voices(args: argparse.Namespace) -> list[Voice]:
+  if not args.api_key:
+    sys.exit("an ElevenLabs API key is required (--api-key or ELEVENLABS_API_KEY)")
+  set_api_key(args.api_key)
+  return el_audio.get_voices()
+
+
+def main() -> None:
+  load_dotenv()
+  parser = argparse.ArgumentParser(description="Render dialogues to audio without the Streamlit app.")
+  parser.add_argument("inputs", nargs="+", help="dialogue.txt files (in the export format) or project zips")
+  add_render_arguments(parser)
+  args = parser.parse_args()
+  voices = get_api_voices(args)
+
+  rendered = sum(render_file(input_file, args, voices).state == "done" for input_file in args.inputs)
+  log(f"rendered {rendered} of {len(args.inputs)} dialogues to {args.output}")
+  if rendered < len(args.inputs):
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -1,43 +1,65 @@
-import os, shutil, glob
+import os, io, glob, zipfile
 import streamlit as st
-from diatribe.dialogues import convert_dialogue_import_into_data
+import diatribe.blobs as blobs
+from diatribe.dialogues import DialogueImportError, convert_dialogue_import_into_data
 from dataclasses import dataclass
-from diatribe.el_audio import import_audio
+from concurrent.futures import ThreadPoolExecutor
+from diatribe.el_audio import AudioMetadata, import_audio_from_zip, link_project_audio, get_audio_metadata, is_project_audio_member
 from diatribe.utils import remove_state
 from diatribe.utils import log
 
+SAMPLE_CACHE_PATH = "./library/saves"
+
 @dataclass
 class SavedDialogueData:
   prepare_project: bool
+  project_download: any
 
-def convert_imported_dialogue(data: bytes) -> dict:
-  uploaded_string = data.decode("utf-8")
-  imported_data = convert_dialogue_import_into_data(uploaded_string)
+@dataclass
+class SampleProject:
+  name: str
+  data: dict
+  members: dict[str, str]
+  metadata: dict[str, AudioMetadata]
+
+def set_imported_dialogue(imported_data: dict) -> None:
   st.session_state["imported_characters"] = imported_data["characters"]
   st.session_state["imported_dialogue"] = imported_data["dialogue"]
   st.session_state["imported_plot"] = imported_data["plot"]  
+
+def convert_imported_dialogue(data: bytes) -> dict:
+  uploaded_string = data.decode("utf-8")
+  imported_data = convert_dialogue_import_into_data(uploaded_string)
+  set_imported_dialogue(imported_data)
   return imported_data
   
-def unzip_package(data: bytes) -> str:
-  # save zip
-  import_path = f"./session/{st.session_state.session_id}/import/package.zip"
-  os.makedirs(os.path.dirname(import_path), exist_ok=True)
-  with open(import_path, "wb") as f:
-    f.write(data)
-  # unzip file
-  unzip_path = f"./session/{st.session_state.session_id}/import/contents"
-  if os.path.exists(unzip_path):
-    shutil.rmtree(unzip_path)
-  os.makedirs(os.path.dirname(unzip_path), exist_ok=True)
-  shutil.unpack_archive(import_path, unzip_path) 
-  return unzip_path 
+@st.cache_resource
+def get_import_executor() -> ThreadPoolExecutor:
+  """Get the background worker that extracts imported project audio (shared by all sessions)."""
+  return ThreadPoolExecutor(max_workers=2, thread_name_prefix="import")
+
+def is_importing_audio() -> bool:
+  return "importing_audio" in st.session_state and not st.session_state["importing_audio"].done()
+
+def wait_for_imported_audio() -> None:
+  """Block until the audio of the last imported project has been extracted."""
+  if "importing_audio" in st.session_state:
+    try:
+      st.session_state["importing_audio"].result()
+    except Exception as e:
+      log(f"unable to extract imported audio: {e}")
+    del st.session_state["importing_audio"]
 
-def import_project(project_path: str) -> None:
-  dialogue_path = f"{project_path}/dialogue.txt"  
-  with open(dialogue_path, "rb") as f:
-    dialogue = f.read()
-  convert_imported_dialogue(dialogue)   
-  imported_audio_files = import_audio(project_path)
+def import_package(data: bytes) -> None:
+  """Import the dialogue of a project zip right away and extract its audio in the background."""
+  wait_for_imported_audio()
+  package = zipfile.ZipFile(io.BytesIO(data))
+  convert_imported_dialogue(package.read("dialogue.txt"))
+  imported_audio_files, extracting = import_audio_from_zip(package, get_import_executor())
+  st.session_state["importing_audio"] = extracting
+  set_imported_audio(imported_audio_files, "final/audio/dialogue.mp3" in package.namelist())
+
+def set_imported_audio(imported_audio_files: list[str], dialogue_included: bool) -> None:
   if len(imported_audio_files) == 0:
     log("No audio files were imported.")
     remove_state("audio_files")
@@ -45,16 +67,54 @@ def import_project(project_path: str) -> None:
     return
   st.session_state["audio_files"] = imported_audio_files
   st.toast("The project has been imported.", icon="👍") 
-  dialogue_included = os.path.exists(f"{project_path}/final/audio/dialogue.mp3")
   if dialogue_included:
     st.session_state["final_audio"] = True
   else:
     remove_state("final_audio")
 
-@st.cache_data
+def cache_sample_project(project_file: str) -> SampleProject:
+  """Extract a sample project into the blob store and precompute its audio metadata."""
+  name = os.path.basename(project_file).replace("_", " ").replace(".zip", "")
+  cache_path = f"{SAMPLE_CACHE_PATH}/{os.path.basename(project_file).replace('.zip', '')}"
+  members = {}
+  metadata = {}
+  with zipfile.ZipFile(project_file) as package:
+    data = convert_dialogue_import_into_data(package.read("dialogue.txt").decode("utf-8"))
+    for member in package.namelist():
+      if not is_project_audio_member(member):
+        continue
+      with package.open(member) as stream:
+        blob_hash = blobs.store_stream(stream)
+      # the cached link keeps the blob referenced while no session uses it
+      blobs.link_blob(blob_hash, f"{cache_path}/{member}")
+      members[member] = blob_hash
+      try:
+        metadata[member] = get_audio_metadata(f"{cache_path}/{member}")
+      except:
+        log(f"unable to read metadata for {member} in {name}")
+  log(f"cached sample project {name}")
+  return SampleProject(name, data, members, metadata)
+
+@st.cache_resource
+def load_sample_projects() -> dict[str, SampleProject]:
+  """Extract and parse the sample projects once per server."""
+  projects = [cache_sample_project(p) for p in sorted(glob.glob("./saves/*.zip"))]
+  return {p.name: p for p in projects}
+
 def sample_project_names() -> list[str]:
-  projects = glob.glob("./saves/*.zip")
-  return [os.path.basename(p).replace("_", " ").replace(".zip", "") for p in projects]
+  return list(load_sample_projects().keys())
+
+def load_sample_project(name: str) -> None:
+  """Load a sample project by linking its cached audio into the session."""
+  wait_for_imported_audio()
+  project = load_sample_projects()[name]
+  set_imported_dialogue({
+    "characters": project.data["characters"].copy(),
+    "dialogue": project.data["dialogue"].copy(),
+    "plot": project.data["plot"]
+  })
+  imported_audio_files = link_project_audio(project.members, project.metadata)
+  set_imported_audio(imported_audio_files, "final/audio/dialogue.mp3" in project.members)
 
 def create_saved_dialogues():
   """Create the saved dialogues section."""
@@ -70,9 +130,7 @@ def create_saved_dialogues():
       )
       submit_sample_project = st.form_submit_button("Load", use_container_width=True)
       if submit_sample_project and selected_save_name:
-        project_path = f"./saves/{selected_save_name.replace(' ', '_')}.zip"
-        unzip_path = unzip_package(open(project_path, "rb").read())
-        import_project(unzip_path)
+        load_sample_project(selected_save_name)
     
     import_tab, export_tab = st.tabs(["Import", "Export"])
     with import_tab:
@@ -81,27 +139,19 @@ def create_saved_dialogues():
         submit_upload_project = st.form_submit_button("Import", use_container_width=True)
         if imported_project and submit_upload_project:
           with st.spinner("Importing project..."):
-            bytes_data = imported_project.getvalue()
-            package_path = unzip_package(bytes_data)
-            import_project(package_path)
+            try:
+              import_package(imported_project.getvalue())
+            except DialogueImportError as e:
+              st.error(f"The project could not be imported because of an error in `dialogue.txt` on {e}")
             
     with export_tab:
       prepare_project=st.button("Prepare Download", use_container_width=True, help="Prepare the dialogue and audio for export")
       
-      download_dialogue_path = f"./session/{st.session_state.session_id}/project/project.zip"
-      if os.path.exists(download_dialogue_path):         
-        with open(download_dialogue_path, "rb") as f:
-          dialogue_downloaded = st.download_button(
-            label="Download", 
-            data=f, 
-            file_name="project.zip", 
-            mime="application/zip",
-            use_container_width=True
-          )
-        if dialogue_downloaded:
-          os.remove(download_dialogue_path)
+      # the archive is built when it is prepared and only kept by the button of that run
+      project_download = st.empty()
         
   return SavedDialogueData(
-    prepare_project
+    prepare_project,
+    project_download
   )
 
@@ -0,0 +1,186 @@
+import os, shutil, time, threading
+import streamlit as st
+import diatribe.blobs as blobs
+from dataclasses import dataclass
+from diatribe.utils import log
+
+SESSION_ROOT = "./session"
+LAST_ACCESS_FILE = ".last_access"
+QUOTA_CHECK_FILE = ".quota_check"
+REGENERABLE_FOLDERS = ["temp", "export", "project", "import", "uploads"]
+
+@dataclass
+class SessionUsage:
+  session_id: str
+  size: int
+  last_access: float
+
+
+@dataclass
+class StorageSettings:
+  session_quota: int
+  storage_quota: int
+  idle_timeout: float
+  collect_interval: float
+  protect_recent: float = 300.0
+  quota_check_interval: float = 30.0
+
+
+def get_storage_settings() -> StorageSettings:
+  """Get the storage quotas (MB) and timeouts (minutes) from the environment."""
+  return StorageSettings(
+    session_quota=int(float(os.getenv("DIATRIBE_SESSION_QUOTA_MB", "500")) * 1024 * 1024),
+    storage_quota=int(float(os.getenv("DIATRIBE_STORAGE_QUOTA_MB", "10240")) * 1024 * 1024),
+    idle_timeout=float(os.getenv("DIATRIBE_SESSION_IDLE_MINUTES", "720")) * 60,
+    collect_interval=float(os.getenv("DIATRIBE_SESSION_COLLECT_MINUTES", "10")) * 60,
+    quota_check_interval=float(os.getenv("DIATRIBE_SESSION_QUOTA_CHECK_SECONDS", "30"))
+  )
+
+
+def get_session_path(session_id: str) -> str:
+  return f"{SESSION_ROOT}/{session_id}"
+
+
+def touch_session(session_id: str) -> None:
+  """Record that the session has been accessed."""
+  session_path = get_session_path(session_id)
+  os.makedirs(session_path, exist_ok=True)
+  with open(f"{session_path}/{LAST_ACCESS_FILE}", "a"):
+    pass
+  os.utime(f"{session_path}/{LAST_ACCESS_FILE}")
+
+
+def get_last_access(session_path: str) -> float:
+  access_file = f"{session_path}/{LAST_ACCESS_FILE}"
+  if os.path.exists(access_file):
+    return os.path.getmtime(access_file)
+  return os.path.getmtime(session_path)
+
+
+def get_folder_size(path: str, include_shared: bool = False) -> int:
+  """Get the size in bytes of the files in a folder, leaving out the hardlinked blobs it shares unless `include_shared` is set."""
+  size = 0
+  for root, _, files in os.walk(path):
+    for file in files:
+      try:
+        stat = os.lstat(os.path.join(root, file))
+      except OSError:
+        continue
+      # shared audio is counted once in the blob store rather than in every session linking it
+      if include_shared or stat.st_nlink == 1:
+        size += stat.st_size
+  return size
+
+
+def get_session_usage(session_id: str) -> SessionUsage:
+  session_path = get_session_path(session_id)
+  return SessionUsage(session_id, get_folder_size(session_path), get_last_access(session_path))
+
+
+def get_sessions_usage() -> list[SessionUsage]:
+  """Get the disk usage of every session, least recently used first."""
+  if not os.path.exists(SESSION_ROOT):
+    return []
+  sessions = []
+  for session_id in os.listdir(SESSION_ROOT):
+    if os.path.isdir(get_session_path(session_id)):
+      try:
+        sessions.append(get_session_usage(session_id))
+      except OSError:
+        pass
+  sessions.sort(key=lambda x: x.last_access)
+  return sessions
+
+
+def get_blob_size() -> int:
+  return get_folder_size(blobs.BLOB_ROOT, include_shared=True)
+
+
+@st.cache_data(ttl=60)
+def get_storage_metrics() -> dict:
+  """Get the disk usage metrics of the session storage."""
+  sessions = get_sessions_usage()
+  settings = get_storage_settings()
+  total = sum(s.size for s in sessions) + get_blob_size()
+  return {
+    "sessions": len(sessions),
+    "total": total,
+    "largest": max((s.size for s in sessions), default=0),
+    "storage_quota": settings.storage_quota,
+    "session_quota": settings.session_quota,
+    "percent": total / settings.storage_quota * 100 if settings.storage_quota else 0
+  }
+
+
+def remove_session(session_id: str) -> None:
+  """Delete everything stored for the session."""
+  log(f"removing session {session_id}")
+  shutil.rmtree(get_session_path(session_id), ignore_errors=True)
+
+
+def check_session_size(session_id: str) -> int:
+  """Get the size of the session, removing its regenerable folders when it is over its quota (measured at most every few seconds)."""
+  settings = get_storage_settings()
+  session_path = get_session_path(session_id)
+  check_file = f"{session_path}/{QUOTA_CHECK_FILE}"
+  # the script reruns on every interaction, so the last size is reused instead of walking the session each time
+  if os.path.exists(check_file) and time.time() - os.path.getmtime(check_file) < settings.quota_check_interval:
+    with open(check_file) as f:
+      size = f.read()
+    if size.isdigit():
+      return int(size)
+  size = get_folder_size(session_path)
+  if size > settings.session_quota:
+    log(f"session {session_id} is over its quota")
+    for folder in REGENERABLE_FOLDERS:
+      size -= get_folder_size(f"{session_path}/{folder}")
+      shutil.rmtree(f"{session_path}/{folder}", ignore_errors=True)
+  os.makedirs(session_path, exist_ok=True)
+  with open(check_file, "w") as f:
+    f.write(str(size))
+  return size
+
+
+def enforce_session_quota(session_id: str) -> bool:
+  """Remove regenerable folders when the session is over its quota and return whether it still is."""
+  return check_session_size(session_id) > get_storage_settings().session_quota
+
+
+def collect_sessions(settings: StorageSettings = None) -> list[str]:
+  """Evict idle sessions and then least recently used sessions until storage is under the quota."""
+  settings = settings or get_storage_settings()
+  now = time.time()
+  sessions = get_sessions_usage()
+  total = sum(s.size for s in sessions) + get_blob_size()
+  evicted = []
+  for session in sessions:
+    idle = now - session.last_access
+    if idle > settings.idle_timeout or (total > settings.storage_quota and idle > settings.protect_recent):
+      remove_session(session.session_id)
+      total -= session.size
+      evicted.append(session.session_id)
+  blobs.collect_blobs()
+  log(f"session storage: {len(sessions) - len(evicted)} sessions, {total / (1024 * 1024):.1f}MB, evicted {len(evicted)}")
+  return evicted
+
+
+def run_session_collector(settings: StorageSettings) -> None:
+  while True:
+    try:
+      collect_sessions(settings)
+    except Exception as e:
+      log(f"session collection failed: {e}")
+    time.sleep(settings.collect_interval)
+
+
+@st.cache_resource
+def start_session_collector() -> threading.Thread:
+  """Start evicting sessions in the background once per server."""
+  collector = threading.Thread(
+    target=run_session_collector,
+    args=(get_storage_settings(),),
+    name="session-collector",
+    daemon=True
+  )
+  collector.start()
+  return collector
@@ -1,9 +1,10 @@
-import os, diatribe.el_audio as el_audio, diatribe.utils as utils, datetime
+import os, diatribe.el_audio as el_audio, diatribe.utils as utils, diatribe.sessions as sessions, datetime
 import streamlit as st
 from elevenlabs import Voice, User, set_api_key
 from dataclasses import dataclass
 from openai import OpenAI
 from streamlit_js_eval import streamlit_js_eval
+from diatribe.timing import timed
 
 @dataclass
 class SidebarData:
@@ -20,7 +21,11 @@ class SidebarData:
   openai_model: str
   openai_temp: float
   openai_max_tokens: int
+  enable_performance: bool = False
+  openai_stream: bool = True
+  openai_pipeline: bool = False
 
+@timed("elevenlabs.usage")
 @st.cache_data(ttl=900)
 def get_usage_percent() -> dict:
   """Get the character usage percent from the Eleven Labs API."""
@@ -72,6 +77,7 @@ def voice_names_with_filter(
       voice_names.append(f"{v.name} ({v.category})" if v.category == "cloned" else v.name)
   return voice_names
 
+@timed("openai.models")
 @st.cache_data
 def get_models(openai_api_key: str) -> list[str]:
   """Get a list of OpenAI models."""
@@ -119,6 +125,11 @@ def create_sidebar() -> SidebarData:
           value=False,
           help="Enable audio editing for each dialogue line. This is disabled by default to increase performance."
         )
+        show_performance = st.toggle(
+          "Show Performance",
+          value=False,
+          help="Show how long each part of the last interaction took."
+        )
                            
         stability = st.slider(
           "Stability", 
@@ -161,10 +172,14 @@ def create_sidebar() -> SidebarData:
           openai_model = st.selectbox("Model", openai_models, index=gpt4_index)
           openai_temp = st.slider("Temperature", 0.0, 1.5, 1.3, 0.1,  help="The higher the temperature, the more creative the text.")
           openai_max_tokens = st.slider("Max Tokens", 1024, 10000, 3072, 1024, help="Check the official documentation on maximum token size for the selected model.")
+          openai_stream = st.toggle("Stream Dialogue", value=True, help="Add the dialogue lines to the table as OpenAI writes them instead of waiting for the whole dialogue.")
+          openai_pipeline = st.toggle("Speak While Writing", value=False, disabled=not openai_stream, help="Generate the audio of each line as soon as OpenAI has written it, so the audio is ready when the dialogue is. Every generated line uses ElevenLabs characters, even if you change it later.")
         else:
           openai_model = None
           openai_temp = None
           openai_max_tokens = None
+          openai_stream = True
+          openai_pipeline = False
       
       
       with st.expander("Voice Explorer"):
@@ -204,9 +219,14 @@ def create_sidebar() -> SidebarData:
         st.markdown(f"**Character Count:** {usage['count']:,}")
         st.markdown(f"**Character Limit:** {usage['limit']:,}")
         st.markdown(f"**Reset:** {usage['reset']}")
+        session_size = sessions.check_session_size(st.session_state.session_id)
+        storage = sessions.get_storage_metrics()
+        st.markdown(f"**Session Storage:** {session_size / (1024 * 1024):,.1f}MB of {storage['session_quota'] / (1024 * 1024):,.0f}MB")
+        st.markdown(f"**Server Storage:** {storage['percent']:.1f}% ({storage['sessions']:,} sessions)")
       
       clear_dialogue = st.button("Clear Dialogue", help=":warning: Clear everything and start over. :warning:", use_container_width=True)
       if clear_dialogue:
+        sessions.remove_session(st.session_state.session_id)
         streamlit_js_eval(js_expressions="parent.window.location.reload()")
         
       return SidebarData( 
@@ -222,7 +242,10 @@ def create_sidebar() -> SidebarData:
         openai_api_key=openai_api_key,
         openai_model=openai_model,
         openai_temp=openai_temp,
-        openai_max_tokens=openai_max_tokens
+        openai_max_tokens=openai_max_tokens,
+        enable_performance=show_performance,
+        openai_stream=openai_stream,
+        openai_pipeline=openai_pipeline and openai_stream
       )
     else:
       return SidebarData(
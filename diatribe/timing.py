@@ -0,0 +1,137 @@
+import os, time, json, threading, functools
+import streamlit as st
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from diatribe.utils import log
+
+TIMING_HISTORY_SIZE = 20
+_state = threading.local()
+
+@dataclass
+class Span:
+  name: str
+  start: float
+  duration: float = 0.0
+  depth: int = 0
+
+
+@dataclass
+class RerunTiming:
+  session_id: str
+  started: float
+  duration: float = 0.0
+  spans: list[Span] = field(default_factory=list)
+  finished: bool = False
+  timestamp: float = field(default_factory=time.time)
+
+  def totals(self) -> dict[str, tuple[int, float]]:
+    """Get the number of calls and total seconds of each span name."""
+    totals = {}
+    for s in self.spans:
+      count, total = totals.get(s.name, (0, 0.0))
+      totals[s.name] = (count + 1, total + s.duration)
+    return totals
+
+
+def get_timing_log() -> str:
+  """Get the path of the JSON lines timing log (timing is only logged if it is set)."""
+  return os.getenv("DIATRIBE_TIMING_LOG")
+
+
+def current_rerun() -> RerunTiming:
+  return getattr(_state, "rerun", None)
+
+
+def write_timing_log(rerun: RerunTiming) -> None:
+  timing_log = get_timing_log()
+  if not timing_log:
+    return
+  try:
+    os.makedirs(os.path.dirname(timing_log) or ".", exist_ok=True)
+    with open(timing_log, "a") as f:
+      f.write(json.dumps(asdict(rerun)) + "\n")
+  except OSError as e:
+    log(f"unable to write timing log: {e}")
+
+
+def finish_rerun() -> RerunTiming:
+  """Finish timing the current rerun, keep it in the session history and write it to the timing log."""
+  rerun = current_rerun()
+  if rerun is None or rerun.finished:
+    return rerun
+  rerun.duration = time.perf_counter() - rerun.started
+  rerun.finished = True
+  history = st.session_state.setdefault("timing_history", [])
+  history.append(rerun)
+  del history[:-TIMING_HISTORY_SIZE]
+  write_timing_log(rerun)
+  return rerun
+
+
+def start_rerun(session_id: str) -> RerunTiming:
+  """Start timing a rerun of the script (finishing the previous one if it was stopped early)."""
+  finish_rerun()
+  _state.rerun = RerunTiming(session_id, time.perf_counter())
+  _state.depth = 0
+  return _state.rerun
+
+
+@contextmanager
+def span(name: str):
+  """Time a block of code as part of the current rerun."""
+  rerun = current_rerun()
+  if rerun is None or rerun.finished:
+    yield
+    return
+  start = time.perf_counter()
+  s = Span(name, start - rerun.started, depth=_state.depth)
+  rerun.spans.append(s)
+  _state.depth += 1
+  try:
+    yield
+  finally:
+    _state.depth -= 1
+    s.duration = time.perf_counter() - start
+
+
+def timed(name: str):
+  """Decorate a function so every call is timed as a span."""
+  def decorator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      with span(name):
+        return func(*args, **kwargs)
+    return wrapper
+  return decorator
+
+
+def get_timing_history() -> list[RerunTiming]:
+  return st.session_state.get("timing_history", [])
+
+
+def create_performance_panel() -> None:
+  """Show the timing of the latest reruns in the sidebar."""
+  history = get_timing_history()
+  with st.sidebar.expander("Performance", expanded=True):
+    if len(history) == 0:
+      st.markdown("No reruns have been timed yet.")
+      return
+    rerun = history[-1]
+    st.markdown(f"**Last Rerun:** {rerun.duration * 1000:,.0f}ms")
+    st.dataframe(
+      [
+        {"Span": name, "Calls": count, "Total (ms)": round(total * 1000, 1)}
+        for name, (count, total) in sorted(rerun.totals().items(), key=lambda x: -x[1][1])
+      ],
+      hide_index=True,
+      use_container_width=True
+    )
+    durations = [r.duration * 1000 for r in history]
+    st.markdown(f"**Last {len(history)} Reruns:** {min(durations):,.0f}ms min, {sum(durations) / len(durations):,.0f}ms mean, {max(durations):,.0f}ms max")
+    st.download_button(
+      "Download Timings",
+      data="\n".join(json.dumps(asdict(r)) for r in history),
+      file_name="timings.jsonl",
+      mime="application/json",
+      use_container_width=True
+    )
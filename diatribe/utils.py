@@ -2,6 +2,7 @@ import re, logging
 import pandas as pd
 import numpy as np
 import streamlit as st
+from streamlit_js_eval import streamlit_js_eval
     
 def extract_name(s: str) -> str:
   """Extract the voice name from the voice name with (cloned) suffix."""
@@ -19,11 +20,13 @@ def get_logger():
   log_level = logging.INFO
   logger = logging.getLogger(__name__)
   logger.setLevel(log_level)
-  handler = logging.StreamHandler()
-  handler.setLevel(log_level)
-  formatter = logging.Formatter("%(levelname)s: %(message)s")
-  handler.setFormatter(formatter)
-  logger.addHandler(handler)
+  # the cache is not kept outside the Streamlit runtime, so only add the handler once
+  if len(logger.handlers) == 0:
+    handler = logging.StreamHandler()
+    handler.setLevel(log_level)
+    formatter = logging.Formatter("%(levelname)s: %(message)s")
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
   return logger
 
 def log(message: str) -> None:
@@ -34,4 +37,14 @@ def log(message: str) -> None:
 
 def remove_state(key: str) -> None:
   if key in st.session_state:
-    del st.session_state[key]
\ No newline at end of file
+    del st.session_state[key]
+
+def rerun_after(seconds: float, key: str) -> None:
+  """Rerun the script after a while, timed by the browser so the script thread is not held while something finishes in the background."""
+  # every run needs a new component, the old one stops its timer when it is removed
+  count = st.session_state.get(f"{key}_reruns", 0) + 1
+  st.session_state[f"{key}_reruns"] = count
+  streamlit_js_eval(
+    js_expressions=f"new Promise(resolve => setTimeout(() => resolve({count}), {int(seconds * 1000)}))",
+    key=f"{key}_rerun_{count}"
+  )
\ No newline at end of file
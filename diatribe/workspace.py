@@ -0,0 +1,110 @@
+import sys
+import streamlit as st
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from diatribe.utils import log
+
+@dataclass
+class Workspace:
+  """The folder holding the audio of one dialogue (a browser session or a batch render)."""
+  path: str
+
+  @property
+  def audio_path(self) -> str:
+    return f"{self.path}/audio"
+
+  @property
+  def final_audio_path(self) -> str:
+    return f"{self.path}/final/audio"
+
+  @property
+  def final_parts_path(self) -> str:
+    return f"{self.path}/final/parts"
+
+  @property
+  def temp_path(self) -> str:
+    return f"{self.path}/temp"
+
+  def line_file(self, line: int) -> str:
+    return f"{self.audio_path}/line{line}.wav"
+
+  def final_dialogue_file(self) -> str:
+    return f"{self.final_audio_path}/dialogue.mp3"
+
+
+def get_session_workspace() -> Workspace:
+  """Get the workspace of the current browser session."""
+  return Workspace(f"./session/{st.session_state.session_id}")
+
+
+class Progress(ABC):
+  """Reports the progress of a long running step (created with the text describing the step)."""
+  @abstractmethod
+  def update(self, fraction: float) -> None:
+    pass
+
+  @abstractmethod
+  def done(self) -> None:
+    pass
+
+  def wait(self, seconds: float) -> None:
+    """Show how long the step has been waiting for a rate limit (0 once it stops waiting)."""
+    pass
+
+
+def get_wait_text(text: str, seconds: float) -> str:
+  return f"{text} (waiting for the rate limit, {seconds:.0f}s)" if seconds > 0 else text
+
+
+class StreamlitProgress(Progress):
+  def __init__(self, text: str) -> None:
+    self.text = text
+    self.fraction = 0.0
+    self.bar = st.progress(0, text=text)
+
+  def update(self, fraction: float) -> None:
+    self.fraction = round(min(max(fraction, 0.0), 1.0), 2)
+    self.bar.progress(self.fraction, text=self.text)
+
+  def wait(self, seconds: float) -> None:
+    self.bar.progress(self.fraction, text=get_wait_text(self.text, seconds))
+
+  def done(self) -> None:
+    self.bar.empty()
+
+
+class ConsoleProgress(Progress):
+  def __init__(self, text: str, width: int = 30) -> None:
+    self.text = text
+    self.width = width
+    self.interactive = sys.stderr.isatty()
+    self.reported = -1
+
+  def update(self, fraction: float) -> None:
+    percent = int(min(max(fraction, 0.0), 1.0) * 100)
+    if self.interactive:
+      filled = int(self.width * percent / 100)
+      sys.stderr.write(f"\r{self.text} [{'#' * filled}{'.' * (self.width - filled)}] {percent}%")
+      sys.stderr.flush()
+    elif percent // 10 > self.reported // 10:
+      log(f"{self.text} {percent}%")
+    self.reported = percent
+
+  def done(self) -> None:
+    if self.interactive:
+      sys.stderr.write("\n")
+
+  def wait(self, seconds: float) -> None:
+    if seconds > 0 and not self.interactive:
+      log(get_wait_text(self.text, seconds))
+
+
+class SilentProgress(Progress):
+  def __init__(self, text: str) -> None:
+    pass
+
+  def update(self, fraction: float) -> None:
+    pass
+
+  def done(self) -> None:
+    pass
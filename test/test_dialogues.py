@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import pytest
+from diatribe.dialogues import generate_dialogue_details, convert_dialogue_details_into_export, convert_dialogue_import_into_data
+
+def export_tables(characters: pd.DataFrame, dialogue: pd.DataFrame, plot: str) -> str:
+  return convert_dialogue_details_into_export(generate_dialogue_details(characters, dialogue, [], plot=plot))
+
+@pytest.mark.parametrize("file", ["test/simple_dialogue.txt", "test/sample_dialogue.txt"])
+def test_sample_round_trip(file: str) -> None:
+  with open(file) as f:
+    imported = convert_dialogue_import_into_data(f.read())
+  exported = export_tables(imported["characters"], imported["dialogue"], imported["plot"])
+  reimported = convert_dialogue_import_into_data(exported)
+  pd.testing.assert_frame_equal(reimported["characters"], imported["characters"], check_dtype=False)
+  pd.testing.assert_frame_equal(reimported["dialogue"], imported["dialogue"])
+  assert reimported["plot"] == imported["plot"]
+
+def test_empty_cells_round_trip() -> None:
+  characters = pd.DataFrame([
+    { "Name": "Ann", "Voice": "Rachel", "Group": np.nan, "Description": None },
+    { "Name": "Bob", "Voice": "Adam", "Group": 2, "Description": "Grumpy" }
+  ], columns=["Name", "Voice", "Group", "Description"])
+  dialogue = pd.DataFrame([
+    { "Speaker": "Ann", "Text": "Hi: there" },
+    { "Speaker": None, "Text": "Nobody" },
+    { "Speaker": "Bob", "Text": "Hello" }
+  ], columns=["Speaker", "Text"])
+  imported = convert_dialogue_import_into_data(export_tables(characters, dialogue, ""))
+  assert list(imported["characters"]["Group"]) == [1, 2]
+  assert list(imported["characters"]["Description"]) == ["", "Grumpy"]
+  assert list(imported["dialogue"]["Text"]) == ["Hi: there", "Hello"]